@@ -0,0 +1,54 @@
+"""
+Reports/sec through the Aggregator with several decoder threads feeding it at
+once, plus the per-queue depth and wait-time stats it keeps.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import aggregator
+
+def produce(queue, n):
+    for i in range(n):
+        report = dict((arfcn, float((arfcn + i) % 40)) for arfcn in range(20, 26))
+        while not queue.put(report):
+            time.sleep(0.001) # a real decoder would just drop it
+
+def run(decoders, n):
+    tmp = tempfile.mkdtemp()
+    try:
+        agg = aggregator.Aggregator(os.path.join(tmp, "gsmws.db"))
+        queues = [agg.register(i) for i in range(decoders)]
+        agg.start()
+        agg.ready.wait()
+        threads = [threading.Thread(target=produce, args=(q, n)) for q in queues]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        agg.stop()
+        elapsed = time.time() - start
+        stats = agg.stats()
+    finally:
+        shutil.rmtree(tmp)
+
+    print("%d decoders: %10.0f reports/sec" % (decoders, decoders * n / elapsed))
+    for i, q in sorted(stats['queues'].items()):
+        print("  queue %d: max depth %4d, full %5d times, wait mean %.2fms max %.2fms"
+              % (i, q['max_depth'], q['dropped'], q['mean_wait_ms'], q['max_wait_ms']))
+    print("  store: %d flushes, %d rows written" % (stats['store']['flushes'],
+                                                  stats['store']['rows_written']))
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for decoders in [1, 2, 4]:
+        run(decoders, n)
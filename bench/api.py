@@ -0,0 +1,163 @@
+"""
+gsmwsd under several clients at once: the old single-threaded
+SimpleXMLRPCServer around a BTS versus api.APIServer. A stand-in BTS takes
+rpc_time for every read (an OpenBTS round trip) and restart_time to
+restart. Clients poll current_arfcn()/is_off() while one of them restarts
+the BTS; we report read throughput and latency. Then a batch of reads as
+separate calls versus one system.multicall, and how soon a wait_reports()
+long-poll hears about a new report compared to polling once a second.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import threading
+import time
+import xmlrpclib
+from SimpleXMLRPCServer import SimpleXMLRPCServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import api, decoder
+
+class StandInBTS(object):
+    def __init__(self, rpc_time=0.005, restart_time=2.0):
+        self.rpc_time = rpc_time
+        self.restart_time = restart_time
+        self.lock = threading.Lock() # one NodeManager socket
+        self.buffer = decoder.MeasurementReportList()
+
+    def _rpc(self):
+        with self.lock:
+            time.sleep(self.rpc_time)
+
+    def current_arfcn(self):
+        self._rpc()
+        return 51
+
+    def is_off(self):
+        self._rpc()
+        return False
+
+    def restart(self):
+        time.sleep(self.restart_time)
+
+    def reports(self):
+        return self.buffer.getall()
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return "http://%s:%d" % server.server_address
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+def clients(url, num_clients, duration):
+    latencies = []
+    lock = threading.Lock()
+    def poll():
+        proxy = xmlrpclib.ServerProxy(url)
+        mine = []
+        end = time.time() + duration
+        while time.time() < end:
+            start = time.time()
+            proxy.current_arfcn()
+            proxy.is_off()
+            mine.append(time.time() - start)
+        with lock:
+            latencies.extend(mine)
+    def restart():
+        time.sleep(duration / 4.0)
+        xmlrpclib.ServerProxy(url, allow_none=True).restart()
+    threads = [threading.Thread(target=poll) for _ in range(num_clients)]
+    threads.append(threading.Thread(target=restart))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies
+
+def run_clients(name, server, num_clients, duration):
+    url = serve(server)
+    latencies = clients(url, num_clients, duration)
+    server.shutdown()
+    server.server_close()
+    print("%-10s %2d clients: %7.0f reads/sec, p50 %7.1fms, p99 %7.1fms, max %7.1fms"
+          % (name, num_clients, 2 * len(latencies) / duration,
+             1000 * percentile(latencies, 0.5), 1000 * percentile(latencies, 0.99),
+             1000 * max(latencies)))
+
+def batching(n):
+    bts = StandInBTS(rpc_time=0.0)
+    server = api.APIServer(api.BTSService(bts, reports=bts.buffer), ("localhost", 0))
+    proxy = xmlrpclib.ServerProxy(serve(server))
+    start = time.time()
+    for _ in range(n):
+        proxy.current_arfcn()
+    separate = time.time() - start
+    start = time.time()
+    multi = xmlrpclib.MultiCall(proxy)
+    for _ in range(n):
+        multi.current_arfcn()
+    results = list(multi())
+    batched = time.time() - start
+    assert results == [51] * n
+    print("%d reads: %.1fms as separate calls, %.1fms in one multicall"
+          % (n, separate * 1000, batched * 1000))
+    server.shutdown()
+    server.server_close()
+
+def following(n, poll_interval):
+    bts = StandInBTS()
+    server = api.APIServer(api.BTSService(bts, reports=bts.buffer), ("localhost", 0))
+    url = serve(server)
+    delays = {'long-poll': [], 'poll %.1fs' % poll_interval: []}
+    sent = {}
+    def long_poll():
+        proxy = xmlrpclib.ServerProxy(url)
+        cursor = 0
+        while cursor < n:
+            res = proxy.wait_reports(cursor, 5.0)
+            cursor = res['cursor']
+            delays['long-poll'].extend(time.time() - sent[r] for r in res['reports'])
+    def poll():
+        # with a cursor of its own, like reports() but without taking them from anyone
+        proxy = xmlrpclib.ServerProxy(url)
+        cursor = 0
+        while cursor < n:
+            res = proxy.wait_reports(cursor, 0)
+            cursor = res['cursor']
+            delays['poll %.1fs' % poll_interval].extend(time.time() - sent[r]
+                                                        for r in res['reports'])
+            time.sleep(poll_interval)
+    threads = [threading.Thread(target=long_poll), threading.Thread(target=poll)]
+    for t in threads:
+        t.start()
+    for i in range(n):
+        time.sleep(0.05)
+        report = "report %d" % i
+        sent[report] = time.time()
+        bts.buffer.put(report)
+    for t in threads:
+        t.join()
+    for name, values in sorted(delays.items()):
+        print("%-10s report->client mean %6.1fms, max %6.1fms"
+              % (name, 1000 * sum(values) / len(values), 1000 * max(values)))
+    server.shutdown()
+    server.server_close()
+
+if __name__ == "__main__":
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 4.0
+    for num_clients in [1, 8, 32]:
+        old = SimpleXMLRPCServer(("localhost", 0), logRequests=False, allow_none=True)
+        old.register_instance(StandInBTS())
+        run_clients("old", old, num_clients, duration)
+        bts = StandInBTS()
+        service = api.BTSService(bts, reports=bts.buffer)
+        run_clients("APIServer", api.APIServer(service, ("localhost", 0)), num_clients, duration)
+    batching(100)
+    following(40, 1.0)
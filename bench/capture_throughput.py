@@ -0,0 +1,75 @@
+"""
+Compare the tshark text path against decoding GSMTAP ourselves.
+
+This only measures our side of each pipeline: for the tshark path that's
+framing and regex-parsing its dissection, for the GSMTAP path it's decoding
+the packet. tshark's own capture and dissection cost comes on top of the
+former, and is the bigger half of the bill on a busy site.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import gsm
+
+TSHARK_HEADER = """GSM TAP Header, ARFCN: 51 (Uplink), TS: 0, Channel: SDCCH/4 (0)
+    Version: 2
+    Header Length: 16 bytes
+    Payload Type: GSM Um (MS<->BTS) (1)
+    Time Slot: 0
+    ..0. .... .... .... = Uplink: 1
+    .... ..00 0011 0011 = ARFCN: 51
+    Signal/Noise Ratio (dB): 0
+    Signal Level (dBm): 0
+    GSM Frame Number: 0
+    Channel Type: SDCCH/4 (7)
+    Antenna Number: 0
+    Sub-Slot: 0
+"""
+
+def tshark_messages(n):
+    # one GSMTAP header and one measurement report per packet, as tshark -V
+    # would print them
+    report = gsm.MeasurementReport.sample().lstrip("\n") + "\n"
+    return [TSHARK_HEADER, report] * n
+
+def gsmtap_packets(n):
+    lapdm = b"\x00\x00\x01\x03" + bytearray([(18 << 2) | 1])
+    payload = bytes(lapdm) + gsm.MeasurementReport.sample_bytes()
+    packet = gsm.encode_gsmtap(51, gsm.GSMTAP_CHANNEL_SDCCH4 | gsm.GSMTAP_CHANNEL_ACCH,
+                               payload, uplink=True)
+    return [packet] * n
+
+def run_tshark(messages, last_arfcns):
+    current_arfcn = None
+    for message in messages:
+        if message.startswith("GSM TAP Header"):
+            current_arfcn = gsm.GSMTAP(message).arfcn
+        elif message.startswith("GSM A-I/F DTAP - Measurement Report"):
+            gsm.MeasurementReport(last_arfcns, current_arfcn, message)
+
+def run_gsmtap(packets, last_arfcns):
+    for packet in packets:
+        gsmtap = gsm.GSMTAP(packet, parser="binary")
+        pd, msg_type = gsmtap.message_type()
+        if pd == gsm.RR_PROTOCOL and msg_type == gsm.RR_MEASUREMENT_REPORT:
+            gsm.MeasurementReport(last_arfcns, gsmtap.arfcn, gsmtap.l3(), parser="binary")
+
+def timed(name, func, data, last_arfcns, n):
+    start = time.time()
+    func(data, last_arfcns)
+    elapsed = time.time() - start
+    print("%-8s %8d reports in %6.3fs: %10.0f reports/sec" % (name, n, elapsed, n / elapsed))
+    return elapsed
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    last_arfcns = gsm.SystemInformationTwo(gsm.SystemInformationTwo.sample()).arfcns
+    text = timed("tshark", run_tshark, tshark_messages(n), last_arfcns, n)
+    binary = timed("gsmtap", run_gsmtap, gsmtap_packets(n), last_arfcns, n)
+    print("speedup: %.1fx (excluding tshark itself)" % (text / binary))
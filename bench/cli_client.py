@@ -0,0 +1,82 @@
+"""
+OpenBTS CLI latency: BTS's old fork-per-command path (a shell piping into
+OpenBTSDo) versus cli.CLIClient's persistent socket, one command at a time
+and pipelined. A thread stands in for OpenBTS's command socket, and a small
+Python script for OpenBTSDo (the real one is C, so we also time a plain
+`echo | cat` as a floor for the fork path; neither includes sudo).
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import envoy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import cli
+
+OPENBTSDO = """
+import socket, sys, os
+path = "/tmp/OpenBTSDo.%d" % os.getpid()
+s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+s.bind(path)
+s.sendto(sys.stdin.read().strip().encode(), sys.argv[1])
+sys.stdout.write(s.recv(10000).decode())
+os.unlink(path)
+"""
+
+class CommandSocket(threading.Thread):
+    def __init__(self, path):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(path)
+
+    def run(self):
+        while True:
+            cmd, addr = self.sock.recvfrom(10000)
+            if cmd.startswith(b"txatten "):
+                reply = b"TX attenuation set to " + cmd.split()[1] + b" dB"
+            else:
+                reply = b"command not found"
+            self.sock.sendto(reply, addr)
+
+def timed(name, func, n, per_call=1):
+    start = time.time()
+    for _ in range(n):
+        func()
+    elapsed = time.time() - start
+    print("%-28s %9.3fms per command" % (name, elapsed * 1000 / (n * per_call)))
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, "command")
+        CommandSocket(path).start()
+        openbtsdo = os.path.join(tmp, "openbtsdo.py")
+        with open(openbtsdo, "w") as f:
+            f.write(OPENBTSDO)
+
+        r = cli.CLIResult("txatten 10", envoy.run("echo 'txatten 10' | %s %s %s"
+                                                  % (sys.executable, openbtsdo, path)).std_out)
+        assert r.ok, r.output
+        assert not cli.CLIClient(path).command("warble").ok
+
+        timed("fork: echo | cat", lambda: envoy.run("echo 'txatten 10' | cat"), n)
+        timed("fork: echo | OpenBTSDo.py", lambda: envoy.run("echo 'txatten 10' | %s %s %s"
+                                                          % (sys.executable, openbtsdo, path)), n)
+        client = cli.CLIClient(path)
+        timed("persistent", lambda: client.command("txatten 10").check(), n * 10)
+        timed("persistent, pipeline of 10", lambda: client.pipeline(["txatten 10"] * 10), n, 10)
+        print(client.stats())
+        client.close()
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,80 @@
+"""
+NodeManager config reads with and without bts.ConfigCache. A local REP
+socket stands in for OpenBTS's NodeManager; we make the calls the
+controller makes per report (is_off() and current_arfcn()) and count round
+trips.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import json
+import os
+import sys
+import threading
+import time
+
+import openbts
+import zmq
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import bts
+
+ADDRESS = "tcp://127.0.0.1:45061"
+
+CONFIG = {"CLI.SocketPath": "/var/run/command",
+          "Peering.NeighborTable.Path": "/var/run/NeighborTable.db",
+          "TRX.RadioFrequencyOffset": "128",
+          "GSM.Radio.C0": "51",
+          "GSM.Neighbors": "",
+          "TRX.TxAttenOffset": "0"}
+
+class NodeManager(threading.Thread):
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.socket = zmq.Context.instance().socket(zmq.REP)
+        self.socket.bind(ADDRESS)
+        self.requests = 0
+
+    def run(self):
+        while True:
+            req = json.loads(self.socket.recv())
+            self.requests += 1
+            entry = lambda k: {"key": k, "value": CONFIG[k], "defaultValue": CONFIG[k]}
+            if req["action"] == "update":
+                CONFIG[req["key"]] = req["value"]
+                res = {"code": 204}
+            elif req["key"] == "":
+                res = {"code": 200, "data": dict((k, entry(k)) for k in CONFIG)}
+            else:
+                res = {"code": 200, "data": entry(req["key"])}
+            self.socket.send(json.dumps(res))
+
+def per_report(read, n):
+    for _ in range(n):
+        int(read("TRX.TxAttenOffset")) > 90
+        int(read("GSM.Radio.C0"))
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    nm = NodeManager()
+    nm.start()
+    client = openbts.OpenBTS(address=ADDRESS)
+
+    start = time.time()
+    per_report(lambda key: client.read_config(key).data['value'], n)
+    elapsed = time.time() - start
+    print("uncached: %5d reports %7.1fms, %5d RPCs, %.0fus per RPC"
+          % (n, elapsed * 1000, nm.requests, 1e6 * elapsed / nm.requests))
+
+    nm.requests = 0
+    cache = bts.ConfigCache(client, bts.BTS.CONFIG_TTLS)
+    start = time.time()
+    cache.prefetch()
+    per_report(cache.value, n)
+    cache.update("GSM.Radio.C0", 52) # change_arfcn invalidates
+    per_report(cache.value, n)
+    elapsed = time.time() - start
+    print("cached:   %5d reports %7.1fms, %5d RPCs, %s"
+          % (2 * n, elapsed * 1000, nm.requests, cache.stats()))
@@ -0,0 +1,94 @@
+"""
+PhysicalStatus ingestion: EventDecoder's old one recv() and json.loads() per
+message versus draining the socket in batches and decoding each batch at
+once. A PUB socket queues up a burst of events; we time how long each way
+takes to turn them into buffered CompactReports.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import json
+import os
+import sys
+import time
+
+import zmq
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import decoder, gsm
+
+ENDPOINT = "tcp://127.0.0.1:45199"
+
+def event(i):
+    return json.dumps({"name": "PhysicalStatus", "timestamp": 1400000000 + i,
+                       "data": {"imsi": "IMSI001010000000%03d" % (i % 1000),
+                                "channel": "SDCCH-4-%d" % (i % 4),
+                                "measurement": {"RXLEV_FULL_SERVING_CELL_dBm": -60 - i % 20,
+                                                "RXQUAL_FULL_SERVING_CELL_BER": 0,
+                                                "neighbors": [{"ARFCN": 20 + 10 * n,
+                                                               "RXLEV_NCELL_dBm": -70 - n,
+                                                               "BSIC_NCELL": n} for n in range(5)]}}})
+
+def burst(n):
+    context = zmq.Context.instance()
+    pub = context.socket(zmq.PUB)
+    pub.setsockopt(zmq.SNDHWM, n + 1)
+    pub.bind(ENDPOINT)
+    return pub
+
+def old_way(sub, n, current_arfcn):
+    reports = decoder.MeasurementReportList(n)
+    for _ in range(n):
+        msg = sub.recv()
+        report = gsm.physical_status_report(json.loads(msg), current_arfcn)
+        if report is not None:
+            reports.put(report)
+    return reports
+
+def batched(ed, n):
+    while ed.received < n:
+        ed.socket.poll(1000)
+        ed.ingest(ed.drain())
+    return ed.reports
+
+def run(n, batch):
+    messages = [event(i) for i in range(n)]
+
+    pub = burst(n)
+    ed = decoder.EventDecoder(ENDPOINT, maxlen=n, decode=True, hwm=n + 1, batch=batch)
+    ed.current_arfcn = 10
+    time.sleep(0.5) # let the subscription get to the publisher
+    for msg in messages:
+        pub.send(msg)
+    time.sleep(0.5)
+    start = time.time()
+    reports = batched(ed, n)
+    new_time = time.time() - start
+    assert len(reports) == n, len(reports)
+    stats = ed.stats()
+    ed.socket.close()
+
+    sub = zmq.Context.instance().socket(zmq.SUB)
+    sub.setsockopt(zmq.RCVHWM, n + 1)
+    sub.connect(ENDPOINT)
+    sub.setsockopt(zmq.SUBSCRIBE, b"")
+    time.sleep(0.5)
+    for msg in messages:
+        pub.send(msg)
+    time.sleep(0.5)
+    start = time.time()
+    old_reports = old_way(sub, n, 10)
+    old_time = time.time() - start
+    sub.close()
+    pub.close()
+
+    assert sorted(old_reports.getall()[0].items()) == sorted(reports.getall()[0].items())
+    print("%d events: recv+loads each %8.0f msgs/sec | batch %4d %8.0f msgs/sec (%s)"
+          % (n, n / old_time, batch, n / new_time, stats))
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for batch in [1, 100, 500]:
+        for _ in range(3):
+            run(n, batch)
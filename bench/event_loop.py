@@ -0,0 +1,67 @@
+"""
+Detection latency: how long a report waits before the controller looks at
+it, with the old sleep-and-poll loop versus events.EventLoop. Reports arrive
+at random times from another thread, like the Aggregator publishing them.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import events
+
+def arrivals(n, mean_gap, deliver):
+    for _ in range(n):
+        time.sleep(random.expovariate(1.0 / mean_gap))
+        deliver(time.time())
+
+def summarize(name, latencies):
+    latencies = sorted(latencies)
+    print("%-12s mean %8.2fms  p50 %8.2fms  max %8.2fms" %
+          (name, 1000 * sum(latencies) / len(latencies),
+           1000 * latencies[len(latencies) // 2], 1000 * latencies[-1]))
+
+def polling(n, mean_gap, sleep):
+    lock = threading.Lock()
+    pending = []
+    def deliver(arrived):
+        with lock:
+            pending.append(arrived)
+    producer = threading.Thread(target=arrivals, args=(n, mean_gap, deliver))
+    producer.start()
+    latencies = []
+    while producer.is_alive() or pending:
+        with lock:
+            seen, pending[:] = list(pending), []
+        now = time.time()
+        latencies.extend(now - arrived for arrived in seen)
+        time.sleep(sleep)
+    summarize("poll %.1fs" % sleep, latencies)
+
+def evented(n, mean_gap):
+    latencies = []
+    def on_notify(pending):
+        now = time.time()
+        latencies.extend(now - arrived for arrived in pending.values())
+        if len(latencies) == n:
+            loop.stop()
+    loop = events.EventLoop(on_notify)
+    producer = threading.Thread(target=arrivals,
+                                args=(n, mean_gap, lambda arrived: loop.notify(0, arrived)))
+    producer.start()
+    loop.run()
+    loop.close()
+    summarize("event loop", latencies)
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    mean_gap = 0.1
+    polling(n, mean_gap, 1.0)
+    polling(n, mean_gap, 0.2)
+    evented(n, mean_gap)
@@ -0,0 +1,84 @@
+"""
+Many BTS on one host: an EventDecoder thread (and zmq.Context) per BTS
+versus one EventMultiplexer. Each of N publishers sends a burst of
+PhysicalStatus events; we time how long until every report is buffered, and
+count threads.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import threading
+import time
+
+import zmq
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import decoder
+from event_ingest import event
+
+BASE_PORT = 45300
+
+def publishers(n, per_bts):
+    context = zmq.Context.instance()
+    pubs = []
+    for i in range(n):
+        pub = context.socket(zmq.PUB)
+        pub.setsockopt(zmq.SNDHWM, per_bts + 1)
+        pub.bind("tcp://127.0.0.1:%d" % (BASE_PORT + i))
+        pubs.append(pub)
+    return pubs
+
+def send(pubs, messages):
+    for msg in messages:
+        for pub in pubs:
+            pub.send(msg)
+
+def wait_for(sources, total):
+    while sum(s.received for s in sources) < total:
+        time.sleep(0.001)
+
+def run(n, per_bts, mode):
+    messages = [event(i) for i in range(per_bts)]
+    pubs = publishers(n, per_bts)
+    hosts = ["tcp://127.0.0.1:%d" % (BASE_PORT + i) for i in range(n)]
+    threads_before = threading.active_count()
+    if mode == "threads":
+        sources = [decoder.EventDecoder(host, maxlen=per_bts, decode=True, hwm=per_bts + 1)
+                   for host in hosts]
+        for s in sources:
+            s.daemon = True
+            s.start()
+    else:
+        mux = decoder.EventMultiplexer(poll_timeout=100)
+        sources = [mux.subscribe(host, maxlen=per_bts, decode=True, hwm=per_bts + 1)
+                   for host in hosts]
+        mux.start()
+    threads = threading.active_count() - threads_before
+    time.sleep(0.5) # let subscriptions reach the publishers
+
+    start = time.time()
+    send(pubs, messages)
+    wait_for(sources, n * per_bts)
+    elapsed = time.time() - start
+
+    if mode == "threads":
+        for s in sources:
+            s.stop()
+        for s in sources:
+            s.join()
+    else:
+        mux.stop()
+        mux.join()
+    for pub in pubs:
+        pub.close()
+    assert all(len(s.reports) == per_bts for s in sources)
+    print("%3d BTS, %-11s %3d threads: %8.0f msgs/sec" % (n, mode, threads, n * per_bts / elapsed))
+
+if __name__ == "__main__":
+    per_bts = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    for n in [2, 8, 32]:
+        run(n, per_bts, "threads")
+        run(n, per_bts, "multiplexer")
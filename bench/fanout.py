@@ -0,0 +1,56 @@
+"""
+How long healthy BTS units wait on one that's restarting. Each of N units
+gets a control action (one config read's worth of work, 20ms); unit 0 is
+restarting and its action takes 2s. We time how long until every healthy
+unit's action is done, running them one at a time as HandoverController
+used to, and on a fanout.UnitPool.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import events, fanout
+
+RESTART = 2.0
+ACTION = 0.02
+
+def action(unit):
+    time.sleep(RESTART if unit == 0 else ACTION)
+
+def serial(n):
+    start = time.time()
+    done = []
+    for unit in range(n):
+        action(unit)
+        if unit != 0:
+            done.append(time.time() - start)
+    return max(done)
+
+def pooled(n, workers):
+    loop = events.EventLoop()
+    pool = fanout.UnitPool(loop, workers)
+    done = []
+    start = time.time()
+    def finished(result, error, unit):
+        if unit != 0:
+            done.append(time.time() - start)
+            if len(done) == n - 1:
+                loop.stop()
+    for unit in range(n):
+        pool.submit(unit, "action", action, (unit,),
+                    callback=lambda result, error, unit=unit: finished(result, error, unit))
+    loop.run()
+    loop.close()
+    pool.close()
+    return max(done)
+
+if __name__ == "__main__":
+    for n in [2, 8, 32]:
+        print("%2d BTS: serial %7.0fms | pool of 4 %7.0fms | pool of 8 %7.0fms"
+              % (n, 1000 * serial(n), 1000 * pooled(n, 4), 1000 * pooled(n, 8)))
@@ -0,0 +1,145 @@
+"""
+Fleet sync against local stand-in gsmwsd nodes (api.APIServer over a
+report buffer that a thread fills with PhysicalStatus events at rate
+reports/sec). First the naive way, a fresh connection per call asking each
+node for current_arfcn() and then draining reports(); then
+fleet.FleetAggregator's keep-alive multicall delta sync. For each we report
+bytes, connections and calls per node, and how long the oldest report in
+each sync took to get from the node's buffer to the merged view. Nodes,
+producers and aggregator all share one interpreter here, so past a few
+thousand reports/sec in total this measures the GIL rather than the sync.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import xmlrpclib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import api, decoder, fleet
+
+class StandInNode(object):
+    """ A BTS as far as api.BTSService cares, with a thread making reports """
+    def __init__(self, arfcn, rate, seed):
+        self.arfcn = arfcn
+        self.rate = rate
+        self.buffer = decoder.MeasurementReportList()
+        self.random = random.Random(seed)
+        self.stopped = threading.Event()
+        self.service = api.BTSService(self, reports=self.buffer)
+        self.server = api.APIServer(self.service, ("localhost", 0))
+        self.url = "http://%s:%d" % self.server.server_address
+        self.connections = 0
+        process_request = self.server.process_request
+        def counting(request, client_address):
+            self.connections += 1
+            process_request(request, client_address)
+        self.server.process_request = counting
+        for target in [self.server.serve_forever, self.produce]:
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+
+    def current_arfcn(self):
+        return self.arfcn
+
+    def reports(self):
+        return self.buffer.getall()
+
+    def event(self):
+        neighbors = [{"ARFCN": a, "RXLEV_NCELL_dBm": self.random.randint(-110, -50),
+                      "BSIC_NCELL": self.random.randint(0, 63)}
+                     for a in self.random.sample(range(1, 124), 6)]
+        return json.dumps({"name": "PhysicalStatus", "timestamp": time.time(),
+                           "data": {"imsi": "IMSI001010000000%03d" % self.random.randint(0, 999),
+                                    "measurement": {"RXLEV_FULL_SERVING_CELL_dBm": -60,
+                                                    "RXQUAL_FULL_SERVING_CELL_BER": 0,
+                                                    "neighbors": neighbors}}})
+
+    def produce(self):
+        while not self.stopped.is_set():
+            self.buffer.put_many([self.event() for _ in range(max(1, int(self.rate / 10)))])
+            self.stopped.wait(0.1)
+
+    def stop(self):
+        self.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+def naive(nodes, duration, interval):
+    """ Every interval, a new connection for each call to each node """
+    transports = dict((n.url, fleet.CountingTransport()) for n in nodes)
+    occupancy = fleet.Occupancy()
+    calls, latencies, reports = 0, [], 0
+    end = time.time() + duration
+    while time.time() < end:
+        for n in nodes:
+            t = transports[n.url]
+            t._connection = (None, None) # what a plain ServerProxy does, one per call
+            arfcn = xmlrpclib.ServerProxy(n.url, transport=t).current_arfcn()
+            t._connection = (None, None)
+            raw = xmlrpclib.ServerProxy(n.url, transport=t).reports()
+            calls += 2
+            got = fleet.Node(n.url, limit=1).decode(raw, arfcn)
+            occupancy.merge(n.url, arfcn, got)
+            if got:
+                latencies.append(time.time() - min(r.timestamp for r in got))
+            reports += len(got)
+        time.sleep(interval)
+    return {'reports': reports, 'calls': calls,
+            'bytes_out': sum(t.sent for t in transports.values()),
+            'bytes_in': sum(t.received for t in transports.values()),
+            'latencies': latencies}
+
+def delta(nodes, duration, interval, workers):
+    f = fleet.FleetAggregator([n.url for n in nodes], interval=interval, workers=workers)
+    main = threading.Thread(target=f.main)
+    main.start()
+    time.sleep(duration)
+    f.stop()
+    main.join()
+    stats = f.stats()
+    latency = f.loop.stats().get('report_to_merge', {})
+    return {'reports': sum(s['reports'] for s in stats.values()),
+            'calls': sum(s['syncs'] for s in stats.values()),
+            'bytes_out': sum(s['bytes_out'] for s in stats.values()),
+            'bytes_in': sum(s['bytes_in'] for s in stats.values()),
+            'lag_reports': max(s['lag_reports'] for s in stats.values()),
+            'latency': latency,
+            'arfcns': len(f.view())}
+
+def run(num_nodes, rate, duration, interval=1.0, workers=8):
+    nodes = [StandInNode(10 + i, rate, i) for i in range(num_nodes)]
+    res = naive(nodes, duration, interval)
+    conns = sum(n.connections for n in nodes)
+    lat = sorted(res['latencies']) or [0]
+    print("%3d nodes, %4d reports/s each, naive: %6d reports, %5.1f calls/node, %4.1f conns/node, "
+          "%7.0f B/s in per node, report->view mean %5.0fms max %5.0fms"
+          % (num_nodes, rate, res['reports'], res['calls'] / float(num_nodes),
+             conns / float(num_nodes), res['bytes_in'] / duration / num_nodes,
+             1000 * sum(lat) / len(lat), 1000 * lat[-1]))
+    for n in nodes:
+        n.stop()
+    # fresh nodes, so there's no backlog from the naive run to catch up on
+    nodes = [StandInNode(10 + i, rate, i) for i in range(num_nodes)]
+    res = delta(nodes, duration, interval, workers)
+    conns = sum(n.connections for n in nodes)
+    print("%3d nodes, %4d reports/s each, delta: %6d reports, %5.1f calls/node, %4.1f conns/node, "
+          "%7.0f B/s in per node, report->view mean %5.0fms max %5.0fms, lag %d, %d ARFCNs"
+          % (num_nodes, rate, res['reports'], res['calls'] / float(num_nodes),
+             conns / float(num_nodes), res['bytes_in'] / duration / num_nodes,
+             res['latency'].get('mean_ms', 0), res['latency'].get('max_ms', 0),
+             res['lag_reports'], res['arfcns']))
+    for n in nodes:
+        n.stop()
+
+if __name__ == "__main__":
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    for num_nodes, rate in [(4, 50), (16, 50), (64, 50), (16, 200)]:
+        run(num_nodes, rate, duration)
@@ -0,0 +1,131 @@
+"""
+Compare GSMDecoder's old line-by-line framing against gsm.MessageFramer on
+synthetic tshark -V output.
+
+Besides lines/sec we count string allocations and bytes copied per message
+delivered to process(). The old loop builds each message with += on an
+attribute, which copies the whole message on every line; the framer
+allocates one string per line (from split) plus one join per message it
+keeps.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import gsm
+
+PACKET_HEADERS = """Frame 1: 81 bytes on wire (648 bits), 81 bytes captured (648 bits) on interface 0
+    Interface id: 0 (any)
+    Encapsulation type: Linux cooked-mode capture (25)
+    Arrival Time: Jan  1, 2014 00:00:00.000000000 PST
+    Epoch Time: 1388563200.000000000 seconds
+    Frame Number: 1
+    Frame Length: 81 bytes (648 bits)
+    Capture Length: 81 bytes (648 bits)
+    Protocols in frame: sll:ip:udp:gsmtap:gsm_a_dtap
+Linux cooked capture
+    Packet type: Unicast to us (0)
+    Link-layer address type: 772
+    Link-layer address length: 6
+    Protocol: IPv4 (0x0800)
+Internet Protocol Version 4, Src: 127.0.0.1 (127.0.0.1), Dst: 127.0.0.1 (127.0.0.1)
+    Version: 4
+    Header length: 20 bytes
+    Total Length: 65
+    Time to live: 64
+    Protocol: UDP (17)
+User Datagram Protocol, Src Port: 53075 (53075), Dst Port: 4729 (4729)
+    Source port: 53075 (53075)
+    Destination port: 4729 (4729)
+    Length: 45
+GSM TAP Header, ARFCN: 51 (Uplink), TS: 0, Channel: SDCCH/4 (0)
+    Version: 2
+    Header Length: 16 bytes
+    Payload Type: GSM Um (MS<->BTS) (1)
+    .... ..00 0011 0011 = ARFCN: 51
+    Channel Type: SDCCH/4 (7)
+GSM SACCH
+    L1 Header
+        .... .000 = Ordered MS power level: 0
+        0000 0000 = Actual Timing Advance: 0
+Link Access Procedure, Channel Dm (LAPDm)
+    Address Field: 0x01
+    Control field: U, func=UI (0x03)
+    Length Field: 0x49
+"""
+
+def tshark_output(n):
+    report = gsm.MeasurementReport.sample().lstrip("\n") + "\n"
+    return (PACKET_HEADERS + report + "\n") * n
+
+class LegacyFramer(object):
+    """ GSMDecoder.run's framing loop before MessageFramer """
+    def __init__(self, stream):
+        self.stream = stream
+        self.current_message = ""
+        self.messages = 0
+        self.lines = 0
+        self.allocations = 0
+        self.copied = 0
+
+    def run(self, count=False):
+        for line in self.stream:
+            self.lines += 1
+            if line.startswith("    "):
+                self.current_message += "%s" % line
+                if count:
+                    # the line, the "%s" result and the new message
+                    self.allocations += 3
+                    self.copied += len(self.current_message)
+            else:
+                self.process(self.current_message)
+                self.current_message = line
+                if count:
+                    self.allocations += 1
+
+    def process(self, message):
+        self.messages += 1
+
+def run_legacy(text):
+    framer = LegacyFramer(io.StringIO(text))
+    start = time.time()
+    framer.run()
+    elapsed = time.time() - start
+
+    counted = LegacyFramer(io.StringIO(text))
+    counted.run(count=True)
+    relevant = text.count("GSM TAP Header") + text.count("Measurement Report\n")
+    return elapsed, framer.lines, framer.messages, counted.allocations, counted.copied, relevant
+
+def run_framer(text):
+    framer = gsm.MessageFramer(io.StringIO(text))
+    copied = 0
+    start = time.time()
+    for message in framer:
+        pass
+    elapsed = time.time() - start
+    for message in gsm.MessageFramer(io.StringIO(text)):
+        copied += len(message)
+    # one string per line from split, plus one join per message kept
+    allocations = framer.lines + framer.messages
+    return elapsed, framer.lines, framer.messages, allocations, copied, framer.messages
+
+def report(name, elapsed, lines, messages, allocations, copied, delivered):
+    print("%-8s %9.0f lines/sec  %7d messages framed  %7d delivered  "
+          "%6.1f allocs/msg  %8.0f bytes copied/msg"
+          % (name, lines / elapsed, messages, delivered,
+             allocations / float(delivered), copied / float(delivered)))
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    text = tshark_output(n)
+    if not isinstance(text, type(u"")):
+        text = text.decode("ascii")
+    report("legacy", *run_legacy(text))
+    report("framer", *run_framer(text))
@@ -0,0 +1,102 @@
+"""
+RSSI history: history.HistoryStore versus the obvious alternative, a
+SQLite table of (ARFCN, TIMESTAMP, RSSI) rows indexed on ARFCN and time.
+We write hours of synthetic reports (each covering a few ARFCNs, as
+measurement reports do) into both, then compare append rate, bytes per
+reading, and how long it takes to read one ARFCN's last hour (and, from
+the store's rollups, its whole history).
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import history
+
+def reports(hours, rate, per_report=7, seed=1):
+    rand = random.Random(seed)
+    start = time.time() - hours * 3600
+    for i in range(int(hours * 3600 * rate)):
+        arfcns = rand.sample(range(1, 124), per_report)
+        yield start + i / float(rate), dict((a, rand.randint(0, 63)) for a in arfcns)
+
+def du(path):
+    # blocks actually allocated: segments are sparse until they're written
+    return sum(os.stat(os.path.join(d, f)).st_blocks * 512
+               for d, _, files in os.walk(path) for f in files)
+
+def timed(func, n=20):
+    start = time.time()
+    for _ in range(n):
+        res = func()
+    return (time.time() - start) / n, res
+
+def run(hours, rate):
+    tmp = tempfile.mkdtemp(prefix="gsmws-bench")
+    data = list(reports(hours, rate))
+    readings = sum(len(r) for _, r in data)
+
+    store = history.HistoryStore(os.path.join(tmp, "history"))
+    start = time.time()
+    for ts, report in data:
+        store.append_report(report, ts)
+    store.close()
+    store_time = time.time() - start
+
+    db = sqlite3.connect(os.path.join(tmp, "history.db"))
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE HISTORY (ARFCN INTEGER, TIMESTAMP REAL, RSSI INTEGER)")
+    db.execute("CREATE INDEX HISTORY_ARFCN_TIME ON HISTORY (ARFCN, TIMESTAMP)")
+    start = time.time()
+    batch = []
+    for ts, report in data:
+        batch.extend((a, ts, v) for a, v in report.items())
+        if len(batch) >= 5000:
+            db.executemany("INSERT INTO HISTORY VALUES (?, ?, ?)", batch)
+            db.commit()
+            batch = []
+    db.executemany("INSERT INTO HISTORY VALUES (?, ?, ?)", batch)
+    db.commit()
+    sqlite_time = time.time() - start
+    db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    print("%g hours at %d reports/s, %d readings:" % (hours, rate, readings))
+    print("  append:  store %8.0f readings/s   sqlite %8.0f readings/s (batched commits)"
+          % (readings / store_time, readings / sqlite_time))
+    print("  on disk: store %8.1f bytes/reading sqlite %8.1f bytes/reading (store bound %dMB)"
+          % (du(os.path.join(tmp, "history")) / float(readings),
+             os.path.getsize(os.path.join(tmp, "history.db")) / float(readings),
+             store.max_disk() // 2**20))
+
+    end = data[-1][0]
+    reader = history.HistoryStore(os.path.join(tmp, "history"))
+    t, res = timed(lambda: reader.query(51, end - 3600, end, "raw"))
+    st, rows = timed(lambda: db.execute("SELECT TIMESTAMP, RSSI FROM HISTORY WHERE ARFCN=? "
+                                        "AND TIMESTAMP>=? AND TIMESTAMP<?",
+                                        (51, end - 3600, end)).fetchall())
+    assert len(rows) == len(res['time'])
+    print("  last hour of one ARFCN (%d samples): store %.2fms  sqlite %.2fms"
+          % (len(rows), t * 1000, st * 1000))
+    for tier in ["1m", "1h"]:
+        t, res = timed(lambda: reader.query(51, end - hours * 3600 - 3600, end, tier))
+        print("  whole history of one ARFCN from %s (%d samples): store %.2fms"
+              % (tier, len(res['time']), t * 1000))
+    t, rows = timed(lambda: db.execute("SELECT MIN(RSSI), MAX(RSSI), AVG(RSSI), COUNT(*) FROM "
+                                       "HISTORY WHERE ARFCN=? GROUP BY CAST(TIMESTAMP / 60 AS INT)",
+                                       (51,)).fetchall(), n=5)
+    print("  per-minute rollup of one ARFCN computed by sqlite (%d rows): %.2fms"
+          % (len(rows), t * 1000))
+    db.close()
+    shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 6
+    run(hours, 10)
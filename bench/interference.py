@@ -0,0 +1,81 @@
+"""
+Interference detection cost per tick: HandoverController's old scan of every
+buffered report (with an is_off() config read per hit) versus
+interference.InterferenceDetector seeing each report once.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import gsm, interference
+
+class FakeBTS(object):
+    def __init__(self, id_num, arfcn, off):
+        self.id_num = id_num
+        self.current_arfcn = arfcn
+        self.off = off
+        self.config_reads = 0
+
+    def is_off(self):
+        self.config_reads += 1
+        return self.off
+
+def make_reports(n):
+    rand = random.Random(4)
+    reports = []
+    for _ in range(n):
+        strengths = dict((arfcn, rand.randint(0, 20)) for arfcn in rand.sample([20, 30, 40, 50, 60, 70], 5))
+        reports.append(gsm.CompactReport(strengths))
+    return reports
+
+def old(bts_units, reports):
+    to_restart = set()
+    arfcn_to_bts = dict(zip([b.current_arfcn for b in bts_units], [b for b in bts_units]))
+    for r in reports:
+        for t in r:
+            if t in arfcn_to_bts:
+                # the debug log line called is_off() too
+                arfcn_to_bts[t].is_off()
+                if r[t] > 10 and arfcn_to_bts[t].is_off():
+                    to_restart |= set([arfcn_to_bts[t],])
+    return to_restart
+
+def streaming(detector, bts_units, reports):
+    for bts in bts_units:
+        detector.refresh(bts) # once per tick, as HandoverController.tick does
+    to_restart = set()
+    for r in reports:
+        to_restart.update(detector.observe(r))
+    return to_restart
+
+def run(n):
+    reports = make_reports(n)
+    bts_units = [FakeBTS(0, 20, False), FakeBTS(1, 30, True)]
+    start = time.time()
+    res = old(bts_units, reports)
+    old_time = time.time() - start
+    old_reads = sum(b.config_reads for b in bts_units)
+
+    bts_units = [FakeBTS(0, 20, False), FakeBTS(1, 30, True)]
+    detector = interference.InterferenceDetector(threshold=10)
+    for b in bts_units:
+        detector.watch(b, b.current_arfcn)
+    start = time.time()
+    new_res = streaming(detector, bts_units, reports)
+    new_time = time.time() - start
+    new_reads = sum(b.config_reads for b in bts_units)
+
+    assert set(b.id_num for b in res) == set(b.id_num for b in new_res)
+    print("%6d reports/tick: old %8.2fms %6d config reads | streaming %8.2fms %2d config reads, "
+          "%d restart decisions" % (n, old_time * 1000, old_reads, new_time * 1000, new_reads,
+                                    detector.restarts))
+
+if __name__ == "__main__":
+    for n in [100, 1000, 10000]:
+        run(n)
@@ -0,0 +1,45 @@
+"""
+What the hot-path metrics cost: time per counter inc() and histogram
+observe(), the decoder's per-message cost with them in, and how long a
+/metrics scrape takes to render once a replay has filled the registry.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import metrics, replay
+import replay as replay_bench
+
+def per_call(name, stmt, setup, n=200000):
+    best = min(timeit.repeat(stmt, setup, number=n, repeat=3))
+    print("%-28s %6.2fus" % (name, best * 1e6 / n))
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    setup = ("from gsmws import metrics\n"
+             "r = metrics.Registry()\n"
+             "c = r.counter('c_total', 'c', ['x']).labels('a')\n"
+             "h = r.histogram('h_seconds', 'h', ['x']).labels('a')\n"
+             "m = r.counter('m_total', 'm', ['x'])\n")
+    per_call("counter inc()", "c.inc()", setup)
+    per_call("counter labels().inc()", "m.labels('a').inc()", setup)
+    per_call("histogram observe()", "h.observe(0.0003)", setup)
+
+    tmp = tempfile.mkdtemp(prefix="gsmws-bench")
+    path = os.path.join(tmp, "gsmtap.rec")
+    replay_bench.gsmtap_recording(path, n)
+    stats = replay.ReplayHarness(path).run()
+    print("gsmtap replay, instrumented  %8.0f msgs/sec" % stats['msgs_per_sec'])
+    os.remove(path)
+    os.rmdir(tmp)
+
+    text = metrics.REGISTRY.text()
+    best = min(timeit.repeat(metrics.REGISTRY.text, number=100, repeat=3))
+    print("scrape: %d metrics, %d lines, %d bytes, %.2fms to render"
+          % (len(metrics.REGISTRY.metrics), text.count("\n"), len(text), best * 10))
@@ -0,0 +1,64 @@
+"""
+End-to-end throughput of the decoder, aggregator and controller, from
+synthetic recordings played back as fast as the pipeline takes them (see
+replay.ReplayHarness). Record a live BTS with scripts/GSMWSReplay to run the
+same thing on real traffic.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import gsm, replay
+
+TSHARK_HEADER = "GSM TAP Header, ARFCN: 51 (Uplink), TS: 0, Channel: SDCCH/4 (0)\n    Version: 2\n"
+
+def tshark_recording(path, n, rate=1000.0):
+    sysinfo = ("GSM CCCH - System Information Type 2\n" +
+               "".join("    %s\n" % line for line in
+                       gsm.SystemInformationTwo.sample().strip("\n").split("\n")))
+    report = gsm.MeasurementReport.sample().lstrip("\n") + "\n"
+    writer = replay.RecordingWriter(path)
+    writer.write(replay.TSHARK, TSHARK_HEADER + sysinfo, 0.0)
+    for i in range(n):
+        writer.write(replay.TSHARK, TSHARK_HEADER + report, i / rate)
+    writer.close()
+
+def gsmtap_recording(path, n, rate=1000.0):
+    sysinfo = gsm.encode_gsmtap(51, gsm.GSMTAP_CHANNEL_BCCH,
+                                b"\x59" + gsm.SystemInformationTwo.sample_bytes())
+    lapdm = b"\x00\x00\x01\x03" + bytes(bytearray([(18 << 2) | 1]))
+    report = gsm.encode_gsmtap(51, gsm.GSMTAP_CHANNEL_SDCCH4 | gsm.GSMTAP_CHANNEL_ACCH,
+                               lapdm + gsm.MeasurementReport.sample_bytes(), uplink=True)
+    writer = replay.RecordingWriter(path)
+    writer.write(replay.GSMTAP, sysinfo, 0.0)
+    for i in range(n):
+        writer.write(replay.GSMTAP, report, i / rate)
+    writer.close()
+
+def run(name, make, n, speed):
+    tmp = tempfile.mkdtemp(prefix="gsmws-bench")
+    path = os.path.join(tmp, name + ".rec")
+    make(path, n)
+    stats = replay.ReplayHarness(path, speed=speed).run()
+    latencies = stats['latencies'].get('report_to_update', {})
+    print("%-6s %6d msgs at %s: %8.0f msgs/sec %8.0f reports/sec, %d dropped, "
+          "queue wait %.2fms (max %.2fms), report->update %.2fms (max %.2fms), "
+          "behind %.0fms, peak RSS %dKB"
+          % (name, stats['messages'], "%gx" % speed if speed else "max speed",
+             stats['msgs_per_sec'], stats['reports_per_sec'], stats['queue']['dropped'],
+             stats['queue']['mean_wait_ms'], stats['queue']['max_wait_ms'],
+             latencies.get('mean_ms', 0.0), latencies.get('max_ms', 0.0),
+             stats['behind_ms'], stats['peak_rss_kb']['after']))
+    os.remove(path)
+    os.rmdir(tmp)
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for speed in [0, 10]:
+        run("tshark", tshark_recording, n, speed)
+        run("gsmtap", gsmtap_recording, n, speed)
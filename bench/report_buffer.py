@@ -0,0 +1,82 @@
+"""
+Several consumers reading the same reports: the old MeasurementReportList
+(a deque that getall() swaps out, so each consumer needs its own copy of
+every report) versus the ring buffer with one cursor per consumer. Reports
+go in in batches, like EventSource.ingest(), and every consumer reads after
+each batch. Then one consumer that only reads every tenth batch, to check
+what it's told it missed.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import collections
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import decoder
+
+class OldList(object):
+    """ MeasurementReportList as it was """
+    def __init__(self, maxlen=10000):
+        self.lock = threading.Lock()
+        self.maxlen = maxlen
+        self.reports = collections.deque(maxlen=maxlen)
+        self.evicted = 0
+
+    def put_many(self, reports):
+        with self.lock:
+            self.evicted += max(0, len(self.reports) + len(reports) - self.maxlen)
+            self.reports.extend(reports)
+
+    def getall(self):
+        with self.lock:
+            reports, self.reports = self.reports, collections.deque(maxlen=self.maxlen)
+        return list(reports)
+
+def old_way(batches, consumers):
+    lists = [OldList() for _ in range(consumers)]
+    seen = 0
+    start = time.time()
+    for batch in batches:
+        for l in lists:
+            l.put_many(batch)
+        for l in lists:
+            seen += len(l.getall())
+    return time.time() - start, seen
+
+def ring(batches, consumers):
+    buf = decoder.MeasurementReportList()
+    cursors = [buf.cursor() for _ in range(consumers)]
+    seen = 0
+    start = time.time()
+    for batch in batches:
+        buf.put_many(batch)
+        for c in cursors:
+            seen += len(c.read())
+    return time.time() - start, seen
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    batch = 100
+    batches = [[{51: -70, 61: -80}] * batch for _ in range(n // batch)]
+    for consumers in [1, 2, 4, 8]:
+        for name, func in [("old", old_way), ("ring", ring)]:
+            elapsed, seen = func(batches, consumers)
+            assert seen == n * consumers
+            print("%-4s %d consumers: %8.0f reports/sec in, %5.2fus per report read"
+                  % (name, consumers, n / elapsed, elapsed * 1e6 / seen))
+
+    buf = decoder.MeasurementReportList(500)
+    fast, slow = buf.cursor(), buf.cursor()
+    got = 0
+    for i, b in enumerate(batches[:1000]):
+        buf.put_many(b)
+        fast.read()
+        if i % 10 == 9:
+            got += len(slow.read())
+    print("slow consumer: read %d, missed %d, of %d (fast consumer missed %d)"
+          % (got, slow.missed, 1000 * batch, fast.missed))
@@ -0,0 +1,49 @@
+"""
+Memory held by 10,000 buffered reports, as dicts (what GSMDecoder used to
+keep) and as gsm.CompactReports.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import gsm
+
+def deep_size(obj, seen):
+    """ sys.getsizeof over obj and everything it holds, counting each once """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif hasattr(obj, "__slots__"):
+        for name in obj.__slots__:
+            size += deep_size(getattr(obj, name), seen)
+    return size
+
+def reports(n, current_arfcn):
+    SI2 = gsm.SystemInformationTwo
+    MR = gsm.MeasurementReport
+    last_arfcns = SI2(SI2.sample()).arfcns
+    return [MR(last_arfcns, current_arfcn, MR.sample()) for _ in range(n)]
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    # Five neighbors, with our own ARFCN either among them (as in the
+    # sample) or not (as when Controller picks five unscanned neighbors).
+    for current_arfcn, label in [(51, "5 ARFCNs"), (20, "6 ARFCNs")]:
+        mrs = reports(n, current_arfcn)
+        as_dicts = [r.current_strengths for r in mrs]
+        as_compact = [gsm.CompactReport.from_report(r) for r in mrs]
+        assert all(dict(c.items()) == d for c, d in zip(as_compact, as_dicts))
+        for name, items in [("dict", as_dicts), ("compact", as_compact)]:
+            # shared objects (small ints, constants) are only counted once
+            seen = set()
+            total = sum(deep_size(item, seen) for item in items)
+            print("%-8s %-8s %8.1f KiB per %d reports (%.0f bytes/report)"
+                  % (label, name, total / 1024.0, n, total / float(n)))
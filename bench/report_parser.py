@@ -0,0 +1,43 @@
+"""
+Measurement Report parser micro-benchmark. (tests/test_gsm.py checks that
+the parsers agree.)
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import gsm
+
+MR = gsm.MeasurementReport
+SI2 = gsm.SystemInformationTwo
+
+NEIGHBOR = """
+        ..01 0001 = RXLEV-NCELL: %d
+        0001 0... = BCCH-FREQ-NCELL: %d
+        .... .000  010. .... = BSIC-NCELL: %d"""
+
+def three_neighbors():
+    # sample() with two more neighbor cells reported. BSICs stay single digit,
+    # since parse() only keeps the first digit.
+    text = MR.sample().replace("result (1)", "result (3)")
+    return text + NEIGHBOR % (30, 0, 5) + NEIGHBOR % (42, 4, 3)
+
+def timed(parser, message, last_arfcns, current_arfcn, n):
+    start = time.time()
+    for _ in range(n):
+        MR(last_arfcns, current_arfcn, message, parser=parser)
+    elapsed = time.time() - start
+    print("%-6s %10.0f reports/sec" % (parser, n / elapsed))
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    last_arfcns = SI2(SI2.sample()).arfcns
+    current_arfcn = 23
+    for parser in ["regex", "scan"]:
+        timed(parser, three_neighbors(), last_arfcns, current_arfcn, n)
+    timed("binary", MR.sample_bytes(), last_arfcns, current_arfcn, n)
@@ -0,0 +1,88 @@
+"""
+Compare GSMDecoder's old deque-based RSSI bookkeeping with
+estimator.RSSIEstimator on a stream of random reports: check they give the
+same averages, then time a report update plus an rssi() read.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import collections
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "gsmws"))
+from gsmws import estimator
+
+class DequeRSSI(object):
+    """ The bookkeeping GSMDecoder did before RSSIEstimator """
+    def __init__(self, maxlen=100):
+        self.maxlen = maxlen
+        self.max_strengths = {}
+        self.recent_strengths = {}
+
+    def update(self, strengths):
+        for arfcn in strengths:
+            value = strengths[arfcn]
+            if arfcn not in self.max_strengths or value > self.max_strengths[arfcn]:
+                self.max_strengths[arfcn] = value
+            if arfcn in self.recent_strengths:
+                self.recent_strengths[arfcn].append(value)
+            else:
+                self.recent_strengths[arfcn] = collections.deque([value], maxlen=self.maxlen)
+        for arfcn in [a for a in self.max_strengths if a not in strengths]:
+            del self.max_strengths[arfcn]
+            del self.recent_strengths[arfcn]
+
+    def rssis(self):
+        res = {}
+        for arfcn in self.max_strengths:
+            tot = self.max_strengths[arfcn] + sum(self.recent_strengths[arfcn])
+            res[arfcn] = float(tot) / (1 + len(self.recent_strengths[arfcn]))
+            # rssi() also computed this for the db on every call
+            sum(self.recent_strengths[arfcn]) / float(len(self.recent_strengths[arfcn]))
+        return res
+
+def reports(n, arfcns):
+    rand = random.Random(1)
+    res = []
+    for i in range(n):
+        # switch neighbor lists now and then, like the controller does
+        if i % 5000 == 0:
+            current = rand.sample(arfcns, 6)
+        res.append(dict((a, rand.choice([-0.001, rand.randint(0, 63)])) for a in current))
+    return res
+
+def timed(name, rssi, reports):
+    start = time.time()
+    for report in reports:
+        rssi.update(report)
+        rssi.rssis()
+    elapsed = time.time() - start
+    print("%-10s %10.0f reports/sec" % (name, len(reports) / elapsed))
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    stream = reports(n, list(range(1, 125)))
+
+    old, new = DequeRSSI(), estimator.RSSIEstimator()
+    for report in stream:
+        old.update(report)
+        new.update(report)
+        a, b = old.rssis(), new.rssis()
+        assert sorted(a) == sorted(b)
+        assert all(abs(a[k] - b[k]) < 1e-9 for k in a), (a, b)
+    averages = new.averages()
+    assert all(abs(averages[k] - b[k]) < 1e-9 for k in b)
+    print("estimator matches deque sums on %d reports" % n)
+
+    timed("deque", DequeRSSI(), stream)
+    timed("estimator", estimator.RSSIEstimator(), stream)
+
+    start = time.time()
+    for _ in range(10000):
+        new.averages()
+    print("averages() for all ARFCNs: %.1f us" % ((time.time() - start) * 100))
@@ -0,0 +1,79 @@
+"""
+How long the handover controller takes to revalidate the whole band:
+random.sample over unscanned ARFCNs (the old pick_new_neighbors) versus
+scheduler.ScanScheduler, with several BTS units cycling neighbors.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import channels, scheduler
+
+SCAN_RANGE = range(1, 124)
+CYCLE = 14400 # NEIGHBOR_CYCLE_TIME
+PER_BTS = 4 # scan slots per BTS
+
+def simulate(num_bts, picker, cycles):
+    """
+    Each cycle every BTS gets PER_BTS channels to scan, and reports on
+    them come in over the cycle. Returns the cycle at which every channel
+    had been scanned at least once, how many scans were wasted on a
+    channel another BTS was scanning at the same time, and the largest
+    gap between scans of one channel after it was first seen.
+    """
+    last = {}
+    gap = 0
+    duplicates = 0
+    full = None
+    for cycle in range(cycles):
+        now = cycle * CYCLE
+        picks = [picker(b, now) for b in range(num_bts)]
+        seen = set()
+        for p in picks:
+            duplicates += len(seen & set(p))
+            seen |= set(p)
+        for arfcn in seen:
+            if arfcn in last:
+                gap = max(gap, now - last[arfcn])
+            last[arfcn] = now
+        if full is None and len(last) == len(SCAN_RANGE):
+            full = cycle + 1
+    return full, duplicates, gap / float(CYCLE)
+
+def run(num_bts, cycles=200):
+    rand = random.Random(7)
+    state = channels.ChannelState(SCAN_RANGE)
+    pending = {}
+    def old(bts, now):
+        if bts == 0:
+            # reports on last cycle's picks only arrive over the cycle
+            state.update(pending, now)
+            pending.clear()
+            state.expire(now - 4*CYCLE)
+        k = min(PER_BTS, len(state.unscanned))
+        picked = state.pick_unscanned(k, rand=rand)
+        pending.update((a, rand.randint(-5, 20)) for a in picked)
+        return picked
+    old_full, old_dup, old_gap = simulate(num_bts, old, cycles)
+
+    sched = scheduler.ScanScheduler(SCAN_RANGE, window=CYCLE * 4)
+    def new(bts, now):
+        picked = sched.assign(bts, PER_BTS)
+        sched.observe(dict((a, rand.randint(-5, 20)) for a in picked), now + CYCLE)
+        return picked
+    new_full, new_dup, new_gap = simulate(num_bts, new, cycles)
+    cov = sched.coverage(cycles * CYCLE)
+
+    print("%2d BTS: random full band after %s cycles, %3d duplicate scans, worst gap %5.1f cycles | "
+          "scheduler %s cycles, %d duplicates, worst gap %5.1f cycles, %.1f channels/hour"
+          % (num_bts, old_full, old_dup, old_gap, new_full, new_dup, new_gap,
+             cov['verified_per_hour']))
+
+if __name__ == "__main__":
+    for n in [1, 2, 8]:
+        run(n)
@@ -0,0 +1,92 @@
+"""
+BTS.set_neighbors called the way the controllers call it: over and over,
+with the neighbor list only changing now and then. Compares the old
+write-everything-every-time version with the diffing one, counting
+NodeManager RPCs and NeighborTable rows written. The NodeManager stand-in
+is the one from config_cache.py.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import datetime
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import openbts
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import bts
+from config_cache import NodeManager, ADDRESS
+
+def neighbor_table(path):
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE NEIGHBOR_TABLE (IPADDRESS TEXT UNIQUE NOT NULL, UPDATED INTEGER, "
+               "HOLDOFF INTEGER DEFAULT 0, C0 INTEGER, BSIC INTEGER)")
+    db.executemany("INSERT INTO NEIGHBOR_TABLE (IPADDRESS) VALUES (?)",
+                   [("127.0.10.%d:16001" % (i + 10),) for i in range(5)])
+    db.commit()
+    return db
+
+def old_set_neighbors(b, arfcns, real=[]):
+    """ set_neighbors before it diffed, minus the logging """
+    fake_neighbors = {}
+    for i in range(0, len(arfcns)):
+        fake_neighbors[arfcns[i]] = "127.0.10.%d:16001" % (i + 10,)
+    neighbor_string = ("%s %s" % (" ".join(real), " ".join(fake_neighbors.values()))).strip()
+    try:
+        b.node_manager.update_config("GSM.Neighbors", neighbor_string)
+    except openbts.exceptions.InvalidResponseError:
+        pass
+    updated = int(datetime.datetime.now().strftime("%s"))
+    rows = 0
+    for arfcn, ip in fake_neighbors.iteritems():
+        rows += b.neighbor_table.execute("UPDATE NEIGHBOR_TABLE SET C0 = ?, UPDATED = ?, HOLDOFF = ?, "
+                                         "BSIC = ? WHERE IPADDRESS = ?;",
+                                         (arfcn, updated, 3600*24*7, 1, ip)).rowcount
+    b.neighbor_table.commit()
+    return rows
+
+def make_bts(tmp, name):
+    b = bts.BTS.__new__(bts.BTS)
+    b.node_manager = openbts.OpenBTS(address=ADDRESS)
+    b.config = bts.ConfigCache(b.node_manager, bts.BTS.CONFIG_TTLS)
+    b.neighbor_table = neighbor_table(os.path.join(tmp, name))
+    b.neighbors = []
+    b.neighbor_calls = b.neighbor_config_writes = b.neighbor_config_skipped = 0
+    b.neighbor_rows_written = b.neighbor_rows_skipped = 0
+    return b
+
+def workload(n):
+    # a new set of 5 neighbors every 100 calls
+    return [[20 + (i // 100) % 50 + k for k in range(5)] for i in range(n)]
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    nm = NodeManager()
+    nm.start()
+    tmp = tempfile.mkdtemp()
+    try:
+        calls = workload(n)
+
+        b = make_bts(tmp, "old.db")
+        start = time.time()
+        rows = sum(old_set_neighbors(b, arfcns) for arfcns in calls)
+        elapsed = time.time() - start
+        print("old:  %d calls %7.1fms, %5d RPCs, %5d rows written"
+              % (n, elapsed * 1000, nm.requests, rows))
+
+        nm.requests = 0
+        b = make_bts(tmp, "new.db")
+        start = time.time()
+        for arfcns in calls:
+            b.set_neighbors(arfcns)
+        elapsed = time.time() - start
+        print("diff: %d calls %7.1fms, %5d RPCs, %s"
+              % (n, elapsed * 1000, nm.requests, b.neighbor_stats()))
+    finally:
+        shutil.rmtree(tmp)
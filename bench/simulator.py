@@ -0,0 +1,63 @@
+"""
+HandoverController scaling with the number of cells, on simulator.Simulator
+instead of radios. Each run puts interference on one cell's ARFCN, runs the
+controller for a while with every cell's events read by one
+EventMultiplexer, and reports what it got through.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import controller, decoder, simulator
+
+def run(num_bts, duration, base_port, handsets=8):
+    tmp = tempfile.mkdtemp(prefix="gsmws-bench")
+    sim = simulator.Simulator(num_bts, handsets=handsets, report_interval=0.48, base_port=base_port,
+                              seed=1)
+    sim.start()
+    mux = decoder.EventMultiplexer(loglvl=logging.WARNING)
+    mux.start()
+    c = controller.HandoverController(sim.bts_confs(mux), 5, 1, 10, os.path.join(tmp, "gsmws.db"),
+                                      loglvl=logging.WARNING, workers=8, deadline=10)
+    c.IGNORE_TIME = 1
+    main = threading.Thread(target=c.main)
+    main.daemon = True
+    main.start()
+
+    time.sleep(duration / 2.0)
+    # interfere with cell 0 while it's warbled off, so the controller has to notice
+    c.by_decoder[0].start_time = c.by_decoder[0].start_time.min
+    sim.set_interference(sim.nodes[0].arfcn, -70)
+    time.sleep(duration / 2.0)
+    c.loop.stop()
+    main.join()
+
+    queues = c.aggregator.stats()['queues']
+    latencies = c.loop.stats()
+    units = c.units.stats()
+    enqueued = sum(q['enqueued'] for q in queues.values())
+    dropped = sum(q['dropped'] for q in queues.values())
+    update = latencies.get('report_to_update', {})
+    print("%3d BTS: %6d reports sent, %6d applied (%5.0f/s), %d dropped, report->update %.1fms "
+          "(max %.1fms), %d restarts, %d late BTS actions"
+          % (num_bts, sim.stats()['reports'], enqueued, enqueued / float(duration), dropped,
+             update.get('mean_ms', 0.0), update.get('max_ms', 0.0), sim.stats()['restarts'],
+             sum(u.get('late', 0) for u in units.values())))
+    c.shutdown()
+    for bts in c.bts_units:
+        bts.decoder.stop()
+    mux.stop()
+    sim.close()
+
+if __name__ == "__main__":
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for i, n in enumerate([2, 8, 24, 48]):
+        run(n, duration, 46000 + 200*i)
@@ -0,0 +1,73 @@
+"""
+Reports/sec that GSMDecoder's persistence can sustain, committing every
+report's changes as they're made (about what GSMDecoder used to do) versus
+write-behind with group commit, against a scratch gsmws.db.
+
+This file is part of GSMWS.
+"""
+from __future__ import print_function
+
+import datetime
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "gsmws"))
+from gsmws import estimator, persist
+
+def make_db():
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    store = persist.WriteBehindStore(path, threading.Lock(), wal=False)
+    store.db.execute("CREATE TABLE MAX_STRENGTHS (TIMESTAMP TEXT NOT NULL, ARFCN INTEGER, RSSI REAL)")
+    store.db.execute("CREATE TABLE AVG_STRENGTHS (TIMESTAMP TEXT NOT NULL, ARFCN INTEGER, RSSI REAL, COUNT INTEGER)")
+    store.db.commit()
+    store.close()
+    return path
+
+def apply(store, rssi, strengths):
+    # the writes GSMDecoder.update_strength() makes for one report
+    now = datetime.datetime.now()
+    for arfcn in strengths:
+        if arfcn not in rssi or strengths[arfcn] > rssi.max(arfcn):
+            store.put("MAX_STRENGTHS", arfcn, (now, arfcn, strengths[arfcn]))
+    for arfcn in rssi.arfcns():
+        if arfcn not in strengths:
+            store.delete("MAX_STRENGTHS", arfcn)
+            store.delete("AVG_STRENGTHS", arfcn)
+    rssi.update(strengths)
+    for arfcn in rssi.arfcns():
+        store.put("AVG_STRENGTHS", arfcn, (now, arfcn, rssi.mean(arfcn), rssi.count(arfcn)))
+    store.maybe_flush()
+
+def run(name, n, **options):
+    path = make_db()
+    store = persist.WriteBehindStore(path, threading.Lock(), **options)
+    store.start()
+    rssi = estimator.RSSIEstimator()
+    rand = random.Random(1)
+    arfcns = rand.sample(range(1, 125), 6)
+    start = time.time()
+    for i in range(n):
+        apply(store, rssi, dict((a, rand.randint(0, 63)) for a in arfcns))
+    store.close()
+    elapsed = time.time() - start
+    stats = store.stats()
+    print("%-22s %8.0f reports/sec  %6d flushes  %7d rows written  %7d coalesced  "
+          "flush mean %.2fms max %.2fms"
+          % (name, n / elapsed, stats['flushes'], stats['rows_written'],
+             stats['rows_coalesced'], stats['mean_flush_ms'], stats['max_flush_ms']))
+    os.unlink(path)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.unlink(path + suffix)
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    run("per-report FULL", n, flush_interval=0, wal=False, synchronous="FULL")
+    run("write-behind WAL FULL", n, flush_interval=1.0, synchronous="FULL")
+    run("write-behind WAL NORMAL", n, flush_interval=1.0, synchronous="NORMAL")
@@ -0,0 +1,333 @@
+"""
+This file is part of GSMWS.
+"""
+
+import Queue
+import datetime
+import logging
+import threading
+import time
+
+import estimator
+import history
+import metrics
+import persist
+
+QUEUE_DEPTH = metrics.REGISTRY.gauge("gsmws_queue_depth", "Items waiting in a queue or buffer",
+                                     ["queue"])
+QUEUE_DROPPED = metrics.REGISTRY.counter("gsmws_queue_dropped_total",
+                                         "Items dropped because a queue was full", ["queue"])
+
+class ReportQueue(object):
+    """
+    A bounded queue of reports from one decoder to the Aggregator. put() never
+    blocks: if the aggregator has fallen that far behind, the report is
+    dropped and counted instead.
+    """
+    def __init__(self, decoder_id, aggregator, maxsize=1000):
+        self.decoder_id = decoder_id
+        self.aggregator = aggregator
+        self.queue = Queue.Queue(maxsize)
+        self.lock = threading.Lock()
+        self.enqueued = 0
+        self.dequeued = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        name = "aggregator_%s" % decoder_id
+        QUEUE_DEPTH.labels(name).set_function(self.queue.qsize)
+        self.dropped_metric = QUEUE_DROPPED.labels(name)
+
+    def put(self, report):
+        try:
+            self.queue.put_nowait((time.time(), report))
+        except Queue.Full:
+            with self.lock:
+                self.dropped += 1
+            self.dropped_metric.inc()
+            return False
+        with self.lock:
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+        self.aggregator.wakeup.set()
+        return True
+
+    def drain(self, limit):
+        """
+        Pull up to limit reports off the queue (aggregator thread only).
+        Returns them along with when the first of them was queued.
+        """
+        reports = []
+        now = time.time()
+        first = None
+        waited = 0.0
+        longest = 0.0
+        while len(reports) < limit:
+            try:
+                queued_at, report = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            if first is None:
+                first = queued_at
+            wait = now - queued_at
+            waited += wait
+            longest = max(longest, wait)
+            reports.append(report)
+        if reports:
+            with self.lock:
+                self.dequeued += len(reports)
+                self.wait_time += waited
+                self.max_wait_time = max(self.max_wait_time, longest)
+        return reports, first
+
+    def stats(self):
+        with self.lock:
+            return {'depth': self.queue.qsize(),
+                    'max_depth': self.max_depth,
+                    'enqueued': self.enqueued,
+                    'dropped': self.dropped,
+                    'mean_wait_ms': (self.wait_time * 1000 / self.dequeued
+                                     if self.dequeued else 0.0),
+                    'max_wait_ms': self.max_wait_time * 1000}
+
+class Aggregator(threading.Thread):
+    """
+    The one thread that owns RSSI state and the gsmws db connection. Decoders
+    register() for a ReportQueue and put() parsed reports on it; we apply them
+    to a per-decoder RSSIEstimator and persist the results write-behind. Nothing
+    else touches the database: other threads hand us work with call() or
+    submit(), so no one ever waits on disk while holding a lock someone else
+    needs.
+
+    Readers get each decoder's weighted averages from rssi(), which returns
+    the dict we published after the last batch rather than touching the
+    estimator. Listeners added with add_listener() are called as
+    listener(decoder_id, arrived) every time we publish, where arrived is
+    when the oldest report in the batch was queued.
+
+    A report, listener or flush that raises is logged and counted in
+    stats()['errors'], and we carry on; if this thread dies anyway, call()
+    raises rather than waiting for it.
+    """
+    def __init__(self, gsmwsdb_location, maxlen=100, queue_size=1000, batch=100,
+                 flush_interval=5.0, max_dirty=500, wal=True, synchronous="NORMAL",
+                 history_location=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.gsmwsdb_location = gsmwsdb_location
+        self.maxlen = maxlen
+        self.queue_size = queue_size
+        self.batch = batch # max reports to take from one queue per pass
+        self.store_options = {'flush_interval': flush_interval, 'max_dirty': max_dirty,
+                              'wal': wal, 'synchronous': synchronous}
+
+        self.queues = {}
+        self.estimators = {}
+        self.published = {} # decoder_id -> last rssi dict
+        self.jobs = Queue.Queue()
+        QUEUE_DEPTH.labels("aggregator_jobs").set_function(self.jobs.qsize)
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.ready = threading.Event()
+        self.listeners = []
+        self.store = None # created in run()
+        self.history_location = history_location
+        self.history = None # a history.HistoryStore, if we have a location, created in run()
+        self.seed_max = {}
+        self.seed_recent = []
+        self.errors = 0
+
+    def register(self, decoder_id):
+        """ Get the queue a decoder should put its reports on """
+        if decoder_id not in self.queues:
+            self.queues[decoder_id] = ReportQueue(decoder_id, self, self.queue_size)
+        return self.queues[decoder_id]
+
+    def unregister(self, decoder_id):
+        """
+        Stop taking a decoder's reports (any thread): we forget its RSSIs
+        and stop draining its queue, so whatever it still puts there is
+        dropped once that fills up.
+        """
+        queue = self.queues.pop(decoder_id, None)
+        if queue is None:
+            return
+        QUEUE_DEPTH.remove("aggregator_%s" % decoder_id)
+        self.submit(self._forget, decoder_id)
+
+    def _forget(self, db, decoder_id):
+        if decoder_id not in self.queues:
+            self.estimators.pop(decoder_id, None)
+            self.published.pop(decoder_id, None)
+
+    def add_listener(self, listener):
+        """ Call listener(decoder_id, arrived) whenever a decoder's RSSIs change """
+        self.listeners.append(listener)
+
+    def rssi(self, decoder_id):
+        """ ARFCN -> weighted average RSSI for a decoder, as of its last report """
+        return dict(self.published.get(decoder_id, {}))
+
+    def submit(self, func, *args):
+        """ Run func(db, *args) on the aggregator thread, sometime soon """
+        self.jobs.put((func, args, None))
+        self.wakeup.set()
+
+    def call(self, func, *args):
+        """ Run func(db, *args) on the aggregator thread and return its result """
+        done = threading.Event()
+        result = {}
+        self.jobs.put((func, args, (done, result)))
+        self.wakeup.set()
+        # (a wait() with a timeout polls, but that's fine here)
+        while not done.wait(1.0):
+            if not self.is_alive():
+                raise RuntimeError("The aggregator thread isn't running")
+        if 'error' in result:
+            raise result['error']
+        return result.get('value')
+
+    def stats(self):
+        res = {'queues': dict((i, q.stats()) for i, q in self.queues.items()),
+               'errors': self.errors}
+        if self.store is not None:
+            res['store'] = self.store.stats()
+        if self.history is not None:
+            res['history'] = self.history.stats()
+        return res
+
+    def stop(self):
+        """ Finish outstanding work, flush, and close the db """
+        self.stopped.set()
+        self.wakeup.set()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        self.store = persist.WriteBehindStore(self.gsmwsdb_location, **self.store_options)
+        persist.init_gsmwsdb(self.store.db)
+        if self.history_location is not None:
+            self.history = history.HistoryStore(self.history_location,
+                                                flush_interval=self.store.flush_interval)
+        self._load_seeds()
+        self.ready.set()
+
+        # Python 2 implements a wait() with a timeout by polling, which would
+        # add up to 50ms to every report, so we wait without one and have
+        # this wake us up to flush instead.
+        ticker = threading.Thread(target=self._tick)
+        ticker.daemon = True
+        ticker.start()
+        try:
+            while not self.stopped.is_set():
+                self.wakeup.wait()
+                self.wakeup.clear()
+                self._work()
+            self._work()
+        finally:
+            self.store.close()
+            if self.history is not None:
+                self.history.close()
+
+    def _tick(self):
+        interval = max(self.store.flush_interval / 2.0, 0.1)
+        while not self.stopped.is_set():
+            time.sleep(interval)
+            self.wakeup.set()
+
+    def _work(self):
+        self._run_jobs()
+        busy = True
+        while busy:
+            busy = False
+            for decoder_id, queue in list(self.queues.items()):
+                reports, arrived = queue.drain(self.batch)
+                for report in reports:
+                    self._guard(self._apply, decoder_id, report)
+                if reports:
+                    self.published[decoder_id] = self._estimator(decoder_id).rssis()
+                    for listener in self.listeners:
+                        self._guard(listener, decoder_id, arrived)
+                    busy = busy or len(reports) == self.batch
+            self._run_jobs()
+        self._guard(self.store.maybe_flush)
+        if self.history is not None:
+            self._guard(self.history.maybe_flush)
+
+    def _guard(self, func, *args):
+        """ func(*args), logging and counting (rather than raising) any error """
+        try:
+            func(*args)
+        except Exception:
+            self.errors += 1
+            logging.exception("Aggregator: %s%s failed" % (getattr(func, '__name__', func), args))
+
+    def _run_jobs(self):
+        while True:
+            try:
+                func, args, waiter = self.jobs.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                value = func(self.store.db, *args)
+                if waiter is not None:
+                    waiter[1]['value'] = value
+            except Exception as e:
+                if waiter is None:
+                    logging.exception("Aggregator job %s failed" % func)
+                else:
+                    waiter[1]['error'] = e
+            if waiter is not None:
+                waiter[0].set()
+
+    def _load_seeds(self):
+        """
+        Rather than storing our history, we just store the current mean for
+        each ARFCN, plus the number of recent readings we have. Each decoder's
+        estimator starts out with N instances of each ARFCN's mean. This has
+        the downside of being not general (only works with means) and losing
+        history potentially (i.e., we die twice in a row: we'll repopulate
+        with just the mean value from before).
+        """
+        self.seed_max = dict(self.store.execute("SELECT ARFCN, RSSI FROM MAX_STRENGTHS"))
+        self.seed_recent = self.store.execute("SELECT ARFCN, RSSI, COUNT FROM AVG_STRENGTHS")
+
+    def _estimator(self, decoder_id):
+        if decoder_id not in self.estimators:
+            est = estimator.RSSIEstimator(self.maxlen)
+            max_strengths = dict(self.seed_max)
+            for arfcn, mean, count in self.seed_recent:
+                est.seed(arfcn, max_strengths.pop(arfcn, None), mean, count)
+            for arfcn in max_strengths:
+                est.seed(arfcn, max_strengths[arfcn])
+            self.estimators[decoder_id] = est
+        return self.estimators[decoder_id]
+
+    def _apply(self, decoder_id, strengths):
+        """
+        Fold one report into a decoder's estimator and queue up the db
+        changes: new maxes, the new averages, and deletes for ARFCNs the
+        report no longer covers.
+        """
+        est = self._estimator(decoder_id)
+        now = datetime.datetime.now()
+        for arfcn in strengths:
+            value = strengths[arfcn]
+            if arfcn not in est or value > est.max(arfcn):
+                self.store.put("MAX_STRENGTHS", arfcn, (now, arfcn, value))
+        for arfcn in est.arfcns():
+            if arfcn not in strengths:
+                self.store.delete("MAX_STRENGTHS", arfcn)
+                self.store.delete("AVG_STRENGTHS", arfcn)
+
+        est.update(strengths)
+        if self.history is not None:
+            # merged across units, in arrival order (see history)
+            self.history.append_report(strengths)
+
+        for arfcn in est.arfcns():
+            count = est.count(arfcn)
+            if count:
+                self.store.put("AVG_STRENGTHS", arfcn, (now, arfcn, est.mean(arfcn), count))
+        self.store.maybe_flush()
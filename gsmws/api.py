@@ -0,0 +1,191 @@
+"""
+This file is part of GSMWS.
+"""
+
+import threading
+import time
+from SimpleXMLRPCServer import (SimpleXMLRPCServer, SimpleXMLRPCRequestHandler,
+                                list_public_methods)
+from SocketServer import ThreadingMixIn
+
+import metrics
+
+"""
+The gsmwsd API: one BTS served over XML-RPC to any number of clients at
+once.
+
+Each request gets its own thread, so a slow call (restart() takes as long
+as OpenBTS does to come back) only holds up its own client. Read-only
+calls are answered from a short-lived cache, and clients asking for the
+same thing at the same time share a single call to OpenBTS. Calls that
+change the BTS run one at a time, and clear the cache when they're done.
+
+Clients can batch calls with system.multicall (xmlrpclib.MultiCall), and
+follow reports with wait_reports(), which long-polls: it returns as soon as
+there are reports after the client's cursor, or after timeout seconds.
+
+GET /metrics returns the metrics registry in the Prometheus text format.
+"""
+
+CALL_TIME = metrics.REGISTRY.histogram("gsmws_api_seconds", "Time to answer one API call",
+                                       ["method"])
+CACHE_HITS = metrics.REGISTRY.counter("gsmws_api_cache_total",
+                                      "Read-only API calls, by whether the cache answered",
+                                      ["result"])
+_CACHE_HIT = CACHE_HITS.labels("hit")
+_CACHE_MISS = CACHE_HITS.labels("miss")
+
+class ResultCache(object):
+    """
+    Results of read-only calls by (method, args), each kept for ttl seconds.
+    Only one caller at a time computes a given key; anyone else who asks for
+    it meanwhile waits for that result instead of making the same call.
+    Errors aren't cached.
+    """
+    def __init__(self, ttl=1.0):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {} # key -> (expires, value)
+        self.key_locks = {}
+        self.generation = 0 # bumped by clear(), so late results from before it are dropped
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, func, *args):
+        value = self._lookup(key)
+        if value is not None:
+            return value[0]
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            value = self._lookup(key) # someone may have just got it for us
+            if value is not None:
+                return value[0]
+            with self.lock:
+                self.misses += 1
+                generation = self.generation
+            _CACHE_MISS.inc()
+            result = func(*args)
+            with self.lock:
+                if generation == self.generation:
+                    self.entries[key] = (time.time() + self.ttl, result)
+            return result
+
+    def _lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self.hits += 1
+                _CACHE_HIT.inc()
+                return (entry[1],)
+        return None
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+class BTSService(object):
+    """
+    What gsmwsd exposes: bts.BTS's calls, with the read-only ones cached
+    (see ResultCache) and the rest serialized, plus wait_reports() to follow
+    the BTS's reports (a decoder.MeasurementReportList; by default its
+    decoder's) from a cursor of the client's own.
+    """
+    READ_ONLY = ('is_off', 'current_arfcn', 'offset_correct', 'config_stats', 'cli_stats',
+                 'neighbor_stats')
+    WRITES = ('command', 'restart', 'set_txatten', 'change_arfcn', 'set_neighbors')
+
+    # don't hold a server thread forever for one client
+    MAX_WAIT = 30.0
+
+    def __init__(self, bts, cache_ttl=1.0, reports=None):
+        self.bts = bts
+        self.cache = ResultCache(cache_ttl)
+        self.write_lock = threading.Lock()
+        self.report_buffer = bts.decoder.reports if reports is None else reports
+        self.timers = dict((m, CALL_TIME.labels(m)) for m in self._listMethods())
+
+    def _listMethods(self):
+        return list(self.READ_ONLY + self.WRITES) + list_public_methods(self)
+
+    def _dispatch(self, method, params):
+        timer = self.timers.get(method)
+        if timer is None:
+            raise Exception('method "%s" is not supported' % method)
+        start = time.time()
+        try:
+            if method in self.READ_ONLY:
+                return self.cache.get((method,) + tuple(params), getattr(self.bts, method),
+                                      *params)
+            if method in self.WRITES:
+                with self.write_lock:
+                    try:
+                        return getattr(self.bts, method)(*params)
+                    finally:
+                        self.cache.clear()
+            return getattr(self, method)(*params)
+        finally:
+            timer.observe(time.time() - start)
+
+    def reports(self):
+        """ Every report since anyone last called reports() """
+        return self.bts.reports()
+
+    def wait_reports(self, cursor=-1, timeout=10.0, limit=1000):
+        """
+        Long-poll for reports: {'cursor', 'reports', 'missed', 'next'} as
+        soon as there are any from sequence number cursor on (-1 for the
+        oldest we have), or after timeout seconds with none. Pass the cursor
+        you got back next time; missed is how many were overwritten before
+        you got to them, and next is the number the next report will get
+        (so next - cursor is how far behind you still are).
+        """
+        buf = self.report_buffer
+        if cursor < 0 or cursor > buf.next_seq:
+            # a cursor from the future is from before we restarted
+            cursor = buf.first_seq()
+        buf.wait(cursor, min(float(timeout), self.MAX_WAIT))
+        reports, cursor, missed = buf.read(cursor, limit)
+        return {'cursor': cursor, 'reports': reports, 'missed': missed, 'next': buf.next_seq}
+
+    def api_stats(self):
+        """ Cache hits/misses and the range of report sequence numbers we have """
+        buf = self.report_buffer
+        return {'cache': self.cache.stats(),
+                'reports': {'first': buf.first_seq(), 'next': buf.next_seq,
+                            'evicted': buf.evicted}}
+
+class RequestHandler(SimpleXMLRPCRequestHandler):
+    """ XML-RPC on POST, and GET /metrics """
+    # keep-alive, so a client making calls all day (e.g., a fleet.Node) keeps one connection
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.report_404()
+            return
+        body = metrics.REGISTRY.text()
+        self.send_response(200)
+        self.send_header("Content-type", metrics.CONTENT_TYPE)
+        self.send_header("Content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class APIServer(ThreadingMixIn, SimpleXMLRPCServer):
+    """ A SimpleXMLRPCServer that handles each request on its own thread """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128 # the default 5 makes a crowd of clients retry connecting
+
+    def __init__(self, service, address=("localhost", 8000), log_requests=False):
+        SimpleXMLRPCServer.__init__(self, address, requestHandler=RequestHandler,
+                                    logRequests=log_requests, allow_none=True)
+        self.service = service
+        self.register_instance(service)
+        self.register_introspection_functions()
+        self.register_multicall_functions()
@@ -5,52 +5,203 @@ This file is part of GSMWS.
 import datetime
 import sqlite3
 import logging
+import socket
+import threading
+import time
 
 import envoy
 import openbts
 
+import cli
 import decoder
+import metrics
+
+RPC_TIME = metrics.REGISTRY.histogram("gsmws_openbts_rpc_seconds",
+                                      "Round trip time of OpenBTS NodeManager and CLI calls",
+                                      ["call"])
+
+class ConfigCache(object):
+    """
+    Caches NodeManager config reads, each key for its own TTL (seconds;
+    default_ttl for keys not in ttls). Writes go through update(), which
+    invalidates the key, so we never serve a value we know is stale.
+
+    prefetch() reads every key in ttls with one round trip, by reading the
+    whole config (NodeManager returns every key when asked for none). If that
+    fails (an OpenBTS error or timeout) or we don't get back what we expect,
+    we fall back to reading them one by one.
+
+    stats() counts hits, misses (each an RPC) and saved RPCs: reads we
+    answered from the cache, less the RPCs prefetching took.
+    """
+    def __init__(self, node_manager, ttls=None, default_ttl=5.0):
+        self.node_manager = node_manager
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.lock = threading.Lock() # the NodeManager socket isn't thread-safe
+        self.entries = {} # key -> (expires, config entry dict)
+
+        self.hits = 0
+        self.misses = 0
+        self.prefetches = 0
+        self.invalidations = 0
+
+    def read(self, key):
+        """ The key's config entry (value, defaultValue, etc.) """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            data = self._rpc("read_config", self.node_manager.read_config, key).data
+            self._store(key, data)
+            return data
+
+    def value(self, key):
+        return self.read(key)['value']
+
+    def _store(self, key, data):
+        self.entries[key] = (time.time() + self.ttls.get(key, self.default_ttl), data)
+
+    def update(self, key, value):
+        """ update_config, and forget what we had for key (even if it fails) """
+        with self.lock:
+            self._invalidate(key)
+            return self._rpc("update_config", self.node_manager.update_config, key, value)
+
+    def _rpc(self, call, func, *args):
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            RPC_TIME.labels(call).observe(time.time() - start)
+
+    def invalidate(self, key=None):
+        """ Forget key, or everything """
+        with self.lock:
+            self._invalidate(key)
+
+    def _invalidate(self, key):
+        if key is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(key, None)
+        self.invalidations += 1
+
+    def prefetch(self, keys=None):
+        """ Load keys (default, all the ones we have TTLs for) """
+        keys = list(self.ttls) if keys is None else list(keys)
+        with self.lock:
+            self.prefetches += 1
+            try:
+                config = self._rpc("read_config_all", self.node_manager.read_config, "").data
+                if not all(isinstance(config.get(key), dict) for key in keys):
+                    raise ValueError("incomplete config")
+            except (ValueError, AttributeError, openbts.exceptions.OpenBTSError):
+                logging.debug("Can't prefetch config in one read, reading each key")
+                config = None
+            for key in keys:
+                if config is not None:
+                    self._store(key, config[key])
+                else:
+                    self.misses += 1
+                    self._store(key, self._rpc("read_config", self.node_manager.read_config,
+                                               key).data)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'prefetches': self.prefetches,
+                    'invalidations': self.invalidations,
+                    'saved_rpcs': self.hits - self.prefetches}
 
 class BTS(object):
     """
     Provides access to handover and power related settings on a single, local
     OpenBTS instance.
     """
-    def __init__(self, loglvl=logging.DEBUG):
-        self.node_manager = openbts.OpenBTS()
-        self.cmd_socket = (self.node_manager
-                            .read_config("CLI.SocketPath").data['value'])
-
-        neighbor_table_loc = (self.node_manager
-                                .read_config("Peering.NeighborTable.Path")
-                                .data['value'])
+    # How long (seconds) to trust cached values of the config keys we use.
+    # Anything we change ourselves is invalidated when we change it.
+    CONFIG_TTLS = {"CLI.SocketPath": 3600,
+                   "Peering.NeighborTable.Path": 3600,
+                   "TRX.RadioFrequencyOffset": 3600,
+                   "GSM.Radio.C0": 60,
+                   "GSM.Neighbors": 60,
+                   "TRX.TxAttenOffset": 5}
+
+    # OpenBTS expires NeighborTable rows that haven't been updated in a
+    # while, so set_neighbors rewrites ours once they're this old (seconds)
+    # even if nothing about them changed
+    NEIGHBOR_REFRESH_TIME = 60
+
+    def __init__(self, loglvl=logging.DEBUG, events=None, events_host="tcp://localhost:45160",
+                 address=None, decode=False):
+        """
+        PhysicalStatus events come from events_host. If there are several BTS
+        on this host, pass them all the same decoder.EventMultiplexer as
+        events, rather than each starting its own EventDecoder thread. Set
+        decode to get gsm.CompactReports from reports() instead of raw events.
 
-        self.neighbor_table = sqlite3.connect(neighbor_table_loc)
+        address is the NodeManager's, if it's not on the default port.
+        """
+        if address is None:
+            self.node_manager = openbts.OpenBTS()
+        else:
+            self.node_manager = openbts.OpenBTS(address=address)
+        self.config = ConfigCache(self.node_manager, self.CONFIG_TTLS)
+        self.config.prefetch()
+        self.cmd_socket = self.config.value("CLI.SocketPath")
+        self.cli = cli.CLIClient(self.cmd_socket)
+
+        neighbor_table_loc = self.config.value("Peering.NeighborTable.Path")
+
+        # set_neighbors may run on any of the controller's worker threads,
+        # though never on two at once
+        self.neighbor_table = sqlite3.connect(neighbor_table_loc, check_same_thread=False)
         self.neighbors = []
+        self.neighbor_calls = 0
+        self.neighbor_config_writes = 0
+        self.neighbor_config_skipped = 0
+        self.neighbor_rows_written = 0
+        self.neighbor_rows_skipped = 0
         self.loglvl = loglvl
 
-        self.decoder = decoder.EventDecoder()
-        self.decoder.daemon = True
-        self.decoder.start()
+        if events is not None:
+            self.decoder = events.subscribe(events_host, decode=decode)
+        else:
+            self.decoder = decoder.EventDecoder(events_host, decode=decode)
+            self.decoder.daemon = True
+            self.decoder.start()
+        # decoded reports only include the serving cell if the decoder knows
+        # it (subclasses may make current_arfcn a property, hence BTS.)
+        self.decoder.current_arfcn = BTS.current_arfcn(self)
+        self.next_arfcn = None # set by change_arfcn, on air after a restart
 
 
     def is_off(self):
         """
         We define the BTS as off if it's in txatten is > 90
         """
-        txatten = int(self.node_manager
-                    .read_config('TRX.TxAttenOffset').data['value'])
+        txatten = int(self.config.value('TRX.TxAttenOffset'))
         return txatten > 90
 
     def current_arfcn(self):
         """
         Check for the current ARFCN in use, according to OpenBTS.
         """
-        return int(self.node_manager.read_config("GSM.Radio.C0").data['value'])
+        return int(self.config.value("GSM.Radio.C0"))
+
+    def config_stats(self):
+        """ Config cache hits, misses and saved RPCs """
+        return self.config.stats()
 
     def reports(self):
         """
-        Gets all the reports from the decoder.
+        Gets all the reports from the decoder since the last call. Other
+        consumers can follow the same reports with their own
+        self.decoder.reports.cursor().
         """
         return self.decoder.reports.getall()
 
@@ -62,7 +213,7 @@ class BTS(object):
         # this works because the "default" offset is defined by the setting in
         # the radio's firmware; if the value in the DB is different from the
         # offset, it won't be set to default.
-        offset = self.node_manager.read_config("TRX.RadioFrequencyOffset")
+        offset = self.config.read("TRX.RadioFrequencyOffset")
         return offset['defaultValue'] == offset['value']
 
 
@@ -73,29 +224,46 @@ class BTS(object):
             Output of the command if successful
             Raises a ValueError if failure (probably*)
 
-        * We say probably because there's no good way to know if a command sent
-        through OpenBTSDo succeeds or not! WHY WOULD YOU NEED THAT.
+        * We say probably because OpenBTS only tells us a command failed by
+        putting one of a few known error messages in its output; see
+        cli.CLIResult.
         """
+        try:
+            return self.pipeline([command_str])[0].check()
+        except socket.error as e:
+            raise ValueError("no response from OpenBTS: %s" % e)
 
+    def pipeline(self, commands):
+        """
+        Run several commands in one round trip over our persistent CLI
+        connection. Returns a cli.CLIResult for each, in order.
+
+        If we can't connect to the command socket directly (usually
+        permissions), we fall back to OpenBTSDo for good, one command at a
+        time. Raises socket.error if OpenBTS doesn't answer.
+        """
+        if self.cli is not None and self.cli.sock is None:
+            try:
+                self.cli.connect()
+            except socket.error as e:
+                logging.warning("Can't use CLI socket %s (%s), falling back to OpenBTSDo"
+                                % (self.cmd_socket, e))
+                self.cli = None
+        if self.cli is not None:
+            return self.cli.pipeline(commands)
+        return [self._openbtsdo(c) for c in commands]
+
+    def _openbtsdo(self, command_str):
         # THIS IS THE OFFICIAL WAY TO DO THIS
         # IN THE NAME OF ALL THAT IS HOLY
         r = envoy.run("echo '%s' | sudo /OpenBTS/OpenBTSDo %s"
                         % (command_str, self.cmd_socket))
+        # More fun: always exits with status 0!
+        return cli.CLIResult(command_str, r.std_out)
 
-        # More fun: always exits with status 0! So we have to check contents of
-        # stdout for "known" error messages from OpenBTS (CLI/CLI.cpp) to guess
-        # if the command succeeded or failed. These are not guaranteed to be in
-        # output, so just a guess.
-        failure_messages = ["wrong number of arguments",
-                            "bad argument(s)",
-                            "command not found",
-                            "too many arguments for parser",
-                            "command failed"]
-        response = r.std_out.strip()
-        for msg in failure_messages:
-            if msg in response:
-                raise ValueError("%s: %s" % (msg, response))
-        return response
+    def cli_stats(self):
+        """ Commands, failures and latency on the persistent CLI connection """
+        return self.cli.stats() if self.cli is not None else {}
 
 
     def restart(self):
@@ -105,6 +273,8 @@ class BTS(object):
         """
         logging.warning("Restarting openbts")
         envoy.run("sudo supervisordctl restart openbts")
+        if self.next_arfcn is not None:
+            self.decoder.current_arfcn, self.next_arfcn = self.next_arfcn, None
 
 
     def set_txatten(self, value):
@@ -118,16 +288,18 @@ class BTS(object):
 
         """
         self.command("txatten %d" % (value))
+        self.config.invalidate('TRX.TxAttenOffset')
 
 
     def change_arfcn(self, new_arfcn, immediate=False):
         """ Change OpenBTS to use a new ARFCN. By default, just update the DB, but
         don't actually restart OpenBTS. If immediate=True, restart OpenBTS too. """
         try:
-            self.node_manager.update_config("GSM.Radio.C0", new_arfcn)
+            self.config.update("GSM.Radio.C0", new_arfcn)
         except openbts.exceptions.InvalidRequestError:
             return False
         logging.warning("Updated ARFCN to %s" % new_arfcn)
+        self.next_arfcn = new_arfcn
         if immediate:
             # this is a blocking call
             self.restart()
@@ -163,29 +335,32 @@ class BTS(object):
             True if we successfully set up the new neighbors, false otherwise
         """
 
-        # Need to generate a mapping of ARFCNs : IPs
-        fake_neighbors = {}
-        for i in range(0, len(arfcns)):
-            chan = arfcns[i]
-            fake_neighbors[chan] = "127.0.10.%d:16001" % (i + 10,)
+        self.neighbor_calls += 1
+
+        # Need to generate a mapping of ARFCNs : IPs, in order, so the same
+        # ARFCNs always give the same neighbor string
+        fake_neighbors = [(arfcns[i], "127.0.10.%d:16001" % (i + 10,))
+                          for i in range(0, len(arfcns))]
 
         real_ip_str = " ".join([str(bts_ip) for bts_ip in real])
-        fake_ip_str = " ".join([str(ip) for ip in fake_neighbors.values()])
+        fake_ip_str = " ".join([ip for _, ip in fake_neighbors])
 
         self.neighbors = arfcns
 
-        # set IPs in openbts
+        # set IPs in openbts, unless that's what they already are
         # leading space will choke OpenBTS
         neighbor_string = ("%s %s" % (real_ip_str, fake_ip_str)).strip()
-        try:
-            r = self.node_manager.update_config("GSM.Neighbors", neighbor_string)
-            logging.debug("Updating neighbors (%s) '%s': '%s'" % (arfcns, neighbor_string, r.data))
-        except openbts.exceptions.InvalidResponseError:
-            # OpenBTS won't accept the same list of neighbor IPs twice, so this
-            # will come up every time we set the same number of ARFCNs to scan.
-            # Totally normal.
-            logging.debug("neighbors unchanged")
-
+        if self.config.value("GSM.Neighbors") == neighbor_string:
+            self.neighbor_config_skipped += 1
+        else:
+            try:
+                r = self.config.update("GSM.Neighbors", neighbor_string)
+                self.neighbor_config_writes += 1
+                logging.debug("Updating neighbors (%s) '%s': '%s'" % (arfcns, neighbor_string, r.data))
+            except openbts.exceptions.InvalidResponseError:
+                # OpenBTS won't accept the same list of neighbor IPs twice,
+                # which can still happen if it changed behind our back.
+                logging.debug("neighbors unchanged")
 
         # Update the neighbor table for each fake neighbor. Real neighbors
         # should be updated automatically on their own.
@@ -196,16 +371,41 @@ class BTS(object):
         #          attempting another handover with this neighbor after failure.
         # C0: The ARFCN we want to scan
         # BSIC: The BSIC. Can be set to whatever?
+        #
+        # We only write rows that don't already say what we want (OpenBTS
+        # may have changed them, so we check the table itself) or are
+        # NEIGHBOR_REFRESH_TIME old, so OpenBTS doesn't expire them, all in
+        # one statement and one transaction.
         updated = int(datetime.datetime.now().strftime("%s"))
         holdoff = 3600*24*7 # 7 days
         bsic = 1 # TODO does this matter?
         try:
-            for arfcn, ip in fake_neighbors.iteritems():
+            ips = [ip for _, ip in fake_neighbors]
+            current = {}
+            if ips:
+                current = dict((ip, (c0, b, h, u)) for ip, c0, b, h, u in self.neighbor_table.execute(
+                    "SELECT IPADDRESS, C0, BSIC, HOLDOFF, UPDATED FROM NEIGHBOR_TABLE "
+                    "WHERE IPADDRESS IN (%s);" % ",".join("?" * len(ips)), ips))
+            stale = updated - self.NEIGHBOR_REFRESH_TIME
+            changes = [(arfcn, updated, holdoff, bsic, ip) for arfcn, ip in fake_neighbors
+                       if current.get(ip, ())[:3] != (arfcn, bsic, holdoff)
+                       or (current[ip][3] or 0) <= stale]
+            if changes:
                 query_str = "UPDATE NEIGHBOR_TABLE SET C0 = ?, UPDATED = ?, HOLDOFF = ?, BSIC = ? WHERE IPADDRESS = ?;"
-                self.neighbor_table.execute(query_str, (arfcn, updated, holdoff, bsic, ip))
-            self.neighbor_table.commit()
-            logging.info("Updated NeighborTable.")
+                with self.neighbor_table:
+                    cur = self.neighbor_table.executemany(query_str, changes)
+                self.neighbor_rows_written += cur.rowcount
+                logging.info("Updated NeighborTable (%d rows)." % cur.rowcount)
+            self.neighbor_rows_skipped += len(fake_neighbors) - len(changes)
             return True
         except sqlite3.OperationalError:
-            logging.notice("Could not update NeighborTable.")
+            logging.warning("Could not update NeighborTable.")
             return False
+
+    def neighbor_stats(self):
+        """ set_neighbors calls, and the writes it made and skipped """
+        return {'calls': self.neighbor_calls,
+                'config_writes': self.neighbor_config_writes,
+                'config_skipped': self.neighbor_config_skipped,
+                'rows_written': self.neighbor_rows_written,
+                'rows_skipped': self.neighbor_rows_skipped}
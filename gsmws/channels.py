@@ -0,0 +1,166 @@
+"""
+This file is part of GSMWS.
+"""
+
+import array
+import collections
+import random
+import time
+
+import gsm
+
+class ChoiceSet(object):
+    """
+    A set that also supports O(1) random.choice, by keeping its members in a
+    list and swapping removed members with the last one.
+    """
+    def __init__(self, items=()):
+        self.items = []
+        self.positions = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item not in self.positions:
+            self.positions[item] = len(self.items)
+            self.items.append(item)
+
+    def discard(self, item):
+        pos = self.positions.pop(item, None)
+        if pos is None:
+            return
+        last = self.items.pop()
+        if pos < len(self.items):
+            self.items[pos] = last
+            self.positions[last] = pos
+
+    def choice(self, rand=random):
+        """ Raises IndexError if empty, like random.choice """
+        return rand.choice(self.items)
+
+    def sample(self, k, rand=random):
+        return rand.sample(self.items, k)
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(list(self.items))
+
+class ChannelState(object):
+    """
+    The controller's view of the band: for each ARFCN we've scanned recently,
+    its RSSI and when we last heard about it. This is what AVAIL_ARFCN holds,
+    but kept in memory and indexed, so the controller can ask for the safe
+    (RSSI < 0) or unscanned channels every loop without going to disk. The
+    table is read from AVAIL_ARFCN by load(), and snapshot() says what's
+    changed since, to write back.
+
+    Only the controller thread should touch this.
+    """
+    def __init__(self, scan_range=range(1, 124)):
+        self.scan_range = list(scan_range)
+        self.scannable = frozenset(self.scan_range)
+        self.rssis = array.array('d', [0.0]) * gsm.NUM_ARFCNS
+        self.last_seen = array.array('d', [0.0]) * gsm.NUM_ARFCNS
+        self.by_age = collections.OrderedDict() # arfcn -> last_seen, oldest first
+        self.safe = ChoiceSet()
+        self.unscanned = ChoiceSet(self.scan_range)
+        self.changed = set() # ARFCNs updated since the last snapshot
+        self.expired_before = None # we've expired everything last seen before this
+        self.dirty = False
+
+    def __contains__(self, arfcn):
+        return arfcn in self.by_age
+
+    def arfcns(self):
+        return list(self.by_age)
+
+    def rssi(self, arfcn):
+        return self.rssis[arfcn] if arfcn in self.by_age else None
+
+    def update(self, rssis, now=None):
+        """ Record a dict of ARFCN -> RSSI as of now """
+        if now is None:
+            now = time.time()
+        for arfcn in rssis:
+            if not 0 <= arfcn < gsm.NUM_ARFCNS:
+                continue
+            self._set(arfcn, rssis[arfcn], now)
+        self.dirty = self.dirty or bool(rssis)
+
+    def _set(self, arfcn, rssi, ts):
+        self.rssis[arfcn] = rssi
+        self.last_seen[arfcn] = ts
+        self.changed.add(arfcn)
+        self.by_age.pop(arfcn, None)
+        self.by_age[arfcn] = ts
+        self.unscanned.discard(arfcn)
+        if rssi < 0:
+            self.safe.add(arfcn)
+        else:
+            self.safe.discard(arfcn)
+
+    def expire(self, cutoff):
+        """ Forget ARFCNs last seen before cutoff. Returns them. """
+        expired = []
+        while self.by_age:
+            arfcn = next(iter(self.by_age))
+            if self.by_age[arfcn] >= cutoff:
+                break
+            del self.by_age[arfcn]
+            self.safe.discard(arfcn)
+            if arfcn in self.scannable:
+                self.unscanned.add(arfcn)
+            self.changed.discard(arfcn)
+            expired.append(arfcn)
+        if expired:
+            if self.expired_before is None or cutoff > self.expired_before:
+                self.expired_before = cutoff
+            self.dirty = True
+        return expired
+
+    def safe_arfcns(self):
+        return list(self.safe)
+
+    def pick_safe(self, rand=random):
+        """ A random safe ARFCN. Raises IndexError if there aren't any. """
+        return self.safe.choice(rand)
+
+    def pick_unscanned(self, k, exclude=(), rand=random):
+        """
+        k random ARFCNs we haven't scanned recently, leaving out exclude.
+        Raises ValueError if there aren't enough, like random.sample.
+
+        Rather than copy the candidates to leave out exclude, we sample that
+        many more than k and drop them, so this is O(k + len(exclude)).
+        """
+        exclude = set(a for a in exclude if a in self.unscanned)
+        picked = self.unscanned.sample(k + len(exclude), rand)
+        return [a for a in picked if a not in exclude][:k]
+
+    def load(self, db):
+        """ Replace our state with what's in AVAIL_ARFCN """
+        self.__init__(self.scan_range)
+        for arfcn, ts, rssi in db.execute("SELECT ARFCN, TIMESTAMP, RSSI FROM AVAIL_ARFCN "
+                                          "ORDER BY TIMESTAMP"):
+            if 0 <= arfcn < gsm.NUM_ARFCNS:
+                self._set(arfcn, rssi, ts)
+        self.changed.clear() # that's what's there already
+
+    def snapshot(self):
+        """
+        What's changed since load() or the last snapshot, as arguments for
+        persist.save_avail_arfcns(): the AVAIL_ARFCN rows we've updated, and
+        the time we've expired everything last seen before (or None). We
+        count as clean from here on.
+        """
+        rows = [(arfcn, self.last_seen[arfcn], self.rssis[arfcn]) for arfcn in self.changed]
+        expired_before = self.expired_before
+        self.changed = set()
+        self.expired_before = None
+        self.dirty = False
+        return rows, expired_before
@@ -0,0 +1,164 @@
+"""
+This file is part of GSMWS.
+"""
+
+import itertools
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import metrics
+
+RPC_TIME = metrics.REGISTRY.histogram("gsmws_openbts_rpc_seconds",
+                                      "Round trip time of OpenBTS NodeManager and CLI calls",
+                                      ["call"])
+
+"""
+OpenBTS CLI status codes (CLI/CLI.cpp), and the text OpenBTS appends to a
+command's output when it returns one. The datagram socket only carries
+text, so this is the only way to get the status back out.
+"""
+SUCCESS = 0
+BAD_NUM_ARGS = 1
+BAD_VALUE = 2
+NOT_FOUND = 3
+TOO_MANY_ARGS = 4
+FAILURE = 5
+
+ERROR_TEXT = {BAD_NUM_ARGS: "wrong number of arguments",
+              BAD_VALUE: "bad argument(s)",
+              NOT_FOUND: "command not found",
+              TOO_MANY_ARGS: "too many arguments for parser",
+              FAILURE: "command failed"}
+
+class CLIResult(object):
+    """ What a CLI command returned: its output and status code """
+    def __init__(self, command, output):
+        self.command = command
+        self.output = output.strip()
+        self.code = SUCCESS
+        for code, text in ERROR_TEXT.items():
+            if text in self.output:
+                self.code = code
+                break
+
+    @property
+    def ok(self):
+        return self.code == SUCCESS
+
+    def check(self):
+        """ Our output, or a ValueError if the command failed """
+        if not self.ok:
+            raise ValueError("%s: %s" % (ERROR_TEXT[self.code], self.output))
+        return self.output
+
+    def __repr__(self):
+        return "CLIResult(%r, code=%d)" % (self.command, self.code)
+
+class CLIClient(object):
+    """
+    A persistent client for the OpenBTS command socket (CLI.SocketPath), the
+    same UNIX datagram socket OpenBTSDo talks to, but without a shell, sudo
+    and a new process for every command. We bind our own socket once and
+    keep it. This needs permission to write to the command socket, so run as
+    whoever OpenBTS runs as (or loosen the socket's permissions).
+
+    OpenBTS answers commands one at a time, in order, so pipeline() sends
+    several at once and then reads all the replies.
+
+    stats() has how many commands we've sent, how many failed, and latency.
+    """
+    _ids = itertools.count()
+
+    def __init__(self, socket_path, timeout=5.0, bufsize=65536):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.bufsize = bufsize
+        self.lock = threading.Lock()
+        self.sock = None
+        self.local_path = None
+
+        self.commands = 0
+        self.failures = 0
+        self.round_trips = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+    def connect(self):
+        """ Raises socket.error if we can't reach the command socket """
+        self.close()
+        self.local_path = os.path.join(tempfile.gettempdir(), "gsmws-cli-%d-%d"
+                                       % (os.getpid(), next(self._ids)))
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.bind(self.local_path)
+            sock.connect(self.socket_path)
+        except socket.error:
+            sock.close()
+            self._unlink()
+            raise
+        sock.settimeout(self.timeout)
+        self.sock = sock
+
+    def command(self, command_str):
+        """ Run one command. Returns a CLIResult. """
+        return self.pipeline([command_str])[0]
+
+    def pipeline(self, commands):
+        """
+        Send every command, then collect their replies, in order. Raises
+        socket.error (e.g., socket.timeout) if OpenBTS doesn't answer; we
+        reconnect next time, so a late reply can't get mixed up with a new
+        command's.
+        """
+        with self.lock:
+            if self.sock is None:
+                self.connect()
+            start = time.time()
+            try:
+                for command_str in commands:
+                    self.sock.send(command_str.encode("utf-8"))
+                replies = [self.sock.recv(self.bufsize).decode("utf-8", "replace")
+                           for _ in commands]
+            except socket.error:
+                self.close()
+                raise
+            elapsed = time.time() - start
+            RPC_TIME.labels("cli").observe(elapsed)
+
+            results = [CLIResult(c, r) for c, r in zip(commands, replies)]
+            self.commands += len(commands)
+            self.failures += len([r for r in results if not r.ok])
+            self.round_trips += 1
+            self.latency += elapsed
+            self.max_latency = max(self.max_latency, elapsed)
+        for r in results:
+            if not r.ok:
+                logging.debug("CLI command failed: '%s': %s" % (r.command, r.output))
+        return results
+
+    def stats(self):
+        with self.lock:
+            return {'commands': self.commands,
+                    'failures': self.failures,
+                    'round_trips': self.round_trips,
+                    'mean_ms': (self.latency * 1000 / self.round_trips
+                                if self.round_trips else 0.0),
+                    'max_ms': self.max_latency * 1000}
+
+    def _unlink(self):
+        if self.local_path is not None:
+            try:
+                os.unlink(self.local_path)
+            except OSError:
+                pass
+            self.local_path = None
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self._unlink()
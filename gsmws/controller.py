@@ -4,14 +4,19 @@ This file is part of GSMWS.
 
 import time
 import datetime
-import random
-import sqlite3
 import logging
 import threading
 
 import decoder
 import gsm
 import bts
+import persist
+import channels
+import aggregator
+import events
+import interference
+import fanout
+import scheduler
 
 """
 The controller has three tasks:
@@ -20,22 +25,32 @@ The controller has three tasks:
     2) If we detect a channel in use "near" us, we should stop OpenBTS and pick a new channel (TODO)
 """
 class Controller(object):
+    # seconds to ignore reports for after changing a BTS's neighbors
+    IGNORE_TIME = 120
+
     def __init__(self, db_loc, openbts_proc, trans_proc, nct, sleep, gsmwsdb,
-                 loglvl=logging.DEBUG, bts_class=bts.BTS):
+                 loglvl=logging.DEBUG, bts_class=bts.BTS, snapshot=60, history=None):
         self.OPENBTS_PROCESS_NAME=openbts_proc
         self.TRANSCEIVER_PROCESS_NAME=trans_proc
 
         # seconds to wait before switching up the neighbor list
         self.NEIGHBOR_CYCLE_TIME = nct
 
-        # seconds between rssi checks
+        # seconds between housekeeping passes; reports are handled as they come in
         self.SLEEP_TIME = sleep
 
         self.openbtsdb_loc = db_loc
 
+        # the aggregator owns the gsmws db (and the RSSI history, if we keep
+        # one, in the history directory); everything goes through it
         self.gsmwsdb_location = gsmwsdb
-        self.gsmwsdb_lock = threading.Lock()
-        self.gsmwsdb = sqlite3.connect(gsmwsdb)
+        self.aggregator = aggregator.Aggregator(gsmwsdb, history_location=history)
+
+        # seconds between snapshots of the channel state to the gsmws db
+        self.SNAPSHOT_TIME = snapshot
+        self.channels = channels.ChannelState()
+        self.last_snapshot = time.time()
+        self.scheduler = scheduler.ScanScheduler(self.channels.scan_range)
 
         self.bts = None
         self.bts_class = bts_class
@@ -47,150 +62,201 @@ class Controller(object):
         logging.warning("New controller started.")
 
     def initdb(self):
-        with self.gsmwsdb_lock:
-            self.gsmwsdb.execute("CREATE TABLE IF NOT EXISTS AVAIL_ARFCN "
-                                 "(TIMESTAMP TEXT NOT NULL, ARFCN INTEGER, "
-                                 "RSSI REAL);")
-            self.gsmwsdb.execute("CREATE TABLE IF NOT EXISTS MAX_STRENGTHS "
-                                 "(TIMESTAMP TEXT NOT NULL, ARFCN INTEGER, "
-                                 "RSSI REAL);")
-            self.gsmwsdb.execute("CREATE TABLE IF NOT EXISTS AVG_STRENGTHS "
-                                 "(TIMESTAMP TEXT NOT NULL, ARFCN INTEGER, "
-                                 "RSSI REAL, COUNT INTEGER);")
+        # the aggregator sets up the db when it starts
+        if not self.aggregator.is_alive():
+            self.aggregator.start()
+        self.aggregator.call(self.channels.load)
+        for arfcn in self.channels.arfcns():
+            self.scheduler.seed(arfcn, self.channels.rssi(arfcn), self.channels.last_seen[arfcn])
 
     def update_rssi_db(self, rssis):
         # rssis: A dict of ARFCN->RSSI that's up to date as of now (it already
-        # captures our historical knowledge)
-        with self.gsmwsdb_lock:
-            logging.debug("Updating RSSIs: %s" % rssis)
-            available_arfcns = (self.gsmwsdb.execute("SELECT ARFCN FROM AVAIL_ARFCN").fetchall())
-            existing = [arfcn for res in available_arfcns for arfcn in res]
-            timestamp = datetime.datetime.now()
-
-            for arfcn in existing:
-                if arfcn in rssis:
-                    # do update
-                    self.gsmwsdb.execute("UPDATE AVAIL_ARFCN SET TIMESTAMP=?, RSSI=? WHERE ARFCN=?",
-                            (timestamp, rssis[arfcn], arfcn))
-            for arfcn in [_ for _ in rssis if _ not in existing]:
-                # do insert
-                self.gsmwsdb.execute("INSERT INTO AVAIL_ARFCN VALUES(?,?,?)",
-                            (timestamp, arfcn, rssis[arfcn]))
-            self.gsmwsdb.commit()
-
-            # now, expire!
-            now = datetime.datetime.now()
-            res = self.gsmwsdb.execute("SELECT TIMESTAMP, ARFCN FROM AVAIL_ARFCN")
-            for items in res.fetchall():
-                ts = datetime.datetime.strptime(items[0], "%Y-%m-%d %H:%M:%S.%f")
-                arfcn = items[1]
-                if (now - ts).seconds > 4*self.NEIGHBOR_CYCLE_TIME:
-                    self.gsmwsdb.execute("DELETE FROM AVAIL_ARFCN WHERE ARFCN=?", (arfcn,))
-                    logging.debug("Expiring ARFCN %s (%s)" % (arfcn, ts))
-            self.gsmwsdb.commit()
+        # captures our historical knowledge). This only touches the in-memory
+        # channel state; snapshot_channels() writes it out.
+        logging.debug("Updating RSSIs: %s" % rssis)
+        now = time.time()
+        self.channels.update(rssis, now)
+
+        # now, expire!
+        for arfcn in self.channels.expire(now - 4*self.NEIGHBOR_CYCLE_TIME):
+            logging.debug("Expiring ARFCN %s" % arfcn)
+        self.snapshot_channels(force=False)
+
+    def snapshot_channels(self, force=True):
+        """
+        Write what's changed in the channel state to AVAIL_ARFCN. Unless
+        forced, only do it if something changed and SNAPSHOT_TIME has passed
+        since the last one.
+        Forced snapshots wait for the write; the others are handed off to the
+        aggregator.
+        """
+        now = time.time()
+        if not force and (not self.channels.dirty or now - self.last_snapshot < self.SNAPSHOT_TIME):
+            return
+        if force:
+            self.aggregator.call(persist.save_avail_arfcns, *self.channels.snapshot())
+        else:
+            self.aggregator.submit(persist.save_avail_arfcns, *self.channels.snapshot())
+        self.last_snapshot = now
+
+    def shutdown(self):
+        self.snapshot_channels()
+        self.aggregator.stop()
 
     def safe_arfcns(self):
         """ Get the ARFCNs which probably have no other users """
-        with self.gsmwsdb_lock:
-            res = self.gsmwsdb.execute("SELECT ARFCN, RSSI FROM AVAIL_ARFCN")
-        candidates = []
-        for i in res:
-            arfcn, rssi = i
-            if rssi < 0:
-                candidates.append(arfcn)
-        return candidates
+        return self.channels.safe_arfcns()
 
     def pick_new_safe_arfcn(self):
         """ Returns a random ARFCN that we have verified to be safe (i.e., <0 RSSI) """
-        return random.choice(self.safe_arfcns())
+        return self.channels.pick_safe()
 
     def pick_new_neighbors(self):
-        """ Pick a set of ARFCNs we haven't scanned before """
-        with self.gsmwsdb_lock:
-            available_arfcns = (self.gsmwsdb.execute("SELECT ARFCN FROM AVAIL_ARFCN").fetchall())
-            existing = [arfcn for res in available_arfcns for arfcn in res]
-        return random.sample([_ for _ in range(1,124) if _ not in existing], 5)
+        """ Pick the ARFCNs most in need of a scan (see scheduler.ScanScheduler) """
+        return self.scheduler.assign(0, 5, exclude=[self.bts.current_arfcn])
 
-    def main(self, stream=None, cmd=None):
+    def main(self, stream=None, cmd=None, capture="tshark"):
         self.initdb() # set up the gsmws db
 
         if stream==None:
-            if cmd==None:
-                cmd = "tshark -V -n -i any udp dst port 4729"
-            stream = gsm.command_stream(cmd)
-
-        gsmd = decoder.GSMDecoder(stream, self.gsmwsdb_lock,
-                                  self.gsmwsdb_location, loglvl=self.loglvl)
+            if capture == "gsmtap":
+                stream = gsm.GSMTAPStream()
+            else:
+                if cmd==None:
+                    cmd = "tshark -V -n -i any udp dst port 4729"
+                stream = gsm.command_stream(cmd)
+
+        gsmd = decoder.GSMDecoder(stream, self.aggregator, loglvl=self.loglvl)
         self.bts = self.bts_class(self.openbtsdb_loc, self.OPENBTS_PROCESS_NAME,
                                   self.TRANSCEIVER_PROCESS_NAME, self.loglvl)
         self.bts.init_decoder(gsmd)
-        last_cycle_time = datetime.datetime.now()
-        ignored_since = datetime.datetime.now()
-        while True:
-            try:
-                now = datetime.datetime.now()
-
-                if self.bts.decoder.ignore_reports and (now - ignored_since).seconds > 120:
-                    self.bts.decoder.ignore_reports = False
-
-                td = (now - last_cycle_time)
-                if td.seconds > self.NEIGHBOR_CYCLE_TIME:
-                    try:
-                        new_arfcn = self.pick_new_safe_arfcn()
-                        bts.change_arfcn(new_arfcn)
-                    except IndexError:
-                        logging.error("Unable to pick new safe ARFCN!")
-                        pass # just don't pick for now
-                    self.bts.set_neighbors(self.pick_new_neighbors())
-                    self.bts.decoder.ignore_reports = True
-                    ignored_since = now
-                    last_cycle_time = now
-
-                logging.info("Current ARFCN: %s" % self.bts.current_arfcn)
-
-                rssis = self.bts.decoder.rssi()
-
-                # TODO this might actually be the right behavior -- why does
-                # the fact we used an arfcn before change whether we need to
-                # get a consistent clear scan before using it again? As long as
-                # it becomes a candidate again later this is fine.
-                #
-                # ignore readings for our own C0 (else, we never consider our
-                # own used arfcn safe until we scan it 100 times again!)
-                #del(rssis[self.gsmd.current_arfcn])
-
-                self.update_rssi_db(rssis)
-                logging.info("Safe ARFCNs: %s" % str(self.safe_arfcns()))
-                time.sleep(self.SLEEP_TIME)
-            except KeyboardInterrupt:
-                break
+
+        self.loop = events.EventLoop(self.on_reports)
+        self.aggregator.add_listener(self.loop.notify)
+        self.loop.call_later(self.NEIGHBOR_CYCLE_TIME, self.cycle_neighbors)
+        self.tick()
+        self.run_loop()
+
+    def run_loop(self):
+        try:
+            self.loop.run()
+        except KeyboardInterrupt:
+            self.shutdown()
+            logging.info("Latencies: %s" % self.loop.stats())
+
+    def ignore_reports(self, bts):
+        """
+        Ignore a BTS's reports for IGNORE_TIME seconds, while phones pick up
+        its new neighbor list.
+        """
+        bts.decoder.ignore_reports = True
+        bts.ignored_since = datetime.datetime.now()
+        if getattr(bts, 'ignore_timer', None) is not None:
+            bts.ignore_timer.cancel()
+        bts.ignore_timer = self.loop.call_later(self.IGNORE_TIME, self.stop_ignoring, bts)
+
+    def stop_ignoring(self, bts):
+        bts.decoder.ignore_reports = False
+        bts.ignore_timer = None
+
+    def cycle_neighbors(self):
+        try:
+            new_arfcn = self.pick_new_safe_arfcn()
+            self.bts.change_arfcn(new_arfcn)
+        except IndexError:
+            logging.error("Unable to pick new safe ARFCN!")
+            pass # just don't pick for now
+        self.bts.set_neighbors(self.pick_new_neighbors())
+        self.ignore_reports(self.bts)
+        self.loop.call_later(self.NEIGHBOR_CYCLE_TIME, self.cycle_neighbors)
+
+    def on_reports(self, arrivals):
+        """ The decoder has new reports: arrivals is decoder id -> when """
+        # the scheduler wants each reading as it came in, not our averages
+        now = time.time()
+        for report in self.bts.decoder.reports.getall():
+            self.scheduler.observe(report, now)
+        rssis = self.bts.decoder.rssi()
+
+        # TODO this might actually be the right behavior -- why does
+        # the fact we used an arfcn before change whether we need to
+        # get a consistent clear scan before using it again? As long as
+        # it becomes a candidate again later this is fine.
+        #
+        # ignore readings for our own C0 (else, we never consider our
+        # own used arfcn safe until we scan it 100 times again!)
+        #del(rssis[self.gsmd.current_arfcn])
+
+        self.update_rssi_db(rssis)
+        self.loop.record("report_to_update", time.time() - min(arrivals.values()))
+
+    def tick(self):
+        """
+        Housekeeping every SLEEP_TIME seconds, whether or not reports are
+        coming in: expire old channels and say how we're doing.
+        """
+        logging.info("Current ARFCN: %s" % self.bts.current_arfcn)
+        self.update_rssi_db({})
+        logging.info("Safe ARFCNs: %s" % str(self.safe_arfcns()))
+        logging.info("Coverage: %s" % self.scheduler.coverage())
+        logging.debug("Latencies: %s" % self.loop.stats())
+        self.loop.call_later(self.SLEEP_TIME, self.tick)
 
 
 """
-This controller uses two BTS units to implement handover-based scanning.
+This controller uses any number of BTS units to implement handover-based
+scanning.
 """
 class HandoverController(Controller):
-    def __init__(self, bts1_conf, bts2_conf, nct, sleep, max_delta, gsmwsdb, loglvl=logging.DEBUG):
+    def __init__(self, bts_confs, nct, sleep, max_delta, gsmwsdb, loglvl=logging.DEBUG, snapshot=60,
+                 workers=4, deadline=30, fixed_neighbors=False, history=None):
         """
-        A BTS config dictionary has the following items:
+        bts_confs is a list of BTS config dictionaries, one per BTS unit. A
+        BTS config dictionary has the following items:
         - db_loc: The OpenBTS.db location for this BTS
         - openbts_proc: The name of the OpenBTS process, so we can kill it if necessary
         - trans_proc: The name of the transceiver process, so we can kill it if necessary
         - bts_class: The type of BTS this is (bts.BTS or bts.OldBTS, for example)
-        - stream: The stream to read from (either sys.STDIN or a gsm.command_stream)
+        - stream: The stream to read from (sys.STDIN, a gsm.command_stream or a gsm.GSMTAPStream)
         - start_cmd: A shell command that can properly restart this BTS
+        - peer: Optional. This BTS's peering address ("ip:port"), which the
+          other units list as a real neighbor, so handsets can hand over to it
+
+        Anything that blocks on a BTS (config reads, CLI commands, restarts)
+        runs on a pool of worker threads, at most one per BTS at a time, and
+        is given up on if it can't start within deadline seconds.
+
+        fixed_neighbors runs the two-BTS spectrum analyzer experiment (see
+        cycle_neighbors) instead of scanning the band.
+
+        history is a directory to keep every ARFCN's RSSI history in (see
+        history.HistoryStore), if we should.
         """
-        self.BTS_CONF = [bts1_conf, bts2_conf]
+        self.BTS_CONF = list(bts_confs)
 
         self.NEIGHBOR_CYCLE_TIME = nct # seconds to wait before switching up the neighbor list
-        self.SLEEP_TIME = sleep # seconds between rssi checks
+        self.SLEEP_TIME = sleep # seconds between housekeeping passes
         self.MAX_DELTA = max_delta # max difference in rssi measurements between ARFCNs
+        self.WORKERS = workers # threads for talking to BTS units
+        self.DEADLINE = deadline # seconds a BTS action may wait to run
+        self.FIXED_NEIGHBORS = fixed_neighbors
+
+        # reports over MAX_DELTA on an off BTS's ARFCN mean interference
+        self.detector = interference.InterferenceDetector(threshold=max_delta)
 
         self.gsmwsdb_location = gsmwsdb
-        self.gsmwsdb_lock = threading.Lock()
-        self.gsmwsdb = sqlite3.connect(gsmwsdb)
+        self.aggregator = aggregator.Aggregator(gsmwsdb, history_location=history)
+
+        self.SNAPSHOT_TIME = snapshot # seconds between channel state snapshots
+        self.channels = channels.ChannelState()
+        self.last_snapshot = time.time()
+        self.scheduler = scheduler.ScanScheduler(self.channels.scan_range)
 
         self.bts_units = []
+        self.by_decoder = {} # decoder id -> bts
+        self.setup_lock = threading.Lock() # guards made and abandoned
+        self.made = {} # decoder id -> what _make_bts returned, until setup_bts takes it
+        self.abandoned = set() # decoder ids setup_bts gave up on
 
         self.loglvl = loglvl
         logging.basicConfig(
@@ -198,22 +264,62 @@ class HandoverController(Controller):
             filename='/var/log/gsmws.log',level=loglvl)
         logging.warning("New HandoverController started.")
 
+    def _make_bts(self, conf, id_num, now):
+        gsmd = decoder.GSMDecoder(conf['stream'], self.aggregator,
+                                  loglvl=self.loglvl, decoder_id=id_num)
+        bts = conf['bts_class'](conf['db_loc'], conf['openbts_proc'], conf['trans_proc'],
+                                self.loglvl, id_num=id_num,
+                                start_time=(now+datetime.timedelta(seconds=90*id_num)))
+        bts.peer = conf.get('peer')
+
+        if not bts.offset_correct:
+            raise ValueError("Non-default TRX.RadioFrequencyOffset, verify radios are properly configured.")
+
+        bts.init_decoder(gsmd)
+        return bts, bts.current_arfcn, bts.is_off()
+
+    def _made_bts(self, id_num, made):
+        """ _make_bts finished (on a worker): hand it to setup_bts, or drop it if that gave up """
+        with self.setup_lock:
+            if id_num not in self.abandoned:
+                self.made[id_num] = made
+                return
+        logging.warning("BTS %d came up after we gave up on it, shutting it down" % id_num)
+        self.aggregator.unregister(id_num)
+        stop = getattr(made[0].decoder, 'stop', None)
+        if stop is not None:
+            stop()
+
     def setup_bts(self):
+        """
+        Bring up every BTS at once. Any that aren't up within DEADLINE
+        seconds are left out, rather than holding up the rest, and their
+        decoders are shut down (and unregistered from the aggregator) if
+        they do come up later.
+        """
         cycle_offset = self.NEIGHBOR_CYCLE_TIME / float(len(self.BTS_CONF))
-        cycle_count = 0
 
         now = datetime.datetime.now()
-        for conf in self.BTS_CONF:
-            gsmd = decoder.GSMDecoder(conf['stream'], self.gsmwsdb_lock, self.gsmwsdb_location,
-                                      loglvl=self.loglvl, decoder_id=cycle_count)
-            bts = conf['bts_class'](conf['db_loc'], conf['openbts_proc'], conf['trans_proc'],
-                                    self.loglvl, id_num=cycle_count,
-                                    start_time=(now+datetime.timedelta(seconds=90*cycle_count)))
-
-            if not bts.offset_correct:
-                raise ValueError("Non-default TRX.RadioFrequencyOffset, verify radios are properly configured.")
-
-            bts.init_decoder(gsmd)
+        start = time.time()
+        pending = [(cycle_count, self.units.pool.apply_async(
+                        self._make_bts, (conf, cycle_count, now),
+                        callback=lambda made, n=cycle_count: self._made_bts(n, made)))
+                   for cycle_count, conf in enumerate(self.BTS_CONF)]
+        for cycle_count, result in pending:
+            result.wait(max(0, start + self.DEADLINE - time.time()))
+            with self.setup_lock:
+                made = self.made.pop(cycle_count, None)
+                if made is None and not result.ready():
+                    self.abandoned.add(cycle_count)
+            if made is None:
+                if result.ready():
+                    result.get() # it failed; raise why
+                logging.error("BTS %d didn't come up within %ss, leaving it out"
+                              % (cycle_count, self.DEADLINE))
+                self.aggregator.unregister(cycle_count)
+                continue
+            bts, arfcn, off = made
+            self.detector.watch(bts, arfcn, off)
 
             # set up cycle time/ignored since
             bts.ignored_since = now
@@ -221,118 +327,156 @@ class HandoverController(Controller):
             bts.last_cycle_time = now - datetime.timedelta(seconds = (cycle_count*cycle_offset + self.NEIGHBOR_CYCLE_TIME))
 
             self.bts_units.append(bts)
-            cycle_count += 1
+            self.by_decoder[cycle_count] = bts
+        if not self.bts_units:
+            raise ValueError("No BTS units came up.")
 
-    def pick_new_neighbors(self, bts_id_num, testing=True):
-        other_arfcns = [b.current_arfcn for b in self.bts_units if b.id_num != bts_id_num] # FIXME
-        if testing:
-            random_arfcns = [x.current_arfcn+10 for x in self.bts_units if x.current_arfcn!=None]
-        else:
-            with self.gsmwsdb_lock:
-                available_arfcns = self.gsmwsdb.execute("SELECT ARFCN FROM AVAIL_ARFCN").fetchall()
-                existing = [arfcn for res in available_arfcns for arfcn in res]
-            random_arfcns = random.sample([_ for _ in range(1,124) if
-                                          (_ not in existing and _ not in other_arfcns)],
-                                          5 - len(other_arfcns))
-        logging.info("BTS %d: Current ARFCN=%s Other ARFCNs: %s Random ARFCNs: %s"
-                     % (bts_id_num, self.bts_units[bts_id_num].current_arfcn,
-                        other_arfcns, random_arfcns))
-        return other_arfcns + random_arfcns
+    def pick_new_neighbors(self, bts_id_num):
+        """
+        Our other BTS units' ARFCNs (so handsets report on them, and we can
+        tell if they're being interfered with), plus the ARFCNs the
+        scheduler says need scanning most that no other BTS is scanning.
+        """
+        other_arfcns = [b.current_arfcn for b in self.bts_units if b.id_num != bts_id_num]
+        own_arfcns = [b.current_arfcn for b in self.bts_units]
+        scan_arfcns = self.scheduler.assign(bts_id_num, max(0, 5 - len(other_arfcns)),
+                                            exclude=own_arfcns)
+        logging.info("BTS %d: Current ARFCN=%s Other ARFCNs: %s Scan ARFCNs: %s"
+                     % (bts_id_num, self.by_decoder[bts_id_num].current_arfcn,
+                        other_arfcns, scan_arfcns))
+        return other_arfcns + scan_arfcns
 
     def main(self):
         self.initdb() # set up the gsmws db
+        self.loop = events.EventLoop(self.on_reports)
+        self.units = fanout.UnitPool(self.loop, self.WORKERS, self.DEADLINE)
         self.setup_bts() # set up the BTS units
 
-        restarted = False
-
-        while True:
-            try:
-                now = datetime.datetime.now()
-
-                # disable ignore reports if expired
-                for bts in self.bts_units:
-                    if bts.decoder.ignore_reports and (now - bts.ignored_since).seconds > 120:
-                        bts.decoder.ignore_reports = False
-
-                for bts in self.bts_units:
-                    logging.info("BTS %d. Reported ARFCN=%s Intended Neighbors=%s Reported Neighbors=%s"
-                                 % (bts.id_num, bts.current_arfcn, sorted(bts.neighbors), sorted(bts.last_arfcns)))
-
-                for bts in self.bts_units:
-                    """
-                    For this test, we only care about monitoring the
-                    pre-defined ARFCN on which we're running our second C0 and
-                    on which the primary BTS will run. We keep these all pretty
-                    close together so we can have everything show up on our
-                    spectrum analyzer, which only has 5MHz of usable
-                    bandwidth...
-
-                    We proceed as follows. Every iteration, we update the
-                    txatten based on our warbling frequency algorithm defined
-                    in bts.py. We keep track of measurement reports we get
-                    back. If we receive a report exceeding threshold T for a
-                    BTS that's off, we assume we've got interference on that
-                    BTS. So, we shut it down, and move to a different arfcn.
-                    This shouldn't affect anyone, since there shouldn't be
-                    calls on it.
-
-                    For the experiment, BTS0 is on ARFCN 20 (939.0), BTS1 and
-                    the primary are on ARFCN 30 (941.0). After detecting the
-                    primary, we switch BTS1 to ARFCN 40 (943.0). We artificially
-                    constrain this just to keep everything on the same figure;
-                    we could change frequencies arbitrarily.
-                    """
-                    bts.next_atten_state() # start updating the power levels for the bts units
-
-                    # this block is where we set new neighbors and stuff
-                    td = (now - bts.last_cycle_time)
-                    logging.debug("BTS %d td=%s, cycle=%d" % (bts.id_num, td.seconds, self.NEIGHBOR_CYCLE_TIME))
-                    if td.seconds > self.NEIGHBOR_CYCLE_TIME:
-                        if bts.id_num == 0:
-                            new_neighbors = [30, 40]
-                        else:
-                            new_neighbors = [20, 40]
-                        logging.info("New neighbors (BTS %d): %s" % (bts.id_num, new_neighbors))
-
-                        neighbor_port = 16002 if bts.id_num==0 else 16001
-                        bts.set_neighbors(new_neighbors, neighbor_port, num_real=1)
-                        bts.decoder.ignore_reports = True
-                        bts.ignored_since = now
-                        bts.last_cycle_time = now
-
-                    # continually do this so OpenBTS doesn't delete these
-                    if restarted:
-                        bts.set_neighbors(bts.neighbors, neighbor_port, num_real=1)
-
-                    rssis = bts.decoder.rssi()
-                    self.update_rssi_db(rssis)
-                    logging.debug("Safe ARFCNs (BTS %d): %s" % (bts.id_num, str(self.safe_arfcns())))
-
-                # check each BTS's reports. If we find a report that exceeds
-                # MAX_DELTA for an off BTS in it, then we need to restart that
-                # BTS.
-                to_restart = set()
-
-                arfcn_to_bts = dict(zip([b.current_arfcn for b in self.bts_units], [b for b in self.bts_units]))
-                reports = []
-                for bts in self.bts_units:
-                    reports += bts.reports
-
-                for r in reports:
-                    for t in r:
-                        if t in arfcn_to_bts:
-                            logging.debug("Report bts %d (ARFCN %s) is_off=%s report=%d"
-                                          % (arfcn_to_bts[t].id_num, t, arfcn_to_bts[t].is_off(), r[t]))
-
-                            # 10 is a good threshold... could be set lower, but w/e
-                            if r[t] > 10 and arfcn_to_bts[t].is_off():
-                                to_restart |= set([arfcn_to_bts[t],])
-
-                logging.info("to_restart: %s" % (to_restart))
-                # kill what needs to be killed
-                for bts in to_restart:
-                    bts.change_arfcn(bts.current_arfcn + 10, True)
-
-                time.sleep(self.SLEEP_TIME)
-            except KeyboardInterrupt:
-                break
+        self.aggregator.add_listener(self.loop.notify)
+        now = datetime.datetime.now()
+        for bts in self.bts_units:
+            due = bts.last_cycle_time + datetime.timedelta(seconds=self.NEIGHBOR_CYCLE_TIME)
+            self.loop.call_later(max(0, (due - now).total_seconds()), self.cycle_neighbors, bts)
+        self.tick()
+        self.run_loop()
+
+    def cycle_neighbors(self, bts):
+        """
+        Give bts a new neighbor list to scan (see pick_new_neighbors).
+
+        With FIXED_NEIGHBORS, we only care about monitoring the pre-defined
+        ARFCN on which we're running our second C0 and on which the primary
+        BTS will run. We keep these all pretty close together so we can have
+        everything show up on our spectrum analyzer, which only has 5MHz of
+        usable bandwidth...
+
+        For the experiment, BTS0 is on ARFCN 20 (939.0), BTS1 and the primary
+        are on ARFCN 30 (941.0). After detecting the primary, we switch BTS1
+        to ARFCN 40 (943.0). We artificially constrain this just to keep
+        everything on the same figure; we could change frequencies
+        arbitrarily.
+        """
+        if not self.FIXED_NEIGHBORS:
+            new_neighbors = self.pick_new_neighbors(bts.id_num)
+        elif bts.id_num == 0:
+            new_neighbors = [30, 40]
+        else:
+            new_neighbors = [20, 40]
+        logging.info("New neighbors (BTS %d): %s" % (bts.id_num, new_neighbors))
+
+        real = [b.peer for b in self.bts_units if b is not bts and b.peer]
+        self.units.submit(bts, "set_neighbors", bts.set_neighbors, (new_neighbors, real),
+                          deadline=self.NEIGHBOR_CYCLE_TIME)
+        self.ignore_reports(bts)
+        bts.last_cycle_time = datetime.datetime.now()
+        self.loop.call_later(self.NEIGHBOR_CYCLE_TIME, self.cycle_neighbors, bts)
+
+    def tick(self):
+        """
+        Every SLEEP_TIME seconds, we update the txatten based on our warbling
+        frequency algorithm defined in bts.py, and expire old channels. The
+        BTS units are updated in the background; a BTS that's still busy
+        from last time just skips a step.
+        """
+        for bts in self.bts_units:
+            logging.info("BTS %d. Reported ARFCN=%s Intended Neighbors=%s Reported Neighbors=%s"
+                         % (bts.id_num, bts.current_arfcn, sorted(bts.neighbors), sorted(bts.last_arfcns)))
+            busy = self.units.busy(bts)
+            if busy is not None:
+                logging.warning("BTS %d has been busy with %s for %.1fs" % ((bts.id_num,) + busy))
+            self.units.submit(bts, "warble", self._warble, (bts,), deadline=self.SLEEP_TIME,
+                              callback=lambda off, error, bts=bts: self.warbled(bts, off, error))
+        self.update_rssi_db({})
+        logging.info("Coverage: %s" % self.scheduler.coverage())
+        logging.debug("Latencies: %s Detector: %s Units: %s"
+                      % (self.loop.stats(), self.detector.stats(), self.units.stats()))
+        self.loop.call_later(self.SLEEP_TIME, self.tick)
+
+    def _warble(self, bts):
+        """ Step bts's power level (on a worker). Returns whether it's off now. """
+        bts.next_atten_state() # start updating the power levels for the bts units
+        return bts.is_off()
+
+    def warbled(self, bts, off, error):
+        if error is None:
+            self.detector.set_off(bts, off)
+
+    def on_reports(self, arrivals):
+        """
+        Some decoders have new reports (arrivals is decoder id -> when the
+        first of them came in). Update our RSSIs from them and check for
+        interference right away.
+        """
+        # leave out units setup_bts gave up on, until they're shut down
+        arrivals = dict((d, arrived) for d, arrived in arrivals.items() if d in self.by_decoder)
+        if not arrivals:
+            return
+        for decoder_id in arrivals:
+            bts = self.by_decoder[decoder_id]
+            rssis = bts.decoder.rssi()
+            self.update_rssi_db(rssis)
+            logging.debug("Safe ARFCNs (BTS %d): %s" % (bts.id_num, str(self.safe_arfcns())))
+        now = time.time()
+        self.loop.record("report_to_update", now - min(arrivals.values()))
+
+        # Each new report goes to the scheduler (which ARFCNs it heard, and
+        # how strong) and through the detector, once. If the detector sees
+        # one of our ARFCNs over threshold while that BTS is off, we assume
+        # we've got interference on that BTS. So, we shut it down, and move
+        # to a different arfcn. This shouldn't affect anyone, since there
+        # shouldn't be calls on it.
+        to_restart = set()
+        for decoder_id in arrivals:
+            for report in self.by_decoder[decoder_id].decoder.reports.getall():
+                self.scheduler.observe(report, now)
+                to_restart.update(self.detector.observe(report))
+
+        if to_restart:
+            logging.info("to_restart: %s" % (to_restart))
+        # kill what needs to be killed, in the background, so the other BTS
+        # units carry on while this one restarts
+        arrived = min(arrivals.values())
+        for bts in to_restart:
+            new_arfcn = bts.current_arfcn + 10
+            # watch the new ARFCN now, so more reports on the old one don't
+            # restart it again; restarted() puts the old one back if need be
+            old = (self.detector.arfcns.get(bts), self.detector.off.get(bts))
+            self.detector.watch(bts, new_arfcn, off=False)
+            self.loop.record("report_to_restart", time.time() - arrived)
+            self.units.submit(bts, "restart", bts.change_arfcn, (new_arfcn, True),
+                              callback=lambda result, error, bts=bts, old=old:
+                                  self.restarted(bts, arrived, old, result, error))
+
+    def restarted(self, bts, arrived, old, result, error):
+        if error is not None or result is False:
+            # it never moved (or was skipped), so it's still on the old ARFCN
+            logging.error("BTS %d didn't move off ARFCN %s: %s"
+                          % (bts.id_num, old[0], error or "ARFCN rejected"))
+            self.detector.watch(bts, *old)
+            return
+        logging.info("BTS %d restarted on ARFCN %s" % (bts.id_num, self.detector.arfcns[bts]))
+        self.loop.record("report_to_restarted", time.time() - arrived)
+
+    def shutdown(self):
+        Controller.shutdown(self)
+        self.units.close()
@@ -3,244 +3,505 @@ This file is part of GSMWS.
 """
 
 import gsm
+import metrics
 import collections
 import threading
 import logging
 import datetime
-import Queue
-import sqlite3
+import json
+import struct
+import time
 import zmq
 
+DECODE_TIME = metrics.REGISTRY.histogram("gsmws_decode_seconds",
+                                         "Time to decode and handle one message, by message type",
+                                         ["type"])
+MESSAGES = metrics.REGISTRY.counter("gsmws_messages_total", "Messages read, by source", ["source"])
+REPORTS = metrics.REGISTRY.counter("gsmws_reports_total",
+                                   "Measurement reports, by what became of them", ["result"])
+QUEUE_DEPTH = metrics.REGISTRY.gauge("gsmws_queue_depth", "Items waiting in a queue or buffer",
+                                     ["queue"])
+
+_ACCEPTED = REPORTS.labels("accepted")
+_IGNORED = REPORTS.labels("ignored") # ignore_reports was set
+_SKIPPED = REPORTS.labels("skipped") # no serving cell or neighbor list yet
+_INVALID = REPORTS.labels("invalid")
+
 class MeasurementReportList(object):
+    """
+    A fixed-capacity, thread-safe ring buffer of reports. Reports are usually
+    gsm.CompactReports, but anything works. Each report gets the next
+    sequence number as it goes in; when the buffer's full, the newest
+    overwrites the oldest (counted in evicted).
+
+    Reading doesn't take reports out, so any number of consumers can each
+    follow along with their own cursor() (or a sequence number of their
+    own, with read()), and a slow one is told how many reports it missed.
+    getall() and get() read from a built-in cursor, for the one consumer
+    that only wants what's new since it last looked; len() is how far
+    behind that cursor is.
+    """
     def __init__(self, maxlen=10000):
         self.lock = threading.Lock()
+        self.added = threading.Condition(self.lock)
         self.maxlen = maxlen
-        self.reports = collections.deque(maxlen=maxlen)
+        self.ring = [None] * maxlen
+        self.next_seq = 0 # the sequence number the next report will get
+        self.evicted = 0
+        self.default = Cursor(self, 0)
 
     def put(self, report):
         with self.lock:
-            self.reports.append(report)
+            if self.next_seq >= self.maxlen:
+                self.evicted += 1
+            self.ring[self.next_seq % self.maxlen] = report
+            self.next_seq += 1
+            self.added.notify_all()
 
-    def get(self):
+    def put_many(self, reports):
+        with self.lock:
+            before = self.next_seq
+            if len(reports) > self.maxlen:
+                # only the last maxlen could survive anyway
+                self.next_seq += len(reports) - self.maxlen
+                reports = reports[-self.maxlen:]
+            i = self.next_seq % self.maxlen
+            head = reports[:self.maxlen - i]
+            self.ring[i:i + len(head)] = head
+            self.ring[:len(reports) - len(head)] = reports[len(head):]
+            self.next_seq += len(reports)
+            self.evicted += max(0, self.next_seq - self.maxlen) - max(0, before - self.maxlen)
+            self.added.notify_all()
+
+    def first_seq(self):
+        """ The sequence number of the oldest report we still have """
+        return max(0, self.next_seq - self.maxlen)
+
+    def read(self, seq, limit=None):
+        """
+        Reports from sequence number seq on, up to limit of them. Returns
+        (reports, the seq to read from next, how many after seq were
+        overwritten before we got to them).
+        """
         with self.lock:
-            self.reports.popleft()
+            return self._read(seq, limit)
+
+    def _read(self, seq, limit):
+        first = max(0, self.next_seq - self.maxlen)
+        missed = max(0, first - seq)
+        start = max(seq, first)
+        end = self.next_seq if limit is None else min(self.next_seq, start + limit)
+        if end <= start:
+            return [], start, missed
+        i, j = start % self.maxlen, end % self.maxlen
+        if i < j:
+            reports = self.ring[i:j]
+        else:
+            reports = self.ring[i:] + self.ring[:j]
+        return reports, end, missed
+
+    def wait(self, seq, timeout):
+        """ Wait up to timeout seconds for a report numbered seq or later. True if there is one. """
+        deadline = time.time() + timeout
+        with self.lock:
+            while self.next_seq <= seq:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.added.wait(remaining)
+            return True
+
+    def cursor(self, oldest=False):
+        """ A new Cursor, at the next report to come in (or the oldest we have) """
+        with self.lock:
+            return Cursor(self, self.first_seq() if oldest else self.next_seq)
+
+    def get(self):
+        """ The next report for the built-in cursor, or None """
+        reports = self.default.read(1)
+        return reports[0] if reports else None
 
     def getall(self):
-        with self.lock:
-            reports, self.reports = self.reports, collections.deque(maxlen=self.maxlen)
-        return list(reports)
+        """ Every report since the last getall(), as far as we still have them """
+        return self.default.read()
+
+    def __len__(self):
+        return self.default.lag()
 
-class EventDecoder(threading.Thread):
+class Cursor(object):
+    """
+    One consumer's place in a MeasurementReportList. missed counts reports
+    that were overwritten before this consumer read them. Reads move the
+    cursor under the list's lock, so threads sharing a cursor (e.g., the
+    built-in one) each get different reports.
+    """
+    def __init__(self, reports, seq):
+        self.reports = reports
+        self.seq = seq
+        self.missed = 0
+
+    def read(self, limit=None):
+        """ The reports since we last read, up to limit of them """
+        with self.reports.lock:
+            reports, self.seq, missed = self.reports._read(self.seq, limit)
+            self.missed += missed
+        return reports
+
+    def wait(self, timeout):
+        """ Wait up to timeout seconds for something to read(). True if there is. """
+        return self.reports.wait(self.seq, timeout)
+
+    def lag(self):
+        """ How many reports we haven't read (including any we're about to miss) """
+        return min(self.reports.next_seq - self.seq, self.reports.maxlen)
+
+def parse_events(messages):
+    """ Decode a batch of JSON messages. Malformed ones come back as None. """
+    events = []
+    loads = json.loads
+    for msg in messages:
+        try:
+            events.append(loads(msg))
+        except ValueError:
+            events.append(None)
+    return events
+
+class EventSource(object):
     """
-    The EventDecoder listens for PhysicalStatus API events from OpenBTS and
-    stores them in an in-memory MeasurementReportList. Unlike GSMDecoder, the
-    EventDecoder does no further processing on them -- they are passed along
-    as-is for interpretation later. We don't even decode the JSON, as these are
-    intended to be pulled via an API from a BTS, so why bother?
+    One OpenBTS PhysicalStatus subscription: a SUB socket on some context,
+    the MeasurementReportList its events go into, and counters. Something
+    else (an EventDecoder or an EventMultiplexer) decides when to read it.
+
+    Events are stored as-is, undecoded: these are intended to be pulled via
+    an API from a BTS, so why bother? Local consumers can set decode=True to
+    get gsm.CompactReports instead; the serving cell is only included if
+    current_arfcn is set (bts.BTS keeps it up to date).
+
+    ZMQ holds up to hwm messages for us while we're busy and silently drops
+    the rest, so a burst goes to the socket's queue instead of evicting
+    reports we've buffered. stats() has what we received, what was malformed
+    (or had no measurement) and what was evicted from the buffer. It can't
+    say what ZMQ dropped at the high-water mark: we never see those, and
+    PhysicalStatus events carry no sequence number to spot the gaps with.
     """
-    def __init__(self, host="tcp://localhost:45160", maxlen=1000, loglvl=logging.INFO):
+    def __init__(self, context, host, maxlen=1000, decode=False, hwm=10000, batch=500):
+        self.host = host
+        self.socket = context.socket(zmq.SUB)
+        self.socket.setsockopt(zmq.RCVHWM, hwm)
+        self.socket.connect(host)
+        self.socket.setsockopt(zmq.SUBSCRIBE, "")
+
+        self.reports = MeasurementReportList(maxlen)
+        QUEUE_DEPTH.labels("events %s" % host).set_function(self.reports.__len__)
+        self.decode = decode
+        self.current_arfcn = None
+        self.batch = batch
+
+        self.received = 0
+        self.malformed = 0
+        self.batches = 0
+
+    def drain(self):
+        """ Everything waiting on the socket, up to batch messages """
+        msgs = []
+        while len(msgs) < self.batch:
+            try:
+                msgs.append(self.socket.recv(zmq.NOBLOCK))
+            except zmq.Again:
+                break
+        return msgs
+
+    def ingest(self, msgs):
+        """ Decode (if we're decoding) and store a batch of messages """
+        if not msgs:
+            return
+        self.received += len(msgs)
+        self.batches += 1
+        MESSAGES.labels("physical_status").inc(len(msgs))
+        if self.decode:
+            start = time.time()
+            reports = []
+            for event in parse_events(msgs):
+                try:
+                    report = gsm.physical_status_report(event, self.current_arfcn)
+                except (ValueError, KeyError, TypeError):
+                    report = None
+                if report is not None:
+                    reports.append(report)
+            if len(reports) < len(msgs):
+                logging.debug("Ignoring %d malformed PhysicalStatus events from %s"
+                              % (len(msgs) - len(reports), self.host))
+            self.malformed += len(msgs) - len(reports)
+            DECODE_TIME.labels("physical_status").observe((time.time() - start) / len(msgs))
+            _ACCEPTED.inc(len(reports))
+            _INVALID.inc(len(msgs) - len(reports))
+            msgs = reports
+        self.reports.put_many(msgs)
+
+    def stats(self):
+        return {'received': self.received,
+                'malformed': self.malformed,
+                'evicted': self.reports.evicted,
+                'buffered': len(self.reports),
+                'batches': self.batches}
+
+    def close(self):
+        QUEUE_DEPTH.remove("events %s" % self.host)
+        self.socket.close()
+
+class EventDecoder(EventSource, threading.Thread):
+    """
+    The EventDecoder listens for PhysicalStatus API events from one OpenBTS
+    and stores them in an in-memory MeasurementReportList (see EventSource).
+    Unlike GSMDecoder, the EventDecoder does no further processing on them.
+
+    We wait for one message, then drain whatever else is waiting on the
+    socket (up to batch messages) without blocking, and decode and store the
+    lot at once.
+
+    This takes a thread and a zmq.Context per BTS; use an EventMultiplexer to
+    listen to several from one thread.
+    """
+    def __init__(self, host="tcp://localhost:45160", maxlen=1000, loglvl=logging.INFO, decode=False,
+                 hwm=10000, batch=500):
         threading.Thread.__init__(self)
         logging.basicConfig(format='%(asctime)s %(module)s %(funcName)s %(lineno)d %(levelname)s %(message)s',
                             filename='/var/log/gsmws.log',level=loglvl)
 
         # Connect to OpenBTS event stream
         self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.SUB)
-        self.socket.connect(host)
-        self.socket.setsockopt(zmq.SUBSCRIBE, "")
-
-        self.reports = MeasurementReportList(maxlen)
+        EventSource.__init__(self, self.context, host, maxlen, decode, hwm, batch)
+        self.stopped = threading.Event()
 
     def run(self):
         """
-        Main processing loop. Run forever!
+        Main processing loop. Run until stop()ped.
         """
-        while True:
-            msg = self.socket.recv()
-            self.reports.put(msg)
+        while not self.stopped.is_set():
+            if not self.socket.poll(1000):
+                continue
+            self.ingest(self.drain())
+        self.close()
+
+    def stop(self):
+        self.stopped.set()
+
+class EventMultiplexer(threading.Thread):
+    """
+    Listens for PhysicalStatus events from any number of OpenBTS instances
+    with one thread, one zmq.Context and one zmq.Poller. subscribe() to an
+    endpoint to get an EventSource, whose reports buffer fills up just like
+    an EventDecoder's; each message goes to the source of the socket it came
+    in on.
+
+    Sources can come and go while we're running; new ones are picked up
+    within poll_timeout ms. Each pass reads at most batch messages from each
+    ready socket, so one busy BTS can't starve the others.
+    """
+    def __init__(self, loglvl=logging.INFO, poll_timeout=1000):
+        threading.Thread.__init__(self)
+        logging.basicConfig(format='%(asctime)s %(module)s %(funcName)s %(lineno)d %(levelname)s %(message)s',
+                            filename='/var/log/gsmws.log',level=loglvl)
+        self.daemon = True
+        self.context = zmq.Context()
+        self.poller = zmq.Poller()
+        self.poll_timeout = poll_timeout
+        self.lock = threading.Lock() # guards the changes lists
+        self.added = []
+        self.removed = []
+        self.sources = {} # socket -> EventSource, poller thread only
+        self.stopped = threading.Event()
+
+    def subscribe(self, host, maxlen=1000, decode=False, hwm=10000, batch=500):
+        """ Start listening to host. Returns its EventSource. """
+        with self.lock:
+            source = EventSource(self.context, host, maxlen, decode, hwm, batch)
+            self.added.append(source)
+        return source
+
+    def unsubscribe(self, source):
+        with self.lock:
+            self.removed.append(source)
+
+    def _apply_changes(self):
+        with self.lock:
+            added, self.added = self.added, []
+            removed, self.removed = self.removed, []
+        for source in added:
+            self.sources[source.socket] = source
+            self.poller.register(source.socket, zmq.POLLIN)
+        for source in removed:
+            if source.socket in self.sources:
+                self.poller.unregister(source.socket)
+                del self.sources[source.socket]
+            source.close()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self._apply_changes()
+            for socket, _ in self.poller.poll(self.poll_timeout):
+                source = self.sources[socket]
+                source.ingest(source.drain())
+        self._apply_changes()
+        for source in self.sources.values():
+            source.close()
+
+    def stop(self):
+        self.stopped.set()
+
+    def stats(self):
+        """ host -> EventSource.stats() """
+        with self.lock:
+            sources = list(self.sources.values()) + self.added
+        return dict((source.host, source.stats()) for source in sources)
 
 
 class GSMDecoder(threading.Thread):
     """
     DEPRECATED
 
-    This is responsible for managing the packet stream from tshark, processing
-    reports, and storing the data.
+    This is responsible for managing the packet stream from tshark and
+    processing reports. Valid reports go onto our queue to the
+    aggregator.Aggregator, which keeps the RSSI state and stores the data, so
+    we never wait on the database.
     """
-    def __init__(self, stream, db_lock, gsmwsdb_location="/tmp/gsmws.db", maxlen=100, loglvl=logging.INFO, decoder_id=0):
+    def __init__(self, stream, aggregator, loglvl=logging.INFO, decoder_id=0, report_parser="scan"):
         threading.Thread.__init__(self)
         self.stream = stream
-        self.current_message = ""
+        self.report_parser = report_parser # "scan" or "regex", see gsm.MeasurementReport
+        self.framer = None # created in run()
         self.current_arfcn = None
         self.last_arfcns = []
         self.ncc_permitted = None
         self.ignore_reports = False # ignore measurement reports
         self.msgs_seen = 0
 
-        self.gsmwsdb_lock = db_lock
-        self.gsmwsdb_location = gsmwsdb_location
-        self.gsmwsdb = None # this gets created in run()
-
         self.decoder_id = decoder_id
+        self.messages = MESSAGES.labels("decoder_%d" % decoder_id)
+        self.decode_time = dict((t, DECODE_TIME.labels(t)) for t in
+                                ("measurement_report", "system_information_2", "gsmtap"))
 
-        self.rssi_queue = Queue.Queue()
+        self.aggregator = aggregator
+        self.queue = aggregator.register(decoder_id)
 
         self.reports = MeasurementReportList()
 
-        self.strengths_maxlen = maxlen
-        self.max_strengths = {} # max strength ever seen for a given arfcn
-        self.recent_strengths = {} # last 100 measurement reports for each arfcn
         logging.basicConfig(format='%(asctime)s %(module)s %(funcName)s %(lineno)d %(levelname)s %(message)s', filename='/var/log/gsmws.log',level=loglvl)
         logging.warn("GSMDecoder is deprecated! Use at your own risk.")
 
-
-    def _populate_strengths(self):
-        """
-        Rather than storing our history, we can just store the current mean for
-        each ARFCN, plus the number of recent readings we have. On start, we
-        just add N instances of each ARFCN's mean to the list. This has the
-        downside of being not general (only works with means) and losing
-        history potentially (i.e., we die twice in a row: we'll repopulate with
-        just the mean value from before).
-        """
-        # populate the above from stable
-        with self.gsmwsdb_lock:
-            max_strengths = self.gsmwsdb.execute("SELECT ARFCN, RSSI FROM MAX_STRENGTHS").fetchall()
-            for item in max_strengths:
-                self.max_strengths[item[0]] = item[1]
-
-            recent = self.gsmwsdb.execute("SELECT ARFCN, RSSI, COUNT FROM AVG_STRENGTHS").fetchall()
-            for item in recent:
-                self.recent_strengths[item[0]] = collections.deque([item[1] for _ in range(0,item[2])],maxlen=self.strengths_maxlen)
-
-    def __write_rssi(self):
-        if not self.rssi_queue.empty():
-            with self.gsmwsdb_lock:
-                while not self.rssi_queue.empty():
-                    try:
-                        query = self.rssi_queue.get()
-                        self.gsmwsdb.execute(query[0], query[1])
-                    except Queue.Empty:
-                        break
-                self.gsmwsdb.commit()
-
-
     def rssi(self):
         # returns a dict with a weighted average of each arfcn
         # we base this only on last known data for an ARFCN -- lack of report
         # doesn't mean anything, but if an arfcn is in the neighbor list and we
         # don't get a report for it, we count that as -1.
-
-        res = {}
-        now = datetime.datetime.now()
-
-        for arfcn in self.max_strengths:
-            tot = self.max_strengths[arfcn] + sum(self.recent_strengths[arfcn])
-            res[arfcn] = float(tot) / (1 + len(self.recent_strengths[arfcn]))
-
-            # now, update the db
-            recent_avg = sum(self.recent_strengths[arfcn]) / float(len(self.recent_strengths[arfcn]))
-            self.rssi_queue.put(("DELETE FROM AVG_STRENGTHS WHERE ARFCN=?", (arfcn,)))
-            self.rssi_queue.put(("INSERT INTO AVG_STRENGTHS VALUES (?, ?, ?, ?)", (now, arfcn, recent_avg, len(self.recent_strengths[arfcn]))))
-
-        return res
-
+        return self.aggregator.rssi(self.decoder_id)
 
     def run(self):
-        self.gsmwsdb = sqlite3.connect(self.gsmwsdb_location)
-        self._populate_strengths()
-
-        last_rssi_update = datetime.datetime.now()
-
-        # Main processing loop. We read output from tshark line by line
-        # breaking every time we find a line that is unindented. Unindented
-        # line = new message. The message is then handed off to process(),
-        # which extracts relevant information from it.
-        for line in self.stream:
-            self.__write_rssi()
-            if line.startswith("    "):
-                #print "appending"
-                self.current_message += "%s" % line
-            else:
-                self.process(self.current_message)
-                self.current_message = line
+        # If we're reading GSMTAP straight off the wire, every packet is a
+        # complete message and there's no text to frame.
+        if isinstance(self.stream, gsm.GSMTAPStream):
+            for packet in self.stream:
+                self.process_packet(packet)
+            return
+
+        # Main processing loop. The framer splits tshark's output into
+        # messages, breaking every time it finds a line that is unindented.
+        # Unindented line = new message. Messages we care about are then
+        # handed off to process(), which extracts relevant information from
+        # them; everything else is dropped by the framer.
+        self.framer = gsm.MessageFramer(self.stream)
+        for message in self.framer:
+            self.process(message)
 
     def update_strength(self, strengths):
-        self.update_max_strength(strengths)
-        self.update_recent_strengths(strengths)
-
-    def update_max_strength(self, strengths):
-        with self.gsmwsdb_lock:
-            for arfcn in strengths:
-                value = strengths[arfcn]
-                now = datetime.datetime.now()
-
-                # FIXME potential leak here: we could record max values twice if we're
-                # not in sync w/ db, but that should only happen rarely
-                if arfcn not in self.max_strengths:
-                    self.max_strengths[arfcn] = value
-                    self.gsmwsdb.execute("INSERT INTO MAX_STRENGTHS VALUES(?,?,?)", (now, arfcn, value))
-                elif value > self.max_strengths[arfcn]:
-                    self.max_strengths[arfcn] = value
-                    self.gsmwsdb.execute("UPDATE MAX_STRENGTHS SET TIMESTAMP=?, RSSI=? WHERE ARFCN=?", (now, value, arfcn))
-
-            to_delete = []
-            for arfcn in self.max_strengths:
-                if arfcn not in strengths:
-                    to_delete.append(arfcn)
-                    self.gsmwsdb.execute("DELETE FROM MAX_STRENGTHS WHERE ARFCN=?", (arfcn,))
-            for arfcn in to_delete:
-                del self.max_strengths[arfcn]
-            self.gsmwsdb.commit()
-
-
-
-    def update_recent_strengths(self, strengths):
-        for arfcn in strengths:
-            value = strengths[arfcn]
-            if arfcn in self.recent_strengths:
-                self.recent_strengths[arfcn].append(value)
-            else:
-                self.recent_strengths[arfcn] = collections.deque([value],maxlen=self.strengths_maxlen)
-
-        with self.gsmwsdb_lock:
-            to_delete = []
-            for arfcn in self.recent_strengths:
-                if arfcn not in strengths:
-                    to_delete.append(arfcn)
-                    self.gsmwsdb.execute("DELETE FROM AVG_STRENGTHS WHERE ARFCN=?", (arfcn,))
-
-            for arfcn in to_delete:
-                del self.recent_strengths[arfcn]
-
-        # force a write whenever we update strength
-        self.rssi()
-        self.__write_rssi()
+        if not self.queue.put(strengths):
+            logging.debug("(decoder %d) Aggregator queue full, dropping report" % self.decoder_id)
 
     def process(self, message):
         self.msgs_seen += 1
+        self.messages.inc()
+        start = time.time()
         if message.startswith("GSM A-I/F DTAP - Measurement Report"):
-            if self.ignore_reports or self.current_arfcn is None or len(self.last_arfcns) == 0:
+            if not self.accepting_reports():
                 return # skip for now, we don't have enough data to work with
-
-            report = gsm.MeasurementReport(self.last_arfcns, self.current_arfcn, message)
-            if report.valid:
-                logging.info("(decoder %d) MeasurementReport: " % (self.decoder_id) + str(report))
-                self.reports.put(report.current_strengths)
-                for arfcn in report.current_strengths:
-                    self.update_max_strength(arfcn,report.current_strengths[arfcn])
-                    self.update_recent_strengths(arfcn, report.current_strengths[arfcn])
-
-                for arfcn in report.current_bsics:
-                    if report.current_bsics[arfcn] != None:
-                        logging.debug("ZOUNDS! AN ENEMY BSIC: %d (ARFCN %d, decoder %d)" % (report.current_bsics[arfcn], arfcn, self.decoder_id))
+            self.handle_report(gsm.MeasurementReport(self.last_arfcns, self.current_arfcn, message,
+                                                     parser=self.report_parser))
+            self.decode_time["measurement_report"].observe(time.time() - start)
         elif message.startswith("GSM CCCH - System Information Type 2"):
-            sysinfo2 = gsm.SystemInformationTwo(message)
-            self.last_arfcns = sysinfo2.arfcns
-            self.ncc_permitted = sysinfo2.ncc_permitted
-            logging.debug("(decoder %d) SystemInformation2: %s" % (self.decoder_id, str(sysinfo2.arfcns)))
+            self.handle_sysinfo2(gsm.SystemInformationTwo(message))
+            self.decode_time["system_information_2"].observe(time.time() - start)
         elif message.startswith("GSM TAP Header"):
-            gsmtap = gsm.GSMTAP(message)
-            self.current_arfcn = gsmtap.arfcn
-            logging.debug("(decoder %d) GSMTAP: Current ARFCN=%s" % (self.decoder_id, str(gsmtap.arfcn)))
-
+            self.handle_gsmtap(gsm.GSMTAP(message))
+            self.decode_time["gsmtap"].observe(time.time() - start)
+
+    def accepting_reports(self):
+        """ Whether to handle a measurement report now; counts the ones we don't """
+        if self.ignore_reports:
+            _IGNORED.inc()
+            return False
+        if self.current_arfcn is None or len(self.last_arfcns) == 0:
+            _SKIPPED.inc()
+            return False
+        return True
+
+    def process_packet(self, packet):
+        """
+        Like process(), but for a raw packet from a GSMTAPStream. Each packet
+        carries both the GSMTAP header and the L3 message that tshark would
+        have shown us as two separate messages.
+        """
+        self.msgs_seen += 1
+        self.messages.inc()
+        start = time.time()
+        try:
+            gsmtap = gsm.GSMTAP(packet, parser="binary")
+        except (ValueError, struct.error):
+            logging.debug("(decoder %d) Ignoring malformed GSMTAP packet" % self.decoder_id)
+            return
+        self.handle_gsmtap(gsmtap)
+
+        pd, msg_type = gsmtap.message_type()
+        if pd != gsm.RR_PROTOCOL:
+            self.decode_time["gsmtap"].observe(time.time() - start)
+            return
+        if msg_type == gsm.RR_MEASUREMENT_REPORT:
+            if not self.accepting_reports():
+                return
+            self.handle_report(gsm.MeasurementReport(self.last_arfcns, self.current_arfcn,
+                                                     gsmtap.l3(), parser="binary"))
+            self.decode_time["measurement_report"].observe(time.time() - start)
+        elif msg_type == gsm.RR_SYSTEM_INFORMATION_2:
+            try:
+                self.handle_sysinfo2(gsm.SystemInformationTwo(gsmtap.l3(), parser="binary"))
+            except ValueError as e:
+                logging.debug("(decoder %d) Ignoring SystemInformation2: %s" % (self.decoder_id, e))
+            self.decode_time["system_information_2"].observe(time.time() - start)
+        else:
+            self.decode_time["gsmtap"].observe(time.time() - start)
+
+    def handle_report(self, report):
+        if not report.valid:
+            _INVALID.inc()
+        else:
+            _ACCEPTED.inc()
+            logging.info("(decoder %d) MeasurementReport: " % (self.decoder_id) + str(report))
+            try:
+                strengths = gsm.CompactReport.from_report(report)
+            except ValueError:
+                # not GSM900, keep the dict
+                strengths = report.current_strengths
+            self.reports.put(strengths)
+            self.update_strength(strengths)
+
+            for arfcn in report.current_bsics:
+                if report.current_bsics[arfcn] != None:
+                    logging.debug("ZOUNDS! AN ENEMY BSIC: %d (ARFCN %d, decoder %d)" % (report.current_bsics[arfcn], arfcn, self.decoder_id))
+
+    def handle_sysinfo2(self, sysinfo2):
+        self.last_arfcns = sysinfo2.arfcns
+        self.ncc_permitted = sysinfo2.ncc_permitted
+        logging.debug("(decoder %d) SystemInformation2: %s" % (self.decoder_id, str(sysinfo2.arfcns)))
+
+    def handle_gsmtap(self, gsmtap):
+        self.current_arfcn = gsmtap.arfcn
+        logging.debug("(decoder %d) GSMTAP: Current ARFCN=%s" % (self.decoder_id, str(gsmtap.arfcn)))
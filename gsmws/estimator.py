@@ -0,0 +1,167 @@
+"""
+This file is part of GSMWS.
+"""
+
+import array
+import collections
+
+import gsm
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class RSSIEstimator(object):
+    """
+    Keeps the last maxlen strength readings for each ARFCN, plus the max ever
+    seen, and the weighted average GSMDecoder.rssi() reports:
+
+        (max + sum(recent)) / (1 + len(recent))
+
+    Each ARFCN's readings live in a slice of one big ring buffer, and we keep
+    running sums, counts and maxes next to it, so adding a reading and
+    reading back an average are both O(1). Readings are stored as integer
+    thousandths (reports are whole RXLEVs or -0.001), so the running sums
+    are exact and never drift from what re-summing would give.
+
+    ARFCNs outside 0..num_arfcns (e.g., DCS1800 neighbors) are rare, so they
+    get a plain deque each on the side instead, with the same semantics.
+    averages() only covers the band.
+    """
+    SCALE = 1000
+
+    def __init__(self, maxlen=100, num_arfcns=gsm.NUM_ARFCNS):
+        self.maxlen = maxlen
+        self.num_arfcns = num_arfcns
+        self.ring = array.array('l', [0]) * (num_arfcns * maxlen)
+        self.heads = array.array('l', [0]) * num_arfcns # next slot to write
+        self.counts = array.array('l', [0]) * num_arfcns
+        self.sums = array.array('l', [0]) * num_arfcns
+        self.maxes = array.array('l', [0]) * num_arfcns
+        self.tracked = set()
+        self.others = {} # out-of-band arfcn -> [max, deque of readings], scaled
+
+    def __contains__(self, arfcn):
+        return arfcn in self.tracked or arfcn in self.others
+
+    def arfcns(self):
+        return list(self.tracked) + list(self.others)
+
+    def _in_band(self, arfcn):
+        return 0 <= arfcn < self.num_arfcns
+
+    def add(self, arfcn, value):
+        """ Record a reading. Returns True if it's a new max for arfcn. """
+        scaled = int(round(value * self.SCALE))
+        if not self._in_band(arfcn):
+            other = self.others.get(arfcn)
+            if other is None:
+                self.others[arfcn] = [scaled, collections.deque([scaled], self.maxlen)]
+                return True
+            other[1].append(scaled)
+            if scaled > other[0]:
+                other[0] = scaled
+                return True
+            return False
+        maxes, counts = self.maxes, self.counts
+        new_max = arfcn not in self.tracked or scaled > maxes[arfcn]
+        if new_max:
+            maxes[arfcn] = scaled
+            self.tracked.add(arfcn)
+
+        head = self.heads[arfcn]
+        slot = arfcn * self.maxlen + head
+        if counts[arfcn] == self.maxlen:
+            self.sums[arfcn] += scaled - self.ring[slot]
+        else:
+            counts[arfcn] += 1
+            self.sums[arfcn] += scaled
+        self.ring[slot] = scaled
+        self.heads[arfcn] = head + 1 if head + 1 < self.maxlen else 0
+        return new_max
+
+    def seed(self, arfcn, max_value=None, mean=None, count=0):
+        """
+        Restore an ARFCN from what we persisted: its max, and the mean and
+        count of its recent readings (which we replay as count copies of
+        the mean).
+        """
+        self.forget(arfcn)
+        for _ in range(0, min(count, self.maxlen)):
+            self.add(arfcn, mean)
+        if max_value is None:
+            return
+        if not self._in_band(arfcn):
+            self.others.setdefault(arfcn, [0, collections.deque([], self.maxlen)])
+            self.others[arfcn][0] = int(round(max_value * self.SCALE))
+        else:
+            self.maxes[arfcn] = int(round(max_value * self.SCALE))
+            self.tracked.add(arfcn)
+
+    def forget(self, arfcn):
+        if not self._in_band(arfcn):
+            self.others.pop(arfcn, None)
+            return
+        self.tracked.discard(arfcn)
+        self.heads[arfcn] = 0
+        self.counts[arfcn] = 0
+        self.sums[arfcn] = 0
+        self.maxes[arfcn] = 0
+
+    def update(self, strengths):
+        """
+        Apply a report (ARFCN -> strength): record a reading for each ARFCN in
+        it and forget the ones it doesn't mention, as GSMDecoder always has.
+        """
+        for arfcn in strengths:
+            self.add(arfcn, strengths[arfcn])
+        for arfcn in [a for a in self.arfcns() if a not in strengths]:
+            self.forget(arfcn)
+
+    def _totals(self, arfcn):
+        """ Scaled max, sum and count of arfcn's readings """
+        if not self._in_band(arfcn):
+            other = self.others[arfcn]
+            return other[0], sum(other[1]), len(other[1])
+        return self.maxes[arfcn], self.sums[arfcn], self.counts[arfcn]
+
+    def max(self, arfcn):
+        return self._totals(arfcn)[0] / float(self.SCALE)
+
+    def count(self, arfcn):
+        return self._totals(arfcn)[2]
+
+    def mean(self, arfcn):
+        """ Plain average of the recent readings """
+        _, total, count = self._totals(arfcn)
+        return total / float(self.SCALE * count)
+
+    def rssi(self, arfcn):
+        """ The weighted average, (max + sum) / (1 + n) """
+        top, total, count = self._totals(arfcn)
+        return (top + total) / float(self.SCALE * (1 + count))
+
+    def rssis(self):
+        """ Weighted average for every ARFCN we're tracking, as a dict """
+        return dict((arfcn, self.rssi(arfcn)) for arfcn in self.arfcns())
+
+    def averages(self):
+        """
+        Weighted averages for every ARFCN at once, indexed by ARFCN. Untracked
+        ARFCNs are NaN. This is a numpy array if numpy is installed, else an
+        array of doubles.
+        """
+        if numpy is not None:
+            maxes = numpy.frombuffer(self.maxes, dtype='l')
+            sums = numpy.frombuffer(self.sums, dtype='l')
+            counts = numpy.frombuffer(self.counts, dtype='l')
+            res = (maxes + sums) / (self.SCALE * (1.0 + counts))
+            untracked = numpy.ones(self.num_arfcns, dtype=bool)
+            untracked[list(self.tracked)] = False
+            res[untracked] = numpy.nan
+            return res
+        res = array.array('d', [float('nan')]) * self.num_arfcns
+        for arfcn in self.tracked:
+            res[arfcn] = self.rssi(arfcn)
+        return res
@@ -0,0 +1,163 @@
+"""
+This file is part of GSMWS.
+"""
+
+import heapq
+import itertools
+import os
+import select
+import threading
+import time
+
+import metrics
+
+LOOP_TIME = metrics.REGISTRY.histogram("gsmws_loop_seconds",
+                                       "Time the controller event loop spends handling one wakeup")
+LATENCY = metrics.REGISTRY.histogram("gsmws_latency_seconds",
+                                     "Latencies the event loop records (see EventLoop.record)",
+                                     ["name"])
+
+class Timer(object):
+    """ A scheduled call. cancel() it if it shouldn't run after all. """
+    __slots__ = ('when', 'func', 'args', 'cancelled')
+
+    def __init__(self, when, func, args):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class LatencyStats(object):
+    """ Count, mean, max and last of some latency, in seconds """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.last = seconds
+
+    def stats(self):
+        return {'count': self.count,
+                'mean_ms': self.total * 1000 / self.count if self.count else 0.0,
+                'max_ms': self.max * 1000,
+                'last_ms': self.last * 1000}
+
+class EventLoop(object):
+    """
+    A small select()-based event loop for the controllers, so they react to
+    reports as they come in rather than sleeping and re-polling everything.
+
+    Other threads (e.g., the Aggregator) call notify(source, arrived) when
+    something has new data; we wake up through a self-pipe and hand every
+    source notified since the last wakeup to the on_notify callback as a dict
+    of source -> earliest arrival time, so a burst of reports is handled
+    once. Everything periodic (neighbor cycling, ignore-window expiry) is a
+    timer from call_later(), and other threads can hand us work with
+    call_soon_threadsafe(). Callbacks all run on the thread that called
+    run(), so they don't need locks among themselves.
+
+    record() keeps named latencies (e.g., report arrival to restart) for
+    stats(), and in the gsmws_latency_seconds histogram. How long each
+    wakeup takes to handle goes in gsmws_loop_seconds.
+    """
+    def __init__(self, on_notify=None):
+        self.on_notify = on_notify
+        self.timers = []
+        self.counter = itertools.count() # keeps heap order stable
+        self.lock = threading.Lock() # guards pending and calls
+        self.pending = {}
+        self.calls = [] # (func, args) from other threads
+        self.read_fd, self.write_fd = os.pipe()
+        self.running = False
+        self.latencies = {}
+        self.histograms = {}
+
+    def notify(self, source, arrived=None):
+        """ Say source has new data (thread-safe). arrived defaults to now. """
+        if arrived is None:
+            arrived = time.time()
+        with self.lock:
+            wake = not self.pending and not self.calls
+            if source not in self.pending or arrived < self.pending[source]:
+                self.pending[source] = arrived
+        if wake:
+            os.write(self.write_fd, b"x")
+
+    def call_soon_threadsafe(self, func, *args):
+        """ Run func(*args) on the loop thread, from any thread """
+        with self.lock:
+            wake = not self.pending and not self.calls
+            self.calls.append((func, args))
+        if wake:
+            os.write(self.write_fd, b"x")
+
+    def call_later(self, delay, func, *args):
+        return self.call_at(time.time() + delay, func, *args)
+
+    def call_at(self, when, func, *args):
+        timer = Timer(when, func, args)
+        heapq.heappush(self.timers, (when, next(self.counter), timer))
+        return timer
+
+    def record(self, name, seconds):
+        if name not in self.latencies:
+            self.latencies[name] = LatencyStats()
+            self.histograms[name] = LATENCY.labels(name)
+        self.latencies[name].add(seconds)
+        self.histograms[name].observe(seconds)
+
+    def stats(self):
+        return dict((name, l.stats()) for name, l in self.latencies.items())
+
+    def stop(self):
+        self.running = False
+        os.write(self.write_fd, b"x")
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+    def run(self):
+        """ Run until stop(). Exceptions from callbacks propagate. """
+        self.running = True
+        while self.running:
+            self.run_once()
+
+    def run_once(self, timeout=None):
+        """ Wait for a notification or the next timer, and handle it """
+        while self.timers and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+        if self.timers:
+            wait = max(0.0, self.timers[0][0] - time.time())
+            timeout = wait if timeout is None else min(timeout, wait)
+
+        readable, _, _ = select.select([self.read_fd], [], [], timeout)
+        start = time.time()
+        if readable:
+            os.read(self.read_fd, 4096)
+            with self.lock:
+                pending, self.pending = self.pending, {}
+                calls, self.calls = self.calls, []
+            for func, args in calls:
+                func(*args)
+            if pending:
+                now = time.time()
+                for arrived in pending.values():
+                    self.record("wakeup", now - arrived)
+                if self.on_notify is not None:
+                    self.on_notify(pending)
+
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, timer = heapq.heappop(self.timers)
+            if not timer.cancelled:
+                timer.func(*timer.args)
+        LOOP_TIME.observe(time.time() - start)
@@ -0,0 +1,113 @@
+"""
+This file is part of GSMWS.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+class Expired(Exception):
+    """ What a skipped action's callback gets as its error """
+    pass
+
+class UnitPool(object):
+    """
+    Runs blocking per-BTS actions (config reads, CLI commands, restarts) on
+    a bounded pool of worker threads, so one slow or restarting BTS can't
+    hold up the others or the controller's event loop.
+
+    Each unit's actions run one at a time, in the order they were submitted
+    (they share the unit's NodeManager and CLI sockets), but different units
+    run in parallel, up to workers at once. A unit only ever occupies one
+    worker, so a BTS that's stuck restarting leaves the rest of the pool
+    for everyone else.
+
+    Every action has a deadline (seconds from submission). If it hasn't
+    started by then it's skipped, since whatever asked for it (e.g., a
+    periodic refresh) has asked again by now, and its callback gets an
+    Expired error; if it finishes after it, we count it as late. The deadline
+    only limits when an action may start: we can't interrupt a call once
+    it's running, so one that hangs (a restart that never returns, say)
+    holds its unit's worker, and the unit's later actions queue behind it
+    and expire, until it does. busy() says how long that's been. Results go to callback(result, error) on the event
+    loop's thread, via loop.call_soon_threadsafe().
+    """
+    def __init__(self, loop, workers=4, deadline=30.0):
+        self.loop = loop
+        self.workers = workers
+        self.deadline = deadline
+        self.pool = ThreadPool(workers)
+        self.lock = threading.Lock() # guards queues, active and the counters
+        self.queues = collections.defaultdict(collections.deque) # unit -> jobs
+        self.active = {} # unit -> (name, started) for units with a worker
+        self.counts = collections.defaultdict(collections.Counter) # unit -> counters
+
+    def submit(self, unit, name, func, args=(), callback=None, deadline=None):
+        """ Run func(*args) for unit, eventually """
+        if deadline is None:
+            deadline = self.deadline
+        job = (name, func, args, callback, time.time() + deadline)
+        with self.lock:
+            self.queues[unit].append(job)
+            self.counts[unit]['submitted'] += 1
+            if unit in self.active:
+                return
+            self.active[unit] = (None, None)
+        self.pool.apply_async(self._run_unit, (unit,))
+
+    def _run_unit(self, unit):
+        """ Work through unit's queue on one worker """
+        while True:
+            with self.lock:
+                if not self.queues[unit]:
+                    del self.active[unit]
+                    return
+                name, func, args, callback, deadline = self.queues[unit].popleft()
+                now = time.time()
+                if now > deadline:
+                    self.counts[unit]['expired'] += 1
+                    logging.warning("Skipping %s for BTS %s, past its deadline"
+                                    % (name, getattr(unit, 'id_num', unit)))
+                    if callback is not None:
+                        self.loop.call_soon_threadsafe(callback, None, Expired(name))
+                    continue
+                self.active[unit] = (name, now)
+
+            result, error = None, None
+            try:
+                result = func(*args)
+            except Exception as e:
+                error = e
+                logging.exception("%s failed for BTS %s" % (name, getattr(unit, 'id_num', unit)))
+
+            with self.lock:
+                counts = self.counts[unit]
+                counts['errors' if error is not None else 'completed'] += 1
+                if time.time() > deadline:
+                    counts['late'] += 1
+            if callback is not None:
+                self.loop.call_soon_threadsafe(callback, result, error)
+
+    def busy(self, unit):
+        """ What unit's worker is running and for how long, or None """
+        with self.lock:
+            name, started = self.active.get(unit, (None, None))
+        if started is None:
+            return None
+        return name, time.time() - started
+
+    def backlog(self, unit):
+        with self.lock:
+            return len(self.queues[unit])
+
+    def stats(self):
+        """ unit id -> submitted, completed, errors, expired and late counts """
+        with self.lock:
+            return dict((getattr(unit, 'id_num', unit), dict(counts))
+                        for unit, counts in self.counts.items())
+
+    def close(self):
+        self.pool.close()
@@ -0,0 +1,333 @@
+"""
+This file is part of GSMWS.
+"""
+
+import collections
+import httplib
+import json
+import logging
+import threading
+import time
+import xmlrpclib
+
+import estimator
+import events
+import fanout
+import gsm
+import metrics
+
+"""
+One view of spectrum occupancy across many sites, each running gsmwsd.
+
+FleetAggregator keeps a Node per gsmwsd, each with one keep-alive HTTP
+connection, and every interval seconds has a bounded pool of workers
+(fanout.UnitPool) sync every node that isn't still busy syncing. A sync
+asks for the reports after the node's cursor (api.BTSService.wait_reports,
+without waiting) and its current ARFCN, in a single multicall, so it costs
+one round trip and only the bytes of what's new. Reports are merged into
+an Occupancy on the aggregator's event loop thread.
+
+stats() has, per node: how far behind we are (in reports, and seconds since
+our last good sync), bytes each way, and how long syncs take.
+"""
+
+SYNC_TIME = metrics.REGISTRY.histogram("gsmws_fleet_sync_seconds",
+                                       "Time to sync one gsmwsd node", ["node"])
+SYNC_BYTES = metrics.REGISTRY.counter("gsmws_fleet_bytes_total",
+                                      "XML-RPC payload bytes to and from gsmwsd nodes",
+                                      ["node", "direction"])
+SYNC_LAG = metrics.REGISTRY.gauge("gsmws_fleet_lag_reports",
+                                  "Reports a gsmwsd node has that we haven't synced", ["node"])
+
+class _CountingResponse(object):
+    """ An httplib response that counts what's read from it """
+    def __init__(self, response, transport):
+        self.response = response
+        self.transport = transport
+
+    def read(self, *args):
+        data = self.response.read(*args)
+        self.transport.received += len(data)
+        return data
+
+    def getheader(self, *args):
+        return self.response.getheader(*args)
+
+class CountingTransport(xmlrpclib.Transport):
+    """
+    xmlrpclib's keep-alive transport, with a timeout, counting payload bytes
+    sent and received (as they go over the wire, so gzipped responses count
+    compressed) and connections made.
+    """
+    def __init__(self, timeout=10.0):
+        xmlrpclib.Transport.__init__(self)
+        self.timeout = timeout
+        self.sent = 0
+        self.received = 0
+        self.connections = 0
+
+    def make_connection(self, host):
+        if self._connection and host == self._connection[0]:
+            return self._connection[1]
+        chost, self._extra_headers, _ = self.get_host_info(host)
+        self._connection = host, httplib.HTTPConnection(chost, timeout=self.timeout)
+        self.connections += 1
+        return self._connection[1]
+
+    def send_content(self, connection, request_body):
+        self.sent += len(request_body)
+        xmlrpclib.Transport.send_content(self, connection, request_body)
+
+    def parse_response(self, response):
+        return xmlrpclib.Transport.parse_response(self, _CountingResponse(response, self))
+
+class Node(object):
+    """
+    One gsmwsd we sync from. sync() runs on a worker; everything else about
+    us is only touched on the aggregator's thread.
+    """
+    def __init__(self, url, name=None, limit=1000, timeout=10.0):
+        self.url = url
+        self.name = name or url
+        self.limit = limit # reports per call
+        self.transport = CountingTransport(timeout)
+        self.proxy = xmlrpclib.ServerProxy(url, transport=self.transport, allow_none=True)
+        self.cursor = -1 # start from the oldest they have
+        self.head = 0 # their next sequence number, as of our last sync
+        self.arfcn = None
+        self.reports = 0
+        self.missed = 0
+        self.malformed = 0
+        self.syncs = 0
+        self.errors = 0
+        self.last_sync = None
+        self.sync_time = events.LatencyStats()
+
+        self.timer = SYNC_TIME.labels(self.name)
+        self.bytes_out = SYNC_BYTES.labels(self.name, "out")
+        self.bytes_in = SYNC_BYTES.labels(self.name, "in")
+        SYNC_LAG.labels(self.name).set_function(self.lag)
+
+    def lag(self):
+        return max(0, self.head - max(self.cursor, 0))
+
+    def sync(self):
+        """
+        Fetch everything after our cursor, a call of up to limit reports at
+        a time. Returns (current ARFCN, [gsm.CompactReport], cursor, head,
+        missed, seconds it took); the caller advances our cursor.
+        """
+        cursor, missed, arfcn = self.cursor, 0, None
+        reports = []
+        sent, received = self.transport.sent, self.transport.received
+        start = time.time()
+        try:
+            while True:
+                multi = xmlrpclib.MultiCall(self.proxy)
+                multi.current_arfcn()
+                multi.wait_reports(cursor, 0, self.limit)
+                arfcn, res = tuple(multi())
+                if res['cursor'] < cursor:
+                    logging.warning("%s started over, resyncing" % self.name)
+                cursor, head = res['cursor'], res['next']
+                missed += res['missed']
+                reports.extend(self.decode(res['reports'], arfcn))
+                if len(res['reports']) < self.limit or cursor >= head:
+                    break
+        finally:
+            self.timer.observe(time.time() - start)
+            self.bytes_out.inc(self.transport.sent - sent)
+            self.bytes_in.inc(self.transport.received - received)
+        return arfcn, reports, cursor, head, missed, time.time() - start
+
+    def decode(self, raw, arfcn):
+        """ PhysicalStatus events (JSON) to CompactReports """
+        reports = []
+        for msg in raw:
+            try:
+                report = gsm.physical_status_report(json.loads(msg), arfcn)
+            except (ValueError, KeyError, TypeError):
+                report = None
+            if report is None:
+                self.malformed += 1
+            else:
+                reports.append(report)
+        return reports
+
+    def stats(self):
+        stats = {'url': self.url,
+                 'arfcn': self.arfcn,
+                 'cursor': self.cursor,
+                 'lag_reports': self.lag(),
+                 'lag_seconds': (time.time() - self.last_sync
+                                 if self.last_sync is not None else None),
+                 'reports': self.reports,
+                 'missed': self.missed,
+                 'malformed': self.malformed,
+                 'syncs': self.syncs,
+                 'errors': self.errors,
+                 'bytes_out': self.transport.sent,
+                 'bytes_in': self.transport.received,
+                 'connections': self.transport.connections}
+        stats.update(('sync_' + k, v) for k, v in self.sync_time.stats().items())
+        return stats
+
+class Occupancy(object):
+    """
+    What every node's handsets have heard, per ARFCN. Each node gets its own
+    estimator.RSSIEstimator, and an ARFCN it hasn't heard for window seconds
+    drops out of the view. view() combines them: for each ARFCN, how many
+    nodes hear it, the strongest and mean of their weighted averages, when
+    it was last heard, and which nodes are transmitting on it.
+
+    merge() is called from one thread; view() from any.
+    """
+    def __init__(self, window=600, maxlen=20):
+        self.window = window
+        self.maxlen = maxlen
+        self.lock = threading.Lock()
+        self.estimators = {} # node name -> RSSIEstimator
+        self.last_heard = collections.defaultdict(dict) # node name -> arfcn -> time
+        self.serving = {} # node name -> arfcn
+
+    def merge(self, node, arfcn, reports):
+        with self.lock:
+            est = self.estimators.get(node)
+            if est is None:
+                est = self.estimators[node] = estimator.RSSIEstimator(self.maxlen)
+            heard = self.last_heard[node]
+            self.serving[node] = arfcn
+            for report in reports:
+                for a in report:
+                    est.add(a, report[a])
+                    if report.timestamp > heard.get(a, 0):
+                        heard[a] = report.timestamp
+
+    def forget(self, node):
+        with self.lock:
+            self.estimators.pop(node, None)
+            self.last_heard.pop(node, None)
+            self.serving.pop(node, None)
+
+    def view(self, now=None):
+        """ ARFCN -> {'nodes', 'max', 'mean', 'last_heard', 'serving'} """
+        now = time.time() if now is None else now
+        res = {}
+        with self.lock:
+            for node, est in self.estimators.items():
+                heard = self.last_heard[node]
+                for arfcn in est.arfcns():
+                    if now - heard.get(arfcn, 0) > self.window:
+                        continue
+                    rssi = est.rssi(arfcn)
+                    entry = res.setdefault(arfcn, {'nodes': 0, 'max': rssi, 'total': 0.0,
+                                                   'last_heard': 0, 'serving': []})
+                    entry['nodes'] += 1
+                    entry['max'] = max(entry['max'], rssi)
+                    entry['total'] += rssi
+                    entry['last_heard'] = max(entry['last_heard'], heard[arfcn])
+            for node, arfcn in self.serving.items():
+                if arfcn in res:
+                    res[arfcn]['serving'].append(node)
+        for entry in res.values():
+            entry['mean'] = entry.pop('total') / entry['nodes']
+            entry['serving'].sort()
+        return res
+
+class FleetAggregator(object):
+    """
+    Syncs Nodes every interval seconds, workers at a time, into an Occupancy.
+    Run main() on a thread of its own; everything but view() and stats()
+    happens there.
+    """
+    def __init__(self, urls, interval=1.0, workers=8, window=600, limit=1000, timeout=10.0):
+        self.interval = interval
+        self.loop = events.EventLoop()
+        self.units = fanout.UnitPool(self.loop, workers, deadline=max(interval, timeout))
+        self.occupancy = Occupancy(window)
+        self.nodes = collections.OrderedDict()
+        self.lock = threading.Lock() # guards nodes
+        for url in urls:
+            self.add_node(url, limit=limit, timeout=timeout)
+
+    def add_node(self, url, name=None, **kwargs):
+        node = Node(url, name, **kwargs)
+        with self.lock:
+            self.nodes[node.name] = node
+        return node
+
+    def remove_node(self, name):
+        with self.lock:
+            node = self.nodes.pop(name)
+        SYNC_LAG.remove(name)
+        self.occupancy.forget(name)
+        return node
+
+    def main(self):
+        self.loop.call_soon_threadsafe(self.tick)
+        self.loop.run()
+        self.units.close()
+
+    def tick(self):
+        with self.lock:
+            nodes = list(self.nodes.values())
+        for node in nodes:
+            # a node still syncing (or timing out) gets its turn next tick
+            if self.units.busy(node) is None and not self.units.backlog(node):
+                self.units.submit(node, "sync", node.sync,
+                                  callback=lambda result, error, node=node:
+                                  self.synced(node, result, error))
+        self.loop.call_later(self.interval, self.tick)
+
+    def synced(self, node, result, error):
+        with self.lock:
+            if self.nodes.get(node.name) is not node:
+                return # removed while it was syncing
+        if error is not None:
+            node.errors += 1
+            return
+        arfcn, reports, cursor, head, missed, elapsed = result
+        node.arfcn = arfcn
+        node.cursor, node.head = cursor, head
+        node.missed += missed
+        node.reports += len(reports)
+        node.syncs += 1
+        node.last_sync = time.time()
+        node.sync_time.add(elapsed)
+        if reports:
+            self.occupancy.merge(node.name, arfcn, reports)
+            self.loop.record("report_to_merge", node.last_sync - min(r.timestamp for r in reports))
+
+    def view(self):
+        return self.occupancy.view()
+
+    def stats(self):
+        """ node name -> Node.stats() """
+        with self.lock:
+            nodes = list(self.nodes.values())
+        return dict((node.name, node.stats()) for node in nodes)
+
+    def stop(self):
+        self.loop.stop()
+
+class FleetService(object):
+    """ What GSMWSFleet serves, via an api.APIServer (XML-RPC keys are strings) """
+    def __init__(self, fleet):
+        self.fleet = fleet
+
+    def occupancy(self):
+        """ ARFCN (as a string) -> Occupancy.view() entry """
+        return dict((str(arfcn), entry) for arfcn, entry in self.fleet.view().items())
+
+    def node_stats(self):
+        # XML-RPC ints are 32 bits, and byte counts get bigger than that
+        return dict((name, dict((k, float(v) if isinstance(v, (int, long)) and v > 2**31 - 1 else v)
+                                for k, v in stats.items()))
+                    for name, stats in self.fleet.stats().items())
+
+    def add_node(self, url, name=None):
+        return self.fleet.add_node(url, name).name
+
+    def remove_node(self, name):
+        self.fleet.remove_node(name)
+        return True
@@ -4,8 +4,13 @@ This file is part of GSMWS.
 
 import subprocess
 import sys
+import os
 import datetime
 import re
+import socket
+import struct
+import binascii
+import time
 
 """
 Rather than decoding the actual packet stream, we just run tshark w/ verbose
@@ -21,6 +26,10 @@ Things we care about:
 We continually run tshark in a separate process, and parse its output. We
 maintain a timestamped history of all measurement reports and current ARFCNs as
 well as a moving average of the RSSI for each.
+
+Alternatively, GSMTAPStream binds the GSMTAP port itself and we decode the few
+fields we need straight out of the packets (parser="binary" below). This skips
+tshark entirely, which matters on busy sites.
 """
 
 regex = {'current_strength': re.compile("RXLEV-FULL-SERVING-CELL:.*dBm \((\d+)\)"),
@@ -28,18 +37,173 @@ regex = {'current_strength': re.compile("RXLEV-FULL-SERVING-CELL:.*dBm \((\d+)\)
          'cell_report': re.compile("RXLEV-NCELL: (\d+)\n.*= BCCH-FREQ-NCELL: (\d+)\n.* = BSIC-NCELL: (\d)"),
          'arfcn': re.compile("GSM TAP Header, ARFCN: (\d+)"),
          'sys_info_2': re.compile("List of ARFCNs =([ \d]+).*(\d{4} \d{4}) = NCC Permitted",re.DOTALL),
+         # everything MeasurementReport.parse_scan needs, in one pattern
+         'report_fields': re.compile("RXLEV-FULL-SERVING-CELL:.*dBm \((\d+)\)"
+                                     "|NO-NCELL-M:.*result \((\d+)\)"
+                                     "|RXLEV-NCELL: (\d+)\n.*= BCCH-FREQ-NCELL: (\d+)\n.* = BSIC-NCELL: (\d+)"),
          }
+
+GSMTAP_PORT = 4729
+GSMTAP_HEADER = struct.Struct("!BBBBHbbIBBBB")
+GSMTAP_TYPE_UM = 0x01
+GSMTAP_ARFCN_F_UPLINK = 0x4000
+GSMTAP_ARFCN_MASK = 0x3fff
+GSMTAP_CHANNEL_BCCH = 0x01
+GSMTAP_CHANNEL_CCCH = 0x02
+GSMTAP_CHANNEL_SDCCH4 = 0x07
+GSMTAP_CHANNEL_ACCH = 0x80
+
+# GSM900 ARFCNs are 1-124; we keep index 0 so ARFCNs index arrays directly
+NUM_ARFCNS = 125
+
+RR_PROTOCOL = 0x06
+RR_MEASUREMENT_REPORT = 0x15
+RR_SYSTEM_INFORMATION_2 = 0x1a
+
 def command_stream(command):
     cmd_list = command.split()
     proc = subprocess.Popen(cmd_list, stdout=subprocess.PIPE)
     return proc.stdout
 
+# tshark messages that GSMDecoder.process() does something with
+RELEVANT_MESSAGES = ("GSM A-I/F DTAP - Measurement Report",
+                     "GSM CCCH - System Information Type 2",
+                     "GSM TAP Header")
+
+class MessageFramer(object):
+    """
+    Splits tshark's verbose output into messages. An unindented line starts a
+    new message; indented lines belong to the current one.
+
+    We read the stream in big chunks and only join each message's lines once
+    it's complete, so framing is linear in the size of the output. Messages
+    that don't start with one of prefixes are dropped as soon as we see their
+    first line, since tshark spends most of its output on frame, IP and UDP
+    headers we don't care about.
+    """
+    def __init__(self, stream, prefixes=RELEVANT_MESSAGES, chunk_size=65536):
+        self.stream = stream
+        self.prefixes = tuple(prefixes)
+        self.chunk_size = chunk_size
+        self.lines = 0
+        self.messages = 0
+        self.dropped = 0
+        self.current = None
+
+    def chunks(self):
+        # os.read returns whatever's in the pipe rather than waiting for a
+        # full chunk, so we don't sit on messages while tshark is quiet
+        try:
+            fd = self.stream.fileno()
+        except (AttributeError, IOError, ValueError):
+            fd = None
+        while True:
+            if fd is None:
+                chunk = self.stream.read(self.chunk_size)
+            else:
+                chunk = os.read(fd, self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def __iter__(self):
+        partial = ""
+        self.current = None # lines of the message we're assembling, None if dropping
+        for chunk in self.chunks():
+            lines = (partial + chunk).split("\n")
+            partial = lines.pop()
+            for message in self.frame(lines):
+                yield message
+
+        # end of stream: whatever's left is complete
+        for message in self.frame([partial] if partial else []):
+            yield message
+        if self.current is not None:
+            yield self.finish()
+
+    def frame(self, lines):
+        self.lines += len(lines)
+        for line in lines:
+            if line.startswith("    "):
+                if self.current is not None:
+                    self.current.append(line)
+                continue
+            if self.current is not None:
+                yield self.finish()
+            if line.startswith(self.prefixes):
+                self.current = [line]
+            else:
+                self.current = None
+                self.dropped += 1
+
+    def finish(self):
+        # trailing "" gives the message its final newline, as tshark had it
+        self.current.append("")
+        message = "\n".join(self.current)
+        self.current = None
+        self.messages += 1
+        return message
+
+class GSMTAPStream(object):
+    """
+    Receives GSMTAP packets directly from OpenBTS, rather than having tshark
+    capture and dissect them for us. Iterating over this yields raw packets,
+    which can be handed to GSMTAP(packet, parser="binary").
+
+    OpenBTS just sends GSMTAP to a UDP port, so we bind that port ourselves.
+    If you're running multiple BTS on one host, give each its own GSMTAP
+    destination IP (e.g., 127.0.0.1 and 127.0.0.2) and bind one stream to each.
+    """
+    def __init__(self, host="127.0.0.1", port=GSMTAP_PORT, rcvbuf=4*1024*1024):
+        self.host = host
+        self.port = port
+        self.packets = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # a big receive buffer lets us ride out bursts without drops
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.sock.bind((host, port))
+
+    def __iter__(self):
+        while True:
+            packet = self.sock.recv(65535)
+            self.packets += 1
+            yield packet
+
+    def close(self):
+        self.sock.close()
+
+def encode_gsmtap(arfcn, sub_type, payload, uplink=False, timeslot=0, frame_nr=0):
+    """
+    Build a GSMTAP packet around payload. This is what OpenBTS sends us; we
+    only need it for test fixtures and benchmarks.
+    """
+    if uplink:
+        arfcn |= GSMTAP_ARFCN_F_UPLINK
+    header = GSMTAP_HEADER.pack(2, GSMTAP_HEADER.size // 4, GSMTAP_TYPE_UM,
+                                timeslot, arfcn, 0, 0, frame_nr, sub_type,
+                                0, 0, 0)
+    return header + payload
+
+def _bitfield(data):
+    """
+    Returns a function that extracts (offset, width) bitfields from data,
+    numbering bits from the MSB of the first octet like the 3GPP specs do.
+    """
+    total = len(data) * 8
+    value = int(binascii.hexlify(data), 16) if data else 0
+    def field(offset, width):
+        return int((value >> (total - offset - width)) & ((1 << width) - 1))
+    return field
+
 class MeasurementReport(object):
-    def __init__(self, last_arfcns, current_arfcn, result_msg):
+    def __init__(self, last_arfcns, current_arfcn, result_msg, parser="regex"):
         self.timestamp = datetime.datetime.now()
         self.result_msg = result_msg
         self.valid = False
-        self.current_strengths, self.current_bsics = self.parse(last_arfcns, current_arfcn)
+        parse = {'regex': self.parse, 'scan': self.parse_scan,
+                 'binary': self.parse_bytes}[parser]
+        self.current_strengths, self.current_bsics = parse(last_arfcns, current_arfcn)
 
     @staticmethod
     def sample():
@@ -63,6 +227,11 @@ GSM A-I/F DTAP - Measurement Report
         0001 0... = BCCH-FREQ-NCELL: 2
         .... .000  010. .... = BSIC-NCELL: 2"""
 
+    @staticmethod
+    def sample_bytes():
+        """ The L3 message dissected in sample() """
+        return binascii.unhexlify("061510107e51104000000000000000000000")
+
     def parse(self, last_arfcns, current_arfcn, result_msg=None):
         if result_msg == None:
             result_msg = self.result_msg
@@ -94,26 +263,267 @@ GSM A-I/F DTAP - Measurement Report
         self.valid = True
         return strengths, bsics
 
+    def parse_scan(self, last_arfcns, current_arfcn, result_msg=None):
+        """
+        Same as parse(), but pulls the serving strength, NO-NCELL-M and every
+        neighbor triple out in a single pass over the message, without
+        building intermediate lists. Malformed reports (no serving strength,
+        a neighbor count that doesn't match NO-NCELL-M, or a BCCH-FREQ-NCELL
+        past the end of last_arfcns) come back invalid rather than raising.
+        Unlike parse(), multi-digit BSICs are kept whole.
+        """
+        if result_msg == None:
+            result_msg = self.result_msg
+        strengths = dict.fromkeys(last_arfcns, -0.001)
+        bsics = dict.fromkeys(last_arfcns)
+        serving_strength = None
+        num_cells = None
+        seen_cells = 0
+
+        for match in regex['report_fields'].finditer(result_msg):
+            group = match.lastindex
+            if group == 1:
+                # tshark prints this before the neighbors, so a neighbor
+                # report for our own ARFCN still wins like it does in parse()
+                serving_strength = int(match.group(1))
+                strengths[current_arfcn] = serving_strength
+            elif group == 2:
+                num_cells = int(match.group(2))
+            else:
+                seen_cells += 1
+                try:
+                    arfcn = last_arfcns[int(match.group(4))]
+                except IndexError:
+                    return {}, {}
+                strengths[arfcn] = int(match.group(3))
+                if not current_arfcn == arfcn:
+                    bsics[arfcn] = int(match.group(5))
+
+        if serving_strength is None or num_cells is None or seen_cells != num_cells:
+            return {}, {}
+
+        self.valid = True
+        return strengths, bsics
+
+    def parse_bytes(self, last_arfcns, current_arfcn, result_msg=None):
+        """
+        Same as parse(), but works on the raw L3 message (starting at the
+        protocol discriminator) instead of tshark's dissection. The
+        Measurement Results IE is 16 octets of packed bitfields (3GPP TS
+        44.018 10.5.2.20); up to six 17-bit neighbor entries follow
+        NO-NCELL-M. Reports too short, or with a BCCH-FREQ-NCELL past the end
+        of last_arfcns, come back invalid.
+        """
+        if result_msg == None:
+            result_msg = self.result_msg
+        results = bytearray(result_msg)[2:18]
+        if len(results) < 16:
+            return {}, {}
+        field = _bitfield(results)
+
+        # NO-NCELL-M of 7 means neighbor info isn't available, which tshark
+        # doesn't render as a "result" either.
+        num_cells = field(23, 3)
+        if num_cells == 7:
+            return {}, {}
+
+        strengths = dict(zip(last_arfcns,[-0.001 for _ in range(0,len(last_arfcns))]))
+        bsics = dict(zip(last_arfcns,[None for _ in range(0,len(last_arfcns))]))
+        strengths[current_arfcn] = field(2, 6)
+
+        for i in range(0, num_cells):
+            offset = 26 + 17*i
+            try:
+                arfcn = last_arfcns[field(offset + 6, 5)]
+            except IndexError:
+                return {}, {}
+            strengths[arfcn] = field(offset, 6)
+            if not current_arfcn == arfcn:
+                bsics[arfcn] = field(offset + 11, 6)
+
+        self.valid = True
+        return strengths, bsics
+
     def __str__(self):
         return "%s %s" % (self.timestamp, str(self.current_strengths))
 
 
+class CompactReport(object):
+    """
+    A measurement report's strengths and BSICs packed into one byte string:
+    the ARFCNs it covers (one byte each, in order), then their strengths,
+    then their BSICs. We keep thousands of these per BTS, and a report only
+    covers a handful of ARFCNs, so this is well under half the size of the
+    dicts in a MeasurementReport; lookups scan the few ARFCN bytes.
+
+    Reads like the current_strengths dict (arfcn in r, r[arfcn], iteration),
+    so anything that takes those takes these too. As in the dict, ARFCNs we
+    were scanning but didn't hear come back as -0.001.
+    """
+    __slots__ = ('timestamp', 'data')
+
+    NOT_HEARD = 0xff # stored strength for an ARFCN with no report
+    NO_BSIC = 0xff
+
+    def __init__(self, strengths=None, bsics=None, timestamp=None):
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.data = ""
+        self._pack(strengths or {}, bsics or {})
+
+    @classmethod
+    def from_report(cls, report):
+        """ Raises ValueError if the report has ARFCNs outside GSM900 """
+        return cls(report.current_strengths, report.current_bsics,
+                   time.mktime(report.timestamp.timetuple()))
+
+    def _pack(self, strengths, bsics):
+        arfcns = sorted(strengths)
+        for arfcn in arfcns:
+            if not 0 <= arfcn < NUM_ARFCNS:
+                raise ValueError("ARFCN %s out of range" % arfcn)
+        levels = [self.NOT_HEARD if strengths[a] < 0 else int(strengths[a]) for a in arfcns]
+        codes = [self.NO_BSIC if bsics.get(a) is None else bsics[a] for a in arfcns]
+        self.data = str(bytearray(arfcns + levels + codes))
+
+    def set(self, arfcn, strength, bsic=None):
+        strengths, bsics = dict(self.items()), dict((a, self.bsic(a)) for a in self)
+        strengths[arfcn] = strength
+        bsics[arfcn] = bsic
+        self._pack(strengths, bsics)
+
+    def _index(self, arfcn):
+        """ Where arfcn's bytes are, or -1 """
+        if not 0 <= arfcn < NUM_ARFCNS:
+            return -1
+        return self.data.find(chr(arfcn), 0, len(self.data) // 3)
+
+    def bsic(self, arfcn):
+        """ BSIC reported for arfcn, or None, like current_bsics[arfcn] """
+        i = self._index(arfcn)
+        if i < 0:
+            return None
+        value = ord(self.data[2 * (len(self.data) // 3) + i])
+        return None if value == self.NO_BSIC else value
+
+    def __contains__(self, arfcn):
+        return self._index(arfcn) >= 0
+
+    def __getitem__(self, arfcn):
+        i = self._index(arfcn)
+        if i < 0:
+            raise KeyError(arfcn)
+        value = ord(self.data[len(self.data) // 3 + i])
+        return -0.001 if value == self.NOT_HEARD else value
+
+    def get(self, arfcn, default=None):
+        return self[arfcn] if arfcn in self else default
+
+    def __iter__(self):
+        return iter(bytearray(self.data[:len(self.data) // 3]))
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(arfcn, self[arfcn]) for arfcn in self]
+
+    def __len__(self):
+        return len(self.data) // 3
+
+    def __str__(self):
+        return "%s %s" % (datetime.datetime.fromtimestamp(self.timestamp), dict(self.items()))
+
+def rxlev(dbm):
+    """ dBm to the 0-63 RXLEV scale used in measurement reports """
+    return max(0, min(63, int(dbm) + 111))
+
+def physical_status_report(event, current_arfcn=None):
+    """
+    Build a CompactReport from a decoded OpenBTS PhysicalStatus event. We use
+    the serving cell level (RXLEV_FULL_SERVING_CELL_dBm) and the neighbors
+    list (ARFCN, RXLEV_NCELL_dBm, BSIC_NCELL) from data.measurement; levels
+    go back to RXLEV so they compare with tshark-decoded reports. The serving
+    cell is only recorded if we're told current_arfcn. Returns None for events
+    without measurement results.
+    """
+    try:
+        measurement = event['data']['measurement']
+    except (KeyError, TypeError):
+        return None
+    report = CompactReport(timestamp=event.get('timestamp'))
+    if current_arfcn is not None and 'RXLEV_FULL_SERVING_CELL_dBm' in measurement:
+        report.set(current_arfcn, rxlev(measurement['RXLEV_FULL_SERVING_CELL_dBm']))
+    for ncell in measurement.get('neighbors', []):
+        arfcn = ncell['ARFCN']
+        if not 0 <= arfcn < NUM_ARFCNS:
+            continue
+        bsic = None if arfcn == current_arfcn else ncell.get('BSIC_NCELL')
+        report.set(arfcn, rxlev(ncell['RXLEV_NCELL_dBm']), bsic)
+    return report
+
 class GSMTAP(object):
-    def __init__(self, message):
+    def __init__(self, message, parser="regex"):
         self.timestamp = datetime.datetime.now()
         self.message = message
-        self.arfcn = self.parse()
+        # only populated by the binary parser
+        self.uplink = None
+        self.sub_type = None
+        self.payload = None
+        parse = {'regex': self.parse, 'binary': self.parse_bytes}[parser]
+        self.arfcn = parse()
 
     def parse(self, message=None):
         if message == None:
             message = self.message
         return int(regex['arfcn'].findall(message)[0])
 
+    def parse_bytes(self, message=None):
+        if message == None:
+            message = self.message
+        (version, hdr_len, gsmtap_type, timeslot, arfcn, signal_dbm, snr_db,
+         frame_nr, sub_type, antenna_nr, sub_slot, _) = GSMTAP_HEADER.unpack_from(message)
+        if gsmtap_type != GSMTAP_TYPE_UM:
+            raise ValueError("Not a GSMTAP Um packet (type %d)" % gsmtap_type)
+        self.uplink = bool(arfcn & GSMTAP_ARFCN_F_UPLINK)
+        self.sub_type = sub_type
+        self.payload = message[hdr_len*4:]
+        return arfcn & GSMTAP_ARFCN_MASK
+
+    def l3(self):
+        """
+        Strip the L1/L2 headers from a binary packet and return the L3
+        message, starting at the protocol discriminator.
+        """
+        if self.sub_type & GSMTAP_CHANNEL_ACCH:
+            # SACCH L1 header (2 octets) then a LAPDm header (3 octets) whose
+            # last octet holds the L3 length
+            if len(self.payload) < 5:
+                return ""
+            length = bytearray(self.payload[4:5])[0] >> 2
+            return self.payload[5:5+length]
+        elif self.sub_type in (GSMTAP_CHANNEL_BCCH, GSMTAP_CHANNEL_CCCH):
+            # just the L2 pseudo length octet
+            return self.payload[1:]
+        else:
+            # dedicated channels are LAPDm, same as above minus the L1 header
+            if len(self.payload) < 3:
+                return ""
+            length = bytearray(self.payload[2:3])[0] >> 2
+            return self.payload[3:3+length]
+
+    def message_type(self):
+        """ Returns (protocol discriminator, message type) of the L3 message """
+        l3 = bytearray(self.l3()[0:2])
+        if len(l3) < 2:
+            return None, None
+        return l3[0] & 0x0f, l3[1]
+
 class SystemInformationTwo(object):
-    def __init__(self, message):
+    def __init__(self, message, parser="regex"):
         self.timestamp = datetime.datetime.now()
         self.message = message
-        self.arfcns, self.ncc_permitted = self.parse()
+        parse = {'regex': self.parse, 'binary': self.parse_bytes}[parser]
+        self.arfcns, self.ncc_permitted = parse()
 
     @staticmethod
     def sample():
@@ -139,6 +549,11 @@ RACH Control Parameters
     0000 0000 0000 0000 = ACC: 0x0000
         """
 
+    @staticmethod
+    def sample_bytes():
+        """ The L3 message dissected in sample() """
+        return binascii.unhexlify("061a8e0b8020000808000000000800000000ff790000")
+
     def parse(self, message=None):
         if message == None:
             message = self.message
@@ -147,3 +562,41 @@ RACH Control Parameters
         arfcns = map(int,res[0].split())
         ncc_permitted = res[1]
         return arfcns, ncc_permitted
+
+    def parse_bytes(self, message=None):
+        """
+        Decode the Neighbour Cell Description (3GPP TS 44.018 10.5.2.22) and
+        NCC Permitted IEs from the raw L3 message. We handle the bit map 0 and
+        variable bit map formats, which cover everything OpenBTS sends.
+        NCC Permitted is returned as a bit string like tshark prints it.
+        """
+        if message == None:
+            message = self.message
+        data = bytearray(message)
+        if len(data) < 19:
+            raise ValueError("System Information Type 2 too short")
+        ncd = data[2:18]
+        field = _bitfield(ncd)
+
+        arfcns = []
+        if field(0, 2) == 0:
+            # bit map 0: one bit per ARFCN, 124 down to 1
+            for i in range(0, 124):
+                if field(4 + i, 1):
+                    arfcns.append(124 - i)
+        elif field(0, 2) == 2 and field(4, 3) == 7:
+            # variable bit map: ORIG-ARFCN, then one bit per offset from it
+            orig = field(7, 10)
+            arfcns.append(orig)
+            for i in range(1, 112):
+                if field(16 + i, 1):
+                    arfcns.append((orig + i) % 1024)
+        else:
+            raise ValueError("Unsupported neighbour cell description format")
+        # BCCH-FREQ-NCELL indexes into the list in ascending order, except
+        # ARFCN 0 goes last (3GPP TS 45.008 7.2)
+        arfcns.sort(key=lambda a: (a == 0, a))
+
+        bits = "{0:08b}".format(data[18])
+        ncc_permitted = "%s %s" % (bits[:4], bits[4:])
+        return arfcns, ncc_permitted
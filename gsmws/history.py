@@ -0,0 +1,399 @@
+"""
+This file is part of GSMWS.
+"""
+
+import array
+import bisect
+import logging
+import mmap
+import os
+import struct
+import time
+
+import gsm
+
+"""
+RSSI history per ARFCN: every reading, kept for a day (at up to 10
+readings a second per ARFCN; past that, the oldest go sooner), plus
+per-minute and per-hour rollups kept for longer, so occupancy can be looked
+at after the fact. The gsmws db only has the latest value per ARFCN.
+
+Each tier of each ARFCN is a series of segment files,
+<dir>/<tier>/<arfcn>/<first sample, epoch ms>.seg. A segment is
+preallocated to hold capacity samples and laid out in columns: a header,
+then capacity time offsets (uint32 ms after the segment's base time), then
+capacity of each value column. Raw segments have one value column (the
+RXLEV, int8, -1 for "scanned but not heard"). Rollups have min and max
+(int8), count and heard (uint32) and sum (int32): count is every reading,
+heard the ones that weren't -1, and min, max and sum cover just those (min
+and max are -1 if none were heard). Appending writes one slot of each
+column and then bumps the count in the header, so a reader (in this process
+or another, through a read-only mmap) never sees a half-written sample.
+Numbers are in native byte order.
+
+Samples within a series are kept in time order (one that comes in older
+than the last is recorded at the last's time), so a query bisects the
+segment list and then the offsets column, and reads just the range asked
+for.
+
+There's one series per ARFCN, not per BTS unit: every unit's reports go
+into the same one, as they come in, so it's a merged view of the band, and
+since units' reports interleave, the clamping above shifts some readings a
+little later than their reports' times. Only GSM900 ARFCNs (0-124, see
+gsm.NUM_ARFCNS) are kept; append() ignores and counts the rest.
+
+A segment is finished when it's full or segment_seconds old. Disk use is
+bounded per tier: we keep segments for retention seconds, and at most
+max_segments per ARFCN (so a burst that fills segments early can't grow
+without limit). max_disk() says what that comes to. When max_segments is
+what's limiting a tier, queries that go back further than it does use the
+next tier instead.
+"""
+
+MAGIC = b"GSMWSTS1"
+HEADER = struct.Struct("=8sqII") # magic, base time (epoch ms), capacity, count
+HEADER_SIZE = 64
+COUNT_OFFSET = struct.calcsize("=8sqI")
+
+RAW_COLUMNS = (('offset', 'I'), ('value', 'b'))
+ROLLUP_COLUMNS = (('offset', 'I'), ('min', 'b'), ('max', 'b'), ('count', 'I'), ('heard', 'I'),
+                  ('sum', 'i'))
+
+NOT_HEARD = -1
+
+def _level(value):
+    """ A report's strength (RXLEV, or -0.001 for not heard) as we store it """
+    if value < 0:
+        return NOT_HEARD
+    return min(127, int(round(value)))
+
+def _list_bases(path):
+    """ The base times of a series directory's segments, oldest first """
+    try:
+        return sorted(int(name[:-4]) for name in os.listdir(path) if name.endswith(".seg"))
+    except OSError:
+        return []
+
+class Tier(object):
+    """ resolution is seconds per sample; 0 for raw readings """
+    def __init__(self, name, resolution, segment_seconds, retention, capacity):
+        self.name = name
+        self.resolution = resolution
+        self.segment_seconds = segment_seconds
+        self.retention = retention
+        self.capacity = capacity
+        self.columns = RAW_COLUMNS if resolution == 0 else ROLLUP_COLUMNS
+        self.max_segments = -(-retention // segment_seconds) + 1
+
+    def segment_size(self):
+        return HEADER_SIZE + self.capacity * sum(struct.calcsize(c) for _, c in self.columns)
+
+# offsets are uint32 ms, so segments must be under 49 days
+TIERS = (Tier("raw", 0, 3600, 86400, 36000),
+         Tier("1m", 60, 86400, 30 * 86400, 1440),
+         Tier("1h", 3600, 28 * 86400, 365 * 86400, 672))
+
+class Segment(object):
+    """ One mmap'd segment file; see above for the layout """
+    def __init__(self, path, columns, base=None, capacity=None):
+        """ Open path, or create it (writable) if base and capacity are given """
+        self.path = path
+        self.columns = columns
+        self.sizes = [struct.calcsize(code) for _, code in columns]
+        if base is not None:
+            size = HEADER_SIZE + capacity * sum(self.sizes)
+            with open(path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, base, capacity, 0))
+                f.truncate(size)
+            self.file = open(path, "r+b")
+            self.mm = mmap.mmap(self.file.fileno(), size)
+            self.writable = True
+        else:
+            self.file = open(path, "rb")
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.writable = False
+        magic, self.base, self.capacity, self.written = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError("%s isn't a history segment" % path)
+        self.starts = []
+        pos = HEADER_SIZE
+        for size in self.sizes:
+            self.starts.append(pos)
+            pos += size * self.capacity
+
+    def count(self):
+        if self.writable:
+            return self.written
+        return struct.unpack_from("=I", self.mm, COUNT_OFFSET)[0]
+
+    def full(self):
+        return self.written >= self.capacity
+
+    def last(self):
+        """ Epoch ms of the last sample, or None """
+        n = self.count()
+        if not n:
+            return None
+        return self.base + struct.unpack_from("=I", self.mm, self.starts[0] + 4 * (n - 1))[0]
+
+    def append(self, when, values):
+        """ Add a sample at epoch ms when (values are the value columns, in order) """
+        i = self.written
+        struct.pack_into("=I", self.mm, self.starts[0] + 4 * i, when - self.base)
+        for (_, code), size, start, value in zip(self.columns[1:], self.sizes[1:],
+                                                 self.starts[1:], values):
+            struct.pack_into("=" + code, self.mm, start + size * i, value)
+        self.written = i + 1
+        struct.pack_into("=I", self.mm, COUNT_OFFSET, self.written)
+
+    def _bisect(self, offset, n):
+        """ The first slot at or after offset """
+        lo, hi = 0, n
+        start = self.starts[0]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if struct.unpack_from("=I", self.mm, start + 4 * mid)[0] < offset:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def read(self, start, end):
+        """ Samples from epoch ms start up to (not including) end, as {column: array} """
+        n = self.count()
+        lo = self._bisect(max(0, start - self.base), n)
+        hi = self._bisect(max(0, end - self.base), n)
+        res = {}
+        for (name, code), size, pos in zip(self.columns, self.sizes, self.starts):
+            col = array.array(code)
+            col.fromstring(self.mm[pos + size * lo:pos + size * hi])
+            res[name] = col
+        res['time'] = [(self.base + o) / 1000.0 for o in res.pop('offset')]
+        return res
+
+    def flush(self):
+        if self.writable:
+            self.mm.flush()
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+class Series(object):
+    """ One tier of one ARFCN: its segment files, and the one we're writing """
+    def __init__(self, path, tier):
+        self.path = path
+        self.tier = tier
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.bases = _list_bases(path)
+        self.current = None
+        self.last = None # epoch ms of our last sample
+        if self.bases:
+            # carry on in time order after what's already there
+            seg = Segment(self._file(self.bases[-1]), tier.columns)
+            self.last = seg.last()
+            seg.close()
+
+    def _file(self, base):
+        return os.path.join(self.path, "%d.seg" % base)
+
+    def append(self, when, values):
+        if self.last is not None and when < self.last:
+            when = self.last
+        seg = self.current
+        if seg is None or seg.full() or when - seg.base >= self.tier.segment_seconds * 1000:
+            seg = self._roll(when)
+            when = max(when, seg.base)
+        seg.append(when, values)
+        self.last = when
+
+    def _roll(self, when):
+        if self.current is not None:
+            self.current.close()
+        if self.bases and when <= self.bases[-1]:
+            when = self.bases[-1] + 1 # keep file names unique and in order
+        self.current = Segment(self._file(when), self.tier.columns, when, self.tier.capacity)
+        self.bases.append(when)
+        self.expire(when)
+        return self.current
+
+    def expire(self, now):
+        """ Drop segments past retention (by when they ended) or over max_segments """
+        cutoff = now - self.tier.retention * 1000
+        while len(self.bases) > 1 and (len(self.bases) > self.tier.max_segments
+                                       or self.bases[1] <= cutoff):
+            os.remove(self._file(self.bases.pop(0)))
+
+    def flush(self):
+        if self.current is not None:
+            self.current.flush()
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+            self.current = None
+
+class HistoryStore(object):
+    """
+    The writer. append() (or append_report()) readings as they come in; it
+    writes the raw tier and rolls the readings up into the others as each
+    minute or hour goes by. query() reads, from any thread, and so does a
+    HistoryStore opened on the same directory in another process (though
+    that one can't see the rollup buckets still being filled here).
+
+    Only one thread may append.
+    """
+    def __init__(self, path, tiers=TIERS, flush_interval=5.0):
+        self.path = path
+        self.tiers = list(tiers)
+        self.flush_interval = flush_interval
+        self.series = {} # (tier name, arfcn) -> Series
+        self.buckets = {} # (tier name, arfcn) -> [start ms, min, max, count, heard, sum]
+        self.last_flush = time.time()
+        self.appended = 0
+        self.out_of_band = 0
+
+    def _series(self, tier, arfcn):
+        key = (tier.name, arfcn)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = Series(os.path.join(self.path, tier.name, str(arfcn)),
+                                               tier)
+        return series
+
+    def append(self, arfcn, value, timestamp=None):
+        """
+        Record a reading (a report's strength) for arfcn, at timestamp
+        (epoch seconds). Readings for ARFCNs outside the band are dropped.
+        """
+        if not 0 <= arfcn < gsm.NUM_ARFCNS:
+            self.out_of_band += 1
+            return
+        when = int((time.time() if timestamp is None else timestamp) * 1000)
+        level = _level(value)
+        self.appended += 1
+        for tier in self.tiers:
+            if tier.resolution == 0:
+                self._series(tier, arfcn).append(when, (level,))
+                continue
+            key = (tier.name, arfcn)
+            start = when - when % (tier.resolution * 1000)
+            bucket = self.buckets.get(key)
+            if bucket is not None and bucket[0] != start and when > bucket[0]:
+                self._series(tier, arfcn).append(bucket[0], bucket[1:])
+                bucket = None
+            if bucket is None:
+                bucket = self.buckets[key] = [start, NOT_HEARD, NOT_HEARD, 0, 0, 0]
+            bucket[3] += 1
+            if level == NOT_HEARD:
+                continue
+            if bucket[4]:
+                bucket[1] = min(bucket[1], level)
+                bucket[2] = max(bucket[2], level)
+            else:
+                bucket[1] = bucket[2] = level
+            bucket[4] += 1
+            bucket[5] += level
+
+    def append_report(self, report, timestamp=None):
+        """ Record every ARFCN in a report (ARFCN -> strength, e.g. a gsm.CompactReport) """
+        if timestamp is None:
+            timestamp = getattr(report, 'timestamp', None)
+        for arfcn in report:
+            self.append(arfcn, report[arfcn], timestamp)
+
+    def tier(self, name):
+        for tier in self.tiers:
+            if tier.name == name:
+                return tier
+        raise ValueError("No tier %s" % name)
+
+    def pick_tier(self, start, now=None, arfcn=None):
+        """
+        The finest tier that still covers start. With arfcn, skip tiers
+        that max_segments has cut short of start for that ARFCN.
+        """
+        now = time.time() if now is None else now
+        for tier in self.tiers:
+            if now - start > tier.retention:
+                continue
+            if arfcn is not None:
+                bases = _list_bases(os.path.join(self.path, tier.name, str(arfcn)))
+                if len(bases) >= tier.max_segments and start * 1000 < bases[0]:
+                    continue
+            return tier
+        return self.tiers[-1]
+
+    def query(self, arfcn, start, end=None, tier=None):
+        """
+        arfcn's samples from start to end (epoch seconds; end defaults to
+        now), from the named tier or else the finest one that goes back that
+        far. Returns {'tier': name, 'time': [...], and a list per value
+        column} (value; or min, max, count, heard, sum and mean, which is
+        None if nothing was heard).
+        """
+        end = time.time() if end is None else end
+        tier = self.pick_tier(start, arfcn=arfcn) if tier is None else self.tier(tier)
+        start_ms, end_ms = int(start * 1000), int(end * 1000)
+        res = dict((name, []) for name, _ in tier.columns if name != 'offset')
+        res['time'] = []
+
+        path = os.path.join(self.path, tier.name, str(arfcn))
+        bases = _list_bases(path)
+        # the segment that start falls in, through the last one starting before end
+        first = max(0, bisect.bisect_right(bases, start_ms) - 1)
+        last = bisect.bisect_left(bases, end_ms)
+        for base in bases[first:last]:
+            try:
+                seg = Segment(os.path.join(path, "%d.seg" % base), tier.columns)
+            except (IOError, OSError, ValueError):
+                continue # expired while we were looking
+            try:
+                for name, values in seg.read(start_ms, end_ms).items():
+                    res[name].extend(values)
+            finally:
+                seg.close()
+
+        bucket = self.buckets.get((tier.name, arfcn))
+        if bucket is not None and start_ms <= bucket[0] < end_ms:
+            res['time'].append(bucket[0] / 1000.0)
+            for name, value in zip(('min', 'max', 'count', 'heard', 'sum'), bucket[1:]):
+                res[name].append(value)
+        if 'sum' in res:
+            res['mean'] = [float(s) / h if h else None for s, h in zip(res['sum'], res['heard'])]
+        res['tier'] = tier.name
+        return res
+
+    def max_disk(self):
+        """ The most bytes we'll ever keep, for all of the band's ARFCNs """
+        return gsm.NUM_ARFCNS * sum(t.max_segments * t.segment_size() for t in self.tiers)
+
+    def maybe_flush(self):
+        if time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        for series in self.series.values():
+            series.flush()
+        self.last_flush = time.time()
+
+    def stats(self):
+        return {'appended': self.appended,
+                'out_of_band': self.out_of_band,
+                'series': len(self.series),
+                'segments': sum(len(s.bases) for s in self.series.values())}
+
+    def close(self):
+        """
+        Write out the rollup buckets in progress, and close everything. (So
+        if we start again within the same minute or hour, that bucket ends
+        up as two samples.)
+        """
+        for (name, arfcn), bucket in self.buckets.items():
+            self._series(self.tier(name), arfcn).append(bucket[0], bucket[1:])
+        self.buckets.clear()
+        for series in self.series.values():
+            series.flush()
+            series.close()
+        logging.debug("Closed history store %s: %s" % (self.path, self.stats()))
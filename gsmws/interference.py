@@ -0,0 +1,95 @@
+"""
+This file is part of GSMWS.
+"""
+
+import logging
+
+class InterferenceDetector(object):
+    """
+    Watches measurement reports for our own BTS units' ARFCNs. If a handset
+    reports one of them above its threshold while that BTS is off (i.e.,
+    not transmitting), someone else must be transmitting there, so that BTS
+    should move.
+
+    Each report is looked at once, as it comes in, via observe(), which
+    returns the BTS units to restart. It only looks up the ARFCNs we're
+    watching, so it costs the same however many reports pile up.
+
+    Thresholds are per-ARFCN (threshold is the default), with hysteresis: once
+    an ARFCN goes over its threshold it stays "hot" until a report comes in
+    below threshold - hysteresis, and we only ask for a restart on the way
+    up. So a BTS gets one restart per interference event, not one per
+    report.
+
+    Whether a BTS is off is cached; refresh() it whenever its txatten might
+    have changed, rather than reading the config for every report.
+    """
+    def __init__(self, threshold=10, hysteresis=3, thresholds=None):
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.thresholds = dict(thresholds or {}) # arfcn -> threshold
+        self.by_arfcn = {} # arfcn -> bts
+        self.arfcns = {} # bts -> arfcn
+        self.off = {} # bts -> cached is_off()
+        self.hot = set() # arfcns over threshold
+
+        self.reports_seen = 0
+        self.restarts = 0
+
+    def watch(self, bts, arfcn, off=None):
+        """ Start (or keep) watching bts, which is now on arfcn """
+        old = self.arfcns.get(bts)
+        if old is not None and self.by_arfcn.get(old) is bts:
+            del self.by_arfcn[old]
+            self.hot.discard(old)
+        if arfcn is not None:
+            self.by_arfcn[arfcn] = bts
+        self.arfcns[bts] = arfcn
+        if off is not None:
+            self.set_off(bts, off)
+
+    def set_off(self, bts, off):
+        """ Record whether bts is off, e.g. from an is_off() done elsewhere """
+        if off and not self.off.get(bts, False):
+            # while it was on, its ARFCN was hot from its own signal; start
+            # over so whatever's still there once it's off counts
+            self.hot.discard(self.arfcns.get(bts))
+        self.off[bts] = off
+
+    def refresh(self, bts):
+        """ Re-read whether bts is off. Returns it. """
+        self.set_off(bts, bts.is_off())
+        return self.off[bts]
+
+    def set_threshold(self, arfcn, threshold):
+        self.thresholds[arfcn] = threshold
+
+    def observe(self, report):
+        """
+        Take one report (ARFCN -> strength, e.g. a gsm.CompactReport) and
+        return a list of the BTS units it says to restart.
+        """
+        self.reports_seen += 1
+        restart = []
+        for arfcn, bts in self.by_arfcn.items():
+            if arfcn not in report:
+                continue
+            strength = report[arfcn]
+            threshold = self.thresholds.get(arfcn, self.threshold)
+            if arfcn in self.hot:
+                if strength < threshold - self.hysteresis:
+                    self.hot.discard(arfcn)
+            elif strength > threshold:
+                self.hot.add(arfcn)
+                off = self.off.get(bts, False)
+                logging.debug("ARFCN %s over threshold (%s > %s), BTS %s is_off=%s"
+                              % (arfcn, strength, threshold, getattr(bts, 'id_num', bts), off))
+                if off:
+                    restart.append(bts)
+        self.restarts += len(restart)
+        return restart
+
+    def stats(self):
+        return {'reports_seen': self.reports_seen,
+                'restarts': self.restarts,
+                'hot': sorted(self.hot)}
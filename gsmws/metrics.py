@@ -0,0 +1,220 @@
+"""
+This file is part of GSMWS.
+"""
+
+import bisect
+import threading
+
+"""
+Process-wide metrics for the hot paths: counters, gauges and latency
+histograms, registered by name in REGISTRY. Each metric can have labels
+(e.g., message type); labels() gets the child for one set of label values,
+which callers on a hot path should look up once and keep. Counter names end
+in _total, as Prometheus expects.
+
+text() renders everything in the Prometheus text exposition format, which
+is what gsmwsd serves at /metrics.
+"""
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# seconds; from 100us (a parse) to 10s (a BTS restart)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+class CounterChild(object):
+    __slots__ = ('lock', 'value')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        return [(name, labels, (), self.value)]
+
+class GaugeChild(object):
+    __slots__ = ('lock', 'value', 'func')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+        self.func = None
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, func):
+        """ Report func() at scrape time instead of a value we keep """
+        self.func = func
+
+    def get(self):
+        func = self.func
+        if func is not None:
+            return func()
+        return self.value
+
+    def samples(self, name, labels):
+        return [(name, labels, (), self.get())]
+
+class HistogramChild(object):
+    __slots__ = ('lock', 'buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, name, labels):
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        res = []
+        cumulative = 0
+        for bound, n in zip(list(self.buckets) + [float("inf")], counts):
+            cumulative += n
+            res.append((name + "_bucket", labels, (("le", _number(bound)),), cumulative))
+        res.append((name + "_sum", labels, (), total))
+        res.append((name + "_count", labels, (), count))
+        return res
+
+class Metric(object):
+    """
+    A named metric and its children, one per set of label values. Children
+    come from new_child, if given, or else the subclass's child_class.
+    """
+    TYPE = None
+    child_class = None
+
+    def __init__(self, name, help, labels=(), new_child=None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.new_child = new_child or self.child_class
+        if self.new_child is None:
+            raise TypeError("%s has no child class" % type(self).__name__)
+        self.lock = threading.Lock()
+        self.children = {}
+        if not self.label_names:
+            self.children[()] = self.new_child()
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        if len(values) != len(self.label_names):
+            raise ValueError("%s takes labels %s" % (self.name, self.label_names))
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def remove(self, *values):
+        with self.lock:
+            self.children.pop(tuple(str(v) for v in values), None)
+
+    def __getattr__(self, attr):
+        # an unlabelled metric acts like its only child
+        if attr in ('inc', 'dec', 'set', 'set_function', 'get', 'observe') and not self.label_names:
+            return getattr(self.children[()], attr)
+        raise AttributeError(attr)
+
+    def text(self):
+        lines = ["# HELP %s %s" % (self.name, self.help.replace("\n", " ")),
+                 "# TYPE %s %s" % (self.name, self.TYPE)]
+        with self.lock:
+            children = sorted(self.children.items())
+        for values, child in children:
+            try:
+                samples = child.samples(self.name, values)
+            except Exception:
+                continue # a gauge whose function broke; leave it out
+            for name, values, extra, value in samples:
+                lines.append("%s%s %s" % (name, _labels(self.label_names, values, extra),
+                                          _number(value)))
+        return "\n".join(lines) + "\n"
+
+class Counter(Metric):
+    TYPE = "counter"
+    child_class = CounterChild
+
+class Gauge(Metric):
+    TYPE = "gauge"
+    child_class = GaugeChild
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        Metric.__init__(self, name, help, labels, lambda: HistogramChild(self.buckets))
+
+class Registry(object):
+    """
+    Metrics by name. Asking for one that exists returns it, so modules can
+    each declare what they use without coordinating; asking for it as a
+    different type or with different labels is a ValueError.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, labels, **kwargs)
+            elif type(metric) is not cls or metric.label_names != tuple(labels):
+                raise ValueError("%s is already registered differently" % name)
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def text(self):
+        """ Everything, in the Prometheus text format """
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        return "".join(metric.text() for _, metric in metrics)
+
+REGISTRY = Registry()
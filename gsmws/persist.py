@@ -0,0 +1,272 @@
+"""
+This file is part of GSMWS.
+"""
+
+import sqlite3
+import threading
+import logging
+import datetime
+import time
+
+import metrics
+
+COMMIT_TIME = metrics.REGISTRY.histogram("gsmws_sqlite_commit_seconds",
+                                         "Time to write and commit a batch to gsmws.db", ["kind"])
+
+"""
+gsmws.db layout. We track the version in PRAGMA user_version and migrate
+older files in place when the controller starts up.
+
+Version 1: AVAIL_ARFCN is keyed on ARFCN and its timestamps are epoch
+seconds (REAL), indexed, so updates are one upsert and expiry is one range
+delete. Version 0 had no key and TEXT timestamps.
+"""
+SCHEMA_VERSION = 1
+
+def init_gsmwsdb(db):
+    """
+    Create the gsmws.db tables on the given connection, migrating an older
+    file first if need be. Everything happens in one transaction.
+    """
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    isolation, db.isolation_level = db.isolation_level, None
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if version < 1:
+                _migrate_v1(db)
+            db.execute("CREATE TABLE IF NOT EXISTS AVAIL_ARFCN "
+                       "(ARFCN INTEGER PRIMARY KEY, TIMESTAMP REAL NOT NULL, "
+                       "RSSI REAL);")
+            db.execute("CREATE INDEX IF NOT EXISTS AVAIL_ARFCN_TIMESTAMP "
+                       "ON AVAIL_ARFCN (TIMESTAMP);")
+            db.execute("CREATE TABLE IF NOT EXISTS MAX_STRENGTHS "
+                       "(TIMESTAMP TEXT NOT NULL, ARFCN INTEGER, "
+                       "RSSI REAL);")
+            db.execute("CREATE TABLE IF NOT EXISTS AVG_STRENGTHS "
+                       "(TIMESTAMP TEXT NOT NULL, ARFCN INTEGER, "
+                       "RSSI REAL, COUNT INTEGER);")
+            db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+            db.execute("COMMIT")
+        except:
+            db.execute("ROLLBACK")
+            raise
+    finally:
+        db.isolation_level = isolation
+
+def save_avail_arfcns(db, rows, expired_before=None):
+    """
+    Upsert rows of (ARFCN, TIMESTAMP, RSSI) into AVAIL_ARFCN, then delete
+    every row older than expired_before (if given), in one transaction.
+    """
+    start = time.time()
+    db.executemany("INSERT OR REPLACE INTO AVAIL_ARFCN (ARFCN, TIMESTAMP, RSSI) "
+                   "VALUES (?, ?, ?)", rows)
+    if expired_before is not None:
+        db.execute("DELETE FROM AVAIL_ARFCN WHERE TIMESTAMP < ?", (expired_before,))
+    db.commit()
+    elapsed = time.time() - start
+    COMMIT_TIME.labels("snapshot").observe(elapsed)
+    logging.debug("Saved %d ARFCNs in %.1fms" % (len(rows), elapsed * 1000))
+
+def _epoch(timestamp):
+    """ A version 0 TEXT timestamp (str(datetime.now())) to epoch seconds """
+    for fmt in ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S"):
+        try:
+            ts = datetime.datetime.strptime(timestamp, fmt)
+        except ValueError:
+            continue
+        return time.mktime(ts.timetuple()) + ts.microsecond / 1e6
+    raise ValueError("Unrecognized timestamp '%s'" % timestamp)
+
+def _migrate_v1(db):
+    exists = db.execute("SELECT COUNT(*) FROM sqlite_master WHERE "
+                        "type='table' AND name='AVAIL_ARFCN'").fetchone()[0]
+    if not exists:
+        return
+
+    # keep the newest row for each ARFCN; version 0 could have duplicates
+    latest = {}
+    for timestamp, arfcn, rssi in db.execute("SELECT TIMESTAMP, ARFCN, RSSI FROM AVAIL_ARFCN"):
+        try:
+            ts = _epoch(timestamp)
+        except (TypeError, ValueError):
+            logging.warning("Dropping AVAIL_ARFCN row with bad timestamp: %s" % timestamp)
+            continue
+        if arfcn not in latest or ts > latest[arfcn][0]:
+            latest[arfcn] = (ts, rssi)
+
+    db.execute("DROP TABLE AVAIL_ARFCN")
+    db.execute("CREATE TABLE AVAIL_ARFCN "
+               "(ARFCN INTEGER PRIMARY KEY, TIMESTAMP REAL NOT NULL, RSSI REAL);")
+    db.executemany("INSERT INTO AVAIL_ARFCN (ARFCN, TIMESTAMP, RSSI) VALUES (?, ?, ?)",
+                   [(arfcn, ts, rssi) for arfcn, (ts, rssi) in latest.items()])
+    logging.warning("Migrated AVAIL_ARFCN to schema version 1 (%d ARFCNs)" % len(latest))
+
+class WriteBehindStore(object):
+    """
+    Write-behind persistence for per-ARFCN tables (one row per ARFCN, with an
+    ARFCN column), like MAX_STRENGTHS and AVG_STRENGTHS.
+
+    Callers put() and delete() rows as often as they like; we only keep the
+    latest pending change for each (table, ARFCN) in memory, and write them
+    all out in a single transaction once changes are flush_interval seconds
+    old or max_dirty are pending, whichever comes first. With a
+    flush_interval of 0, changes wait for the caller's next maybe_flush(),
+    which the aggregator calls after each report, so each report's changes
+    go out in one commit. That's how often GSMDecoder used to commit.
+
+    Durability: at most flush_interval seconds of changes are lost if we die,
+    plus whatever the synchronous setting lets SQLite lose on power failure
+    ("FULL" loses nothing it has committed, "NORMAL" in WAL mode can lose the
+    last few commits, "OFF" leaves it to the OS). WAL mode also lets readers
+    (e.g., the controller) keep going while we commit.
+    """
+    def __init__(self, location, db_lock=None, flush_interval=5.0, max_dirty=500,
+                 wal=True, synchronous="NORMAL"):
+        if synchronous not in ("OFF", "NORMAL", "FULL"):
+            raise ValueError("synchronous must be OFF, NORMAL or FULL")
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        # only needed if something else shares the db file with us
+        self.db_lock = db_lock if db_lock is not None else threading.Lock()
+        self.lock = threading.Lock() # guards pending and the counters
+        self.flush_lock = threading.Lock() # keeps flushes in order
+
+        # the flusher thread shares this connection with whoever created us
+        self.db = sqlite3.connect(location, check_same_thread=False)
+        with self.db_lock:
+            if wal:
+                self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=%s" % synchronous)
+
+        self.pending = {} # table -> {arfcn: row tuple, or None to delete}
+        self.dirty_since = None
+
+        self.changes = 0 # put()s and delete()s
+        self.flushes = 0
+        self.rows_written = 0
+        self.flush_time = 0.0
+        self.last_flush_time = 0.0
+        self.max_flush_time = 0.0
+
+        self.stopped = threading.Event()
+        self.flusher = None
+
+    def start(self):
+        """
+        Flush from a background thread, so changes don't sit in memory past
+        flush_interval just because nothing else is coming in.
+        """
+        if self.flush_interval > 0 and self.flusher is None:
+            self.flusher = threading.Thread(target=self._flush_loop)
+            self.flusher.daemon = True
+            self.flusher.start()
+
+    def _flush_loop(self):
+        while not self.stopped.wait(self.flush_interval / 2.0):
+            self.maybe_flush()
+
+    def execute(self, query, args=()):
+        """ Run a read against our connection """
+        with self.db_lock:
+            return self.db.execute(query, args).fetchall()
+
+    def put(self, table, arfcn, row):
+        self._change(table, arfcn, row)
+
+    def delete(self, table, arfcn):
+        self._change(table, arfcn, None)
+
+    def _change(self, table, arfcn, row):
+        with self.lock:
+            self.pending.setdefault(table, {})[arfcn] = row
+            self.changes += 1
+            if self.dirty_since is None:
+                self.dirty_since = time.time()
+        if self.flush_interval > 0:
+            self.maybe_flush()
+
+    def dirty(self):
+        with self.lock:
+            return sum(len(rows) for rows in self.pending.values())
+
+    def maybe_flush(self):
+        """ Flush if changes are old enough or there are enough of them """
+        with self.lock:
+            if self.dirty_since is None:
+                return False
+            due = (time.time() - self.dirty_since >= self.flush_interval
+                   or sum(len(rows) for rows in self.pending.values()) >= self.max_dirty)
+        if due:
+            self.flush()
+        return due
+
+    def flush(self):
+        """ Write out every pending change in one transaction """
+        with self.flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.dirty_since = None
+        if not pending:
+            return
+
+        start = time.time()
+        written = 0
+        with self.db_lock:
+            try:
+                for table, rows in pending.items():
+                    self.db.executemany("DELETE FROM %s WHERE ARFCN=?" % table,
+                                        [(arfcn,) for arfcn in rows])
+                    inserts = [row for row in rows.values() if row is not None]
+                    if inserts:
+                        placeholders = ",".join("?" * len(inserts[0]))
+                        self.db.executemany("INSERT INTO %s VALUES (%s)" % (table, placeholders),
+                                            inserts)
+                    written += len(rows)
+                self.db.commit()
+            except sqlite3.Error:
+                self.db.rollback()
+                # put them back unless something newer came in meanwhile
+                with self.lock:
+                    for table, rows in pending.items():
+                        for arfcn, row in rows.items():
+                            self.pending.setdefault(table, {}).setdefault(arfcn, row)
+                    if self.dirty_since is None:
+                        self.dirty_since = start
+                logging.exception("Write-behind flush failed, will retry")
+                return
+        elapsed = time.time() - start
+        COMMIT_TIME.labels("write_behind").observe(elapsed)
+
+        with self.lock:
+            self.flushes += 1
+            self.rows_written += written
+            self.flush_time += elapsed
+            self.last_flush_time = elapsed
+            self.max_flush_time = max(self.max_flush_time, elapsed)
+        logging.debug("Flushed %d rows in %.1fms" % (written, elapsed * 1000))
+
+    def stats(self):
+        with self.lock:
+            return {'flushes': self.flushes,
+                    'rows_written': self.rows_written,
+                    'rows_coalesced': self.changes - self.rows_written
+                                      - sum(len(rows) for rows in self.pending.values()),
+                    'dirty': sum(len(rows) for rows in self.pending.values()),
+                    'last_flush_ms': self.last_flush_time * 1000,
+                    'max_flush_ms': self.max_flush_time * 1000,
+                    'mean_flush_ms': (self.flush_time * 1000 / self.flushes
+                                      if self.flushes else 0.0)}
+
+    def close(self):
+        """ Stop the flusher and write out anything pending """
+        self.stopped.set()
+        if self.flusher is not None:
+            self.flusher.join()
+            self.flusher = None
+        self.flush()
+        self.db.close()
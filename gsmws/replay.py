@@ -0,0 +1,412 @@
+"""
+This file is part of GSMWS.
+"""
+
+import logging
+import os
+import resource
+import shutil
+import struct
+import tempfile
+import threading
+import time
+
+import zmq
+
+import controller
+import decoder
+import events
+import gsm
+
+"""
+Record what a BTS sends us and play it back later, so the decoder and
+controller can be load-tested without live radios.
+
+A recording is a short header followed by one record per read: the time we
+got it, what kind of data it is, and the bytes themselves, exactly as the
+decoder would have seen them. There are three kinds:
+    - TSHARK: chunks of `tshark -V` output (framing happens on playback)
+    - GSMTAP: raw GSMTAP packets, as a GSMTAPStream yields them
+    - EVENT: OpenBTS PhysicalStatus messages, as they came off the SUB socket
+
+Playback keeps the original spacing between records, divided by speed;
+speed=0 plays everything back as fast as the decoder takes it.
+"""
+
+MAGIC = "GSMWSREC1\n"
+RECORD_HEADER = struct.Struct("!dBI") # capture time, kind, length
+
+TSHARK = 1
+GSMTAP = 2
+EVENT = 3
+KINDS = {'tshark': TSHARK, 'gsmtap': GSMTAP, 'event': EVENT}
+KIND_NAMES = dict((kind, name) for name, kind in KINDS.items())
+
+class RecordingWriter(object):
+    """ Appends records to a recording file """
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, "wb")
+        self.f.write(MAGIC)
+        self.records = 0
+        self.bytes = 0
+
+    def write(self, kind, data, ts=None):
+        if ts is None:
+            ts = time.time()
+        self.f.write(RECORD_HEADER.pack(ts, kind, len(data)))
+        self.f.write(data)
+        self.records += 1
+        self.bytes += len(data)
+
+    def close(self):
+        self.f.close()
+
+def read_records(path):
+    """ Yields (timestamp, kind, data) for each record in a recording """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a GSMWS recording" % path)
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            ts, kind, length = RECORD_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                logging.warning("Truncated record at the end of %s" % path)
+                return
+            yield ts, kind, data
+
+def recording_kind(path):
+    """ The kind of the first record in path, or None if it's empty """
+    for _, kind, _ in read_records(path):
+        return kind
+    return None
+
+def _source(kind, source):
+    """ What to read for each kind of recording """
+    if kind == TSHARK:
+        # same reads the MessageFramer does, so chunks come as tshark wrote them
+        return gsm.MessageFramer(source).chunks()
+    elif kind == GSMTAP:
+        return iter(source)
+    else:
+        return _events(source)
+
+def _events(host):
+    socket = zmq.Context.instance().socket(zmq.SUB)
+    socket.connect(host)
+    socket.setsockopt(zmq.SUBSCRIBE, "")
+    try:
+        while True:
+            yield socket.recv()
+    finally:
+        socket.close()
+
+def record(kind, source, path, limit=None, duration=None):
+    """
+    Record from source until it runs out, or until we have limit records or
+    duration seconds have passed (checked as records come in). source is a
+    stream of tshark output (e.g., a gsm.command_stream) for TSHARK, a
+    gsm.GSMTAPStream for GSMTAP, or a PhysicalStatus endpoint for EVENT.
+    Returns the RecordingWriter, closed.
+    """
+    writer = RecordingWriter(path)
+    start = time.time()
+    try:
+        for data in _source(kind, source):
+            writer.write(kind, data)
+            if limit is not None and writer.records >= limit:
+                break
+            if duration is not None and time.time() - start >= duration:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+    return writer
+
+class Pacer(object):
+    """
+    Sleeps so records come out with their recorded spacing divided by speed.
+    behind is how far (seconds) we've fallen behind that schedule at worst,
+    i.e., how long whoever's reading from us kept us waiting.
+    """
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.first = None
+        self.start = None
+        self.behind = 0.0
+
+    def wait(self, ts):
+        now = time.time()
+        if self.first is None:
+            self.first, self.start = ts, now
+        if not self.speed:
+            return
+        due = self.start + (ts - self.first) / self.speed
+        if due > now:
+            time.sleep(due - now)
+        else:
+            self.behind = max(self.behind, now - due)
+
+def replay(path, speed=1.0, pacer=None):
+    """ Yields each record's data from path, paced (see Pacer) """
+    pacer = pacer or Pacer(speed)
+    for ts, _, data in read_records(path):
+        pacer.wait(ts)
+        yield data
+
+class ReplayStream(object):
+    """
+    A recording of tshark output that reads like the stream it was recorded
+    from, so it can be handed straight to a GSMDecoder. Each read() returns
+    the next recorded chunk, whatever size was asked for.
+    """
+    def __init__(self, path, speed=1.0):
+        self.pacer = Pacer(speed)
+        self.records = replay(path, speed, self.pacer)
+        self.chunks = 0
+
+    def read(self, size=-1):
+        for data in self.records:
+            self.chunks += 1
+            return data
+        return ""
+
+    def close(self):
+        self.records.close()
+
+class GSMTAPReplay(gsm.GSMTAPStream):
+    """ A GSMTAPStream that plays back a recording instead of binding the port """
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.pacer = Pacer(speed)
+        self.host = None
+        self.port = None
+        self.packets = 0
+
+    def __iter__(self):
+        for packet in replay(self.path, self.pacer.speed, self.pacer):
+            self.packets += 1
+            yield packet
+
+    def close(self):
+        pass
+
+class EventPublisher(threading.Thread):
+    """
+    Plays a recording of PhysicalStatus events back on a PUB socket bound to
+    host, where an EventDecoder or EventMultiplexer can subscribe to it like
+    it would to OpenBTS.
+    """
+    def __init__(self, path, host="tcp://127.0.0.1:45160", speed=1.0, settle=0.5):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.host = host
+        self.pacer = Pacer(speed)
+        self.settle = settle # seconds for subscribers to connect before we send
+        self.socket = zmq.Context.instance().socket(zmq.PUB)
+        self.socket.setsockopt(zmq.SNDHWM, 0) # don't drop anything ourselves
+        self.socket.bind(host)
+        self.sent = 0
+
+    def run(self):
+        time.sleep(self.settle)
+        for msg in replay(self.path, self.pacer.speed, self.pacer):
+            self.socket.send(msg)
+            self.sent += 1
+
+    def close(self):
+        self.socket.close(linger=1000)
+
+def open_stream(path, speed=1.0):
+    """ A ReplayStream or GSMTAPReplay for path, to hand to a GSMDecoder """
+    kind = recording_kind(path)
+    if kind == GSMTAP:
+        return GSMTAPReplay(path, speed)
+    elif kind == TSHARK or kind is None:
+        return ReplayStream(path, speed)
+    raise ValueError("%s is a PhysicalStatus recording; use an EventPublisher" % path)
+
+class EventFeed(threading.Thread):
+    """
+    Hands reports from an EventDecoder (or any decoding EventSource) to the
+    aggregator, the way a controller pulling BTS.reports() would, so event
+    streams go through the same pipeline as GSMDecoder ones. Looks enough
+    like a GSMDecoder for the controllers; like one, it drops reports while
+    ignore_reports is set. It reads the EventDecoder's reports with a
+    cursor of its own, so they're still there for anyone else reading them.
+    """
+    def __init__(self, event_decoder, aggregator, decoder_id=0, interval=0.01):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.event_decoder = event_decoder
+        self.aggregator = aggregator
+        self.decoder_id = decoder_id
+        self.queue = aggregator.register(decoder_id)
+        self.cursor = event_decoder.reports.cursor(oldest=True)
+        self.reports = decoder.MeasurementReportList()
+        self.interval = interval
+        self.ignore_reports = False
+        self.stopped = threading.Event()
+
+    @property
+    def msgs_seen(self):
+        return self.event_decoder.received
+
+    def rssi(self):
+        return self.aggregator.rssi(self.decoder_id)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.pump()
+            time.sleep(self.interval)
+        self.pump()
+
+    def pump(self):
+        reports = self.cursor.read()
+        if self.ignore_reports:
+            decoder.REPORTS.labels("ignored").inc(len(reports))
+            return
+        for report in reports:
+            self.queue.put(report)
+        self.reports.put_many(reports)
+
+    def stop(self):
+        self.stopped.set()
+
+class ReplayBTS(object):
+    """ Just enough of a BTS for Controller: a decoder and an ARFCN """
+    def __init__(self, decoder):
+        self.decoder = decoder
+
+    @property
+    def current_arfcn(self):
+        return getattr(self.decoder, 'current_arfcn', None)
+
+    def set_neighbors(self, arfcns, *args):
+        pass
+
+    def change_arfcn(self, new_arfcn, immediate=False):
+        pass
+
+def peak_rss_kb():
+    """ Our peak resident set size so far, in KB """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class ReplayHarness(object):
+    """
+    Plays a recording through the whole pipeline: a GSMDecoder (or an
+    EventDecoder, for event recordings), the Aggregator, and a Controller's
+    report handling on its event loop. run() returns what it took:
+
+    - msgs_per_sec, reports_per_sec: end to end, over the whole replay
+    - behind_ms: how far the replay fell behind the recording's schedule,
+      i.e., how long the decoder kept its input waiting
+    - queue: decoder -> aggregator queue wait and drops (ReportQueue.stats)
+    - latencies: aggregator -> controller wakeup, and queued report -> RSSI
+      update done (EventLoop.stats)
+    - peak_rss_kb: the process's peak memory, before and after
+
+    Nothing talks to a real BTS; neighbor and ARFCN changes go nowhere.
+    """
+    def __init__(self, path, speed=0, gsmwsdb=None, loglvl=logging.WARNING,
+                 events_host="tcp://127.0.0.1:45199", idle=1.0):
+        self.path = path
+        self.speed = speed
+        self.kind = recording_kind(path)
+        self.tmpdir = None
+        if gsmwsdb is None:
+            self.tmpdir = tempfile.mkdtemp(prefix="gsmws-replay")
+            gsmwsdb = os.path.join(self.tmpdir, "gsmws.db")
+        self.events_host = events_host
+        self.idle = idle # seconds without new events before we call it done
+        self.controller = controller.Controller(None, None, None, 3600, 10, gsmwsdb,
+                                                loglvl=loglvl)
+        self.loglvl = loglvl
+
+    def _start(self):
+        agg = self.controller.aggregator
+        if self.kind == EVENT:
+            self.publisher = EventPublisher(self.path, self.events_host, self.speed)
+            self.event_decoder = decoder.EventDecoder(self.events_host, maxlen=100000, decode=True,
+                                               loglvl=self.loglvl)
+            self.event_decoder.daemon = True
+            feed = EventFeed(self.event_decoder, agg)
+            self.pacer = self.publisher.pacer
+            self.event_decoder.start()
+            self.publisher.start()
+            feed.start()
+            return feed
+        self.stream = open_stream(self.path, self.speed)
+        self.pacer = self.stream.pacer
+        gsmd = decoder.GSMDecoder(self.stream, agg, loglvl=self.loglvl)
+        gsmd.daemon = True
+        gsmd.start()
+        return gsmd
+
+    def _done(self, feed):
+        """ Has everything been read, decoded and applied? """
+        if self.kind == EVENT:
+            if self.publisher.is_alive():
+                return False
+            received = self.event_decoder.received
+            if received != getattr(self, '_last_received', None):
+                self._last_received, self._last_change = received, time.time()
+            if received < self.publisher.sent and time.time() - self._last_change < self.idle:
+                return False
+            if feed.is_alive():
+                feed.stop()
+                return False
+        elif feed.is_alive():
+            return False
+        # The aggregator drains, applies and announces a batch before it
+        # runs any job, so once this job sees the queue empty, everything
+        # is either on our loop already or handled.
+        drained = self.controller.aggregator.call(lambda db: feed.queue.queue.empty())
+        return drained and not self.controller.loop.pending
+
+    def _check(self, feed):
+        if self._done(feed):
+            self.controller.loop.stop()
+        else:
+            self.controller.loop.call_later(0.05, self._check, feed)
+
+    def run(self):
+        c = self.controller
+        rss_before = peak_rss_kb()
+        c.initdb()
+        c.loop = events.EventLoop(c.on_reports)
+        c.aggregator.add_listener(c.loop.notify)
+
+        start = time.time()
+        feed = self._start()
+        c.bts = ReplayBTS(feed)
+        c.loop.call_later(0.05, self._check, feed)
+        c.loop.run()
+        elapsed = time.time() - start
+
+        queue = feed.queue.stats()
+        stats = {'kind': KIND_NAMES.get(self.kind),
+                 'elapsed': elapsed,
+                 'messages': feed.msgs_seen,
+                 'msgs_per_sec': feed.msgs_seen / elapsed if elapsed else 0.0,
+                 'reports': queue['enqueued'],
+                 'reports_per_sec': queue['enqueued'] / elapsed if elapsed else 0.0,
+                 'behind_ms': self.pacer.behind * 1000,
+                 'queue': queue,
+                 'latencies': c.loop.stats(),
+                 'peak_rss_kb': {'before': rss_before, 'after': peak_rss_kb()}}
+        if self.kind == EVENT:
+            stats['events'] = self.event_decoder.stats()
+            stats['events']['lost'] = self.publisher.sent - self.event_decoder.received
+            self.event_decoder.stop()
+            self.publisher.close()
+        c.shutdown()
+        c.loop.close()
+        if self.tmpdir is not None:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+        return stats
@@ -0,0 +1,146 @@
+"""
+This file is part of GSMWS.
+"""
+
+import collections
+import heapq
+import math
+import time
+
+class ScanScheduler(object):
+    """
+    Decides which ARFCNs each BTS should scan (put in its neighbor list)
+    next, so the whole band gets revalidated as quickly as possible rather
+    than whenever random.sample gets around to it.
+
+    Each ARFCN's urgency is its staleness (seconds since we last heard about
+    it) plus a bonus of up to uncertainty_weight seconds for how unsure we
+    are of it: channels we've barely measured, or whose readings jump
+    around, come up sooner. Channels we've never scanned come first. Since
+    every ARFCN gets staler at the same rate, the order only changes when
+    we hear about one, so we keep them in a heap keyed on (last seen -
+    bonus) and only push when something changes.
+
+    assign() hands out the most urgent channels to one BTS and leases them
+    to it until its next assignment, so no two BTS units ever scan the same
+    channel at once.
+
+    coverage() says how much of the band we've verified recently, for
+    tuning NEIGHBOR_CYCLE_TIME: a channel counts as verified when a report
+    for it comes in while it's assigned.
+    """
+    def __init__(self, scan_range=range(1, 124), uncertainty_weight=3600.0,
+                 rssi_scale=5.0, window=3600.0):
+        self.scan_range = list(scan_range)
+        self.uncertainty_weight = uncertainty_weight
+        self.rssi_scale = rssi_scale # stderr (in RXLEV) we count as fully uncertain
+        self.window = window # seconds coverage() looks back
+
+        self.last_seen = {} # arfcn -> timestamp
+        self.samples = collections.defaultdict(lambda: [0, 0.0, 0.0]) # arfcn -> n, mean, m2
+        self.heap = [] # (key, arfcn); stale entries are skipped
+        self.keys = {} # arfcn -> current key
+        for arfcn in self.scan_range:
+            self._push(arfcn)
+
+        self.leases = {} # arfcn -> bts id
+        self.assigned = collections.defaultdict(set) # bts id -> arfcns
+        self.verified = collections.deque() # (timestamp, arfcn)
+
+    def uncertainty(self, arfcn):
+        """ 0 (sure) to 1 (no idea) """
+        n, _, m2 = self.samples[arfcn] if arfcn in self.samples else (0, 0.0, 0.0)
+        if n < 2:
+            return 1.0
+        stderr = math.sqrt(m2 / (n - 1) / n)
+        return min(1.0, stderr / self.rssi_scale + 1.0 / n)
+
+    def _key(self, arfcn):
+        if arfcn not in self.last_seen:
+            return float('-inf')
+        return self.last_seen[arfcn] - self.uncertainty_weight * self.uncertainty(arfcn)
+
+    def _push(self, arfcn):
+        key = self._key(arfcn)
+        self.keys[arfcn] = key
+        heapq.heappush(self.heap, (key, arfcn))
+        if len(self.heap) > 4 * len(self.keys):
+            # drop the stale entries
+            self.heap = [(k, a) for a, k in self.keys.items()]
+            heapq.heapify(self.heap)
+
+    def observe(self, rssis, now=None):
+        """ We just heard about these ARFCNs (a report, or any dict of ARFCN -> RSSI) """
+        if now is None:
+            now = time.time()
+        for arfcn in rssis:
+            if arfcn not in self.keys:
+                continue
+            # running mean and variance (Welford)
+            sample = self.samples[arfcn]
+            sample[0] += 1
+            delta = rssis[arfcn] - sample[1]
+            sample[1] += delta / sample[0]
+            sample[2] += delta * (rssis[arfcn] - sample[1])
+            self.last_seen[arfcn] = now
+            if arfcn in self.leases:
+                self.verified.append((now, arfcn))
+            self._push(arfcn)
+        self._trim(now)
+
+    def seed(self, arfcn, rssi, last_seen):
+        """ Restore what we knew about arfcn (e.g., from AVAIL_ARFCN) """
+        if arfcn in self.keys:
+            self.observe({arfcn: rssi}, last_seen)
+
+    def assign(self, bts_id, k, exclude=()):
+        """
+        The k most urgent ARFCNs that no other BTS is scanning (and that
+        aren't in exclude), leased to bts_id until its next assign() or
+        release(). May return fewer than k if the band's all spoken for.
+        """
+        self.release(bts_id)
+        exclude = set(exclude)
+        picked, skipped = [], []
+        while self.heap and len(picked) < k:
+            key, arfcn = heapq.heappop(self.heap)
+            if self.keys.get(arfcn) != key or arfcn in picked:
+                continue # stale entry
+            skipped.append((key, arfcn))
+            if arfcn in self.leases or arfcn in exclude:
+                continue
+            picked.append(arfcn)
+        for entry in skipped:
+            heapq.heappush(self.heap, entry)
+        for arfcn in picked:
+            self.leases[arfcn] = bts_id
+        self.assigned[bts_id] = set(picked)
+        return picked
+
+    def release(self, bts_id):
+        for arfcn in self.assigned.pop(bts_id, ()):
+            if self.leases.get(arfcn) == bts_id:
+                del self.leases[arfcn]
+
+    def _trim(self, now):
+        while self.verified and self.verified[0][0] < now - self.window:
+            self.verified.popleft()
+
+    def coverage(self, now=None):
+        """
+        How we're doing over the last window seconds: verifications, distinct
+        channels verified, those as a fraction of the band and per hour, and
+        the stalest channel's age (None if some were never scanned).
+        """
+        if now is None:
+            now = time.time()
+        self._trim(now)
+        distinct = len(set(arfcn for _, arfcn in self.verified))
+        never = len([a for a in self.scan_range if a not in self.last_seen])
+        return {'verifications': len(self.verified),
+                'distinct_verified': distinct,
+                'band_fraction': distinct / float(len(self.scan_range)),
+                'verified_per_hour': distinct * 3600.0 / self.window,
+                'never_scanned': never,
+                'max_staleness': (None if never else
+                                  now - min(self.last_seen[a] for a in self.scan_range))}
@@ -0,0 +1,429 @@
+"""
+This file is part of GSMWS.
+"""
+
+import datetime
+import functools
+import heapq
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+
+import zmq
+
+import bts
+import replay
+
+"""
+A local stand-in for any number of OpenBTS instances, so the controllers can
+be run (and benchmarked) without radios. Each VirtualBTS has everything
+bts.BTS talks to:
+    - a NodeManager (the JSON config API python-openbts speaks, on ZMQ REP)
+    - a CLI command socket (UNIX datagram, like CLI.SocketPath)
+    - a NeighborTable.db, kept in step with GSM.Neighbors like OpenBTS does
+    - a PhysicalStatus publisher (ZMQ PUB)
+plus some synthetic handsets camped on it, which send a measurement report
+every report_interval seconds.
+
+Handsets hear their own cell, the other virtual cells, and whatever
+interference we've put on an ARFCN (dBm, as heard by every handset). They
+report the six strongest of the ARFCNs in their cell's neighbor table, as
+long as they're over the noise floor. A cell that's off (txatten over 90)
+or restarting is heard by no one, and its handsets don't report.
+
+One thread serves every virtual BTS: it polls all the request sockets and
+sends reports as they come due, so dozens of cells are cheap.
+"""
+
+NEIGHBOR_TABLE_SCHEMA = ("CREATE TABLE IF NOT EXISTS NEIGHBOR_TABLE ("
+                         "IPADDRESS TEXT UNIQUE NOT NULL, "
+                         "UPDATED INTEGER DEFAULT 0, "
+                         "HOLDOFF INTEGER DEFAULT 0, "
+                         "C0 INTEGER DEFAULT NULL, "
+                         "BSIC INTEGER DEFAULT NULL)")
+
+NOISE_FLOOR = -110 # dBm; RXLEV 0, nothing weaker gets reported
+MAX_NEIGHBORS = 6 # per measurement report
+OFF_ATTEN = 90 # txatten over this is off, as in BTS.is_off
+
+class Handset(object):
+    """ A phone camped on a virtual BTS, loss dB further away than right next to it """
+    __slots__ = ('imsi', 'loss', 'reports')
+
+    def __init__(self, imsi, loss):
+        self.imsi = imsi
+        self.loss = loss
+        self.reports = 0
+
+class VirtualBTS(object):
+    """
+    One simulated OpenBTS (see above). Everything but restart() is only
+    called from the Simulator's thread.
+    """
+    def __init__(self, sim, id_num, arfcn, base_dir, nm_address, events_host):
+        self.sim = sim
+        self.id_num = id_num
+        self.nm_address = nm_address
+        self.events_host = events_host
+        self.bsic = id_num % 64
+        self.cli_path = os.path.join(base_dir, "command%d" % id_num)
+        self.neighbor_table_path = os.path.join(base_dir, "NeighborTable%d.db" % id_num)
+
+        self.config = {"CLI.SocketPath": self.cli_path,
+                       "Peering.NeighborTable.Path": self.neighbor_table_path,
+                       "TRX.RadioFrequencyOffset": "128",
+                       "GSM.Radio.C0": str(arfcn),
+                       "GSM.Neighbors": "",
+                       "TRX.TxAttenOffset": "0"}
+        self.defaults = dict(self.config)
+        self.arfcn = arfcn # what we're on; C0 changes take a restart()
+        self.restart_until = 0.0
+
+        # made here, used on the Simulator's thread
+        self.neighbor_table = sqlite3.connect(self.neighbor_table_path, check_same_thread=False)
+        self.neighbor_table.execute(NEIGHBOR_TABLE_SCHEMA)
+        self.neighbor_table.commit()
+        self.neighbors = []
+        self.neighbors_read = 0.0
+
+        context = zmq.Context.instance()
+        self.nm_socket = context.socket(zmq.REP)
+        self.nm_socket.bind(nm_address)
+        self.pub_socket = context.socket(zmq.PUB)
+        self.pub_socket.bind(events_host)
+        self.cli_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.cli_socket.bind(self.cli_path)
+
+        self.handsets = []
+        self.config_requests = 0
+        self.commands = 0
+        self.reports = 0
+        self.restarts = 0
+
+    @property
+    def atten(self):
+        return int(self.config["TRX.TxAttenOffset"])
+
+    def on_air(self, now):
+        return now >= self.restart_until and self.atten <= OFF_ATTEN
+
+    def level(self, loss):
+        """ dBm a handset loss dB away hears us at, before fading """
+        return self.sim.tx_dbm - self.atten - loss
+
+    def restart(self):
+        """ Go off the air for restart_time, and come back on C0 (any thread) """
+        with self.sim.lock:
+            self.arfcn = int(self.config["GSM.Radio.C0"])
+            self.restart_until = time.time() + self.sim.restart_time
+            self.restarts += 1
+
+    def handle_config(self, request):
+        """ A NodeManager request, the way python-openbts sends it """
+        self.config_requests += 1
+        key = request.get("key", "")
+        if request.get("command") != "config":
+            return {"code": 404}
+        if request.get("action") == "read":
+            if key == "":
+                return {"code": 200, "dirty": 0,
+                        "data": dict((k, self._entry(k)) for k in self.config)}
+            if key not in self.config:
+                return {"code": 404}
+            return {"code": 200, "dirty": 0, "data": self._entry(key)}
+        elif request.get("action") == "update":
+            if key not in self.config:
+                return {"code": 404}
+            value = str(request.get("value"))
+            if key == "GSM.Neighbors":
+                if value == self.config[key]:
+                    return {"code": 304} # OpenBTS won't take the same list twice
+                self._sync_neighbor_table(value.split())
+            self.config[key] = value
+            return {"code": 204, "dirty": 0}
+        return {"code": 406}
+
+    def _entry(self, key):
+        return {"key": key, "value": self.config[key], "defaultValue": self.defaults[key]}
+
+    def _sync_neighbor_table(self, ips):
+        """
+        OpenBTS keeps a row for each neighbor IP and fills it in by asking
+        the neighbor; ours never answer, so new rows start out empty.
+        """
+        with self.neighbor_table:
+            if ips:
+                self.neighbor_table.execute("DELETE FROM NEIGHBOR_TABLE WHERE IPADDRESS NOT IN (%s)"
+                                            % ",".join("?" * len(ips)), ips)
+            else:
+                self.neighbor_table.execute("DELETE FROM NEIGHBOR_TABLE")
+            self.neighbor_table.executemany("INSERT OR IGNORE INTO NEIGHBOR_TABLE (IPADDRESS) VALUES (?)",
+                                            [(ip,) for ip in ips])
+        self.neighbors_read = 0.0
+
+    def handle_command(self, command):
+        """ A CLI command; we only know txatten """
+        self.commands += 1
+        args = command.split()
+        if args[:1] == ["txatten"]:
+            if len(args) != 2:
+                return "wrong number of arguments"
+            try:
+                self.config["TRX.TxAttenOffset"] = str(int(args[1]))
+            except ValueError:
+                return "bad argument(s)"
+            return "Tx attenuation now %s dB" % args[1]
+        return "command not found"
+
+    def neighbor_arfcns(self, now=None):
+        """ The C0s in our neighbor table, re-read at most once a second """
+        if now is None:
+            now = time.time()
+        if now - self.neighbors_read >= 1.0:
+            try:
+                self.neighbors = [c0 for (c0,) in self.neighbor_table.execute(
+                    "SELECT C0 FROM NEIGHBOR_TABLE WHERE C0 IS NOT NULL")]
+                self.neighbors_read = now
+            except sqlite3.OperationalError:
+                pass # the BTS is writing it; try again next time
+        return self.neighbors
+
+    def report(self, handset, now, heard):
+        """
+        A PhysicalStatus event from handset. heard is ARFCN -> (dBm at no
+        loss, BSIC) for everything on the air.
+        """
+        rand = self.sim.rand
+        fading = self.sim.fading
+        ncells = []
+        for arfcn in self.neighbor_arfcns(now):
+            if arfcn not in heard or arfcn == self.arfcn:
+                continue
+            dbm, bsic, interferer = heard[arfcn]
+            if not interferer:
+                dbm -= handset.loss + self.sim.cell_loss
+            dbm += rand.gauss(0, fading)
+            if dbm > NOISE_FLOOR:
+                ncells.append({"ARFCN": arfcn, "RXLEV_NCELL_dBm": int(dbm), "BSIC_NCELL": bsic})
+        ncells.sort(key=lambda n: -n["RXLEV_NCELL_dBm"])
+        serving = max(NOISE_FLOOR, int(self.level(handset.loss) + rand.gauss(0, fading)))
+        handset.reports += 1
+        self.reports += 1
+        return {"name": "PhysicalStatus",
+                "timestamp": now,
+                "data": {"imsi": handset.imsi,
+                         "channel": "SDCCH-4-%d" % (handset.reports % 4),
+                         "measurement": {"RXLEV_FULL_SERVING_CELL_dBm": serving,
+                                         "RXQUAL_FULL_SERVING_CELL_BER": 0,
+                                         "neighbors": ncells[:MAX_NEIGHBORS]}}}
+
+    def stats(self):
+        return {'arfcn': self.arfcn,
+                'atten': self.atten,
+                'neighbors': list(self.neighbors),
+                'config_requests': self.config_requests,
+                'commands': self.commands,
+                'reports': self.reports,
+                'restarts': self.restarts}
+
+    def close(self):
+        self.nm_socket.close(linger=0)
+        self.pub_socket.close(linger=0)
+        self.cli_socket.close()
+        self.neighbor_table.close()
+
+class Simulator(threading.Thread):
+    """
+    Runs num_bts VirtualBTS instances (see above), each with handsets phones
+    that report every report_interval seconds. BTS i's NodeManager is on
+    base_port+2i and its PhysicalStatus events on base_port+2i+1; its CLI
+    socket and NeighborTable.db are in base_dir (a temporary directory,
+    removed by close(), if not given).
+
+    interference is ARFCN -> dBm, as heard by every handset; change it while
+    we're running with set_interference(). Cells start on arfcns (default:
+    every tenth ARFCN from 10 up, then the ones in between).
+
+    Hand bts_confs() to a HandoverController to control the lot.
+    """
+    def __init__(self, num_bts=2, handsets=8, interference=None, arfcns=None, base_dir=None,
+                 base_port=46000, report_interval=0.48, tx_dbm=-40, cell_loss=10, fading=2.0,
+                 restart_time=2.0, seed=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lock = threading.Lock() # guards interference and restarts
+        self.rand = random.Random(seed)
+        self.report_interval = report_interval
+        self.tx_dbm = tx_dbm # what a handset right next to a cell hears at no txatten
+        self.cell_loss = cell_loss # extra dB to a neighboring cell
+        self.fading = fading # std dev, dB
+        self.restart_time = restart_time # seconds a restart takes
+        self.interference = dict(interference or {})
+        self.interferer_bsic = 63
+
+        self.own_dir = base_dir is None
+        self.base_dir = tempfile.mkdtemp(prefix="gsmws-sim") if base_dir is None else base_dir
+        if arfcns is None:
+            arfcns = sorted(range(1, 124), key=lambda a: (a % 10, a))[:num_bts]
+
+        self.nodes = []
+        self.due = [] # (when, node index, handset index)
+        now = time.time()
+        for i in range(num_bts):
+            node = VirtualBTS(self, i, arfcns[i], self.base_dir,
+                              "tcp://127.0.0.1:%d" % (base_port + 2*i),
+                              "tcp://127.0.0.1:%d" % (base_port + 2*i + 1))
+            for h in range(handsets):
+                node.handsets.append(Handset("IMSI0010100%02d%06d" % (i % 100, h),
+                                             self.rand.uniform(0, 40)))
+                heapq.heappush(self.due, (now + self.rand.uniform(0, report_interval), i, h))
+            self.nodes.append(node)
+
+        self.poller = zmq.Poller()
+        self.by_socket = {}
+        for node in self.nodes:
+            self.poller.register(node.nm_socket, zmq.POLLIN)
+            self.poller.register(node.cli_socket, zmq.POLLIN)
+            self.by_socket[node.nm_socket] = node
+            self.by_socket[node.cli_socket.fileno()] = node # the poller gives us fds for these
+        self.stopped = threading.Event()
+        self.passes = 0
+
+    def set_interference(self, arfcn, dbm=None):
+        """ Put dBm of interference on arfcn, or take it off if dbm is None """
+        with self.lock:
+            if dbm is None:
+                self.interference.pop(arfcn, None)
+            else:
+                self.interference[arfcn] = dbm
+
+    def run(self):
+        while not self.stopped.is_set():
+            timeout = max(0.0, self.due[0][0] - time.time()) if self.due else 1.0
+            for sock, _ in self.poller.poll(min(timeout, 0.1) * 1000):
+                node = self.by_socket[sock]
+                if sock is node.nm_socket:
+                    try:
+                        request = json.loads(sock.recv())
+                        response = node.handle_config(request)
+                    except ValueError:
+                        response = {"code": 406}
+                    sock.send(json.dumps(response))
+                else:
+                    command, addr = node.cli_socket.recvfrom(65536)
+                    reply = node.handle_command(command.decode("utf-8", "replace"))
+                    node.cli_socket.sendto(reply.encode("utf-8"), addr)
+            self._send_reports(time.time())
+            self.passes += 1
+
+    def _send_reports(self, now):
+        if not self.due or self.due[0][0] > now:
+            return
+        with self.lock:
+            heard = dict((arfcn, (dbm, self.interferer_bsic, True))
+                         for arfcn, dbm in self.interference.items())
+            for node in self.nodes:
+                if node.on_air(now):
+                    dbm = node.level(0)
+                    if node.arfcn not in heard or heard[node.arfcn][0] < dbm:
+                        heard[node.arfcn] = (dbm, node.bsic, False)
+            on_air = [node.on_air(now) for node in self.nodes]
+        while self.due and self.due[0][0] <= now:
+            _, i, h = heapq.heappop(self.due)
+            heapq.heappush(self.due, (now + self.report_interval, i, h))
+            if on_air[i]:
+                node = self.nodes[i]
+                node.pub_socket.send(json.dumps(node.report(node.handsets[h], now, heard)))
+
+    def bts_confs(self, events=None, loglvl=logging.INFO):
+        """
+        HandoverController BTS configs for our cells. Pass a shared
+        decoder.EventMultiplexer as events to read them all with one thread.
+        """
+        confs = []
+        for node in self.nodes:
+            confs.append({'db_loc': node.neighbor_table_path,
+                          'openbts_proc': None,
+                          'trans_proc': None,
+                          'bts_class': functools.partial(SimBTS, node, events=events),
+                          'stream': None,
+                          'start_cmd': None})
+        return confs
+
+    def stats(self):
+        return {'passes': self.passes,
+                'reports': sum(node.reports for node in self.nodes),
+                'restarts': sum(node.restarts for node in self.nodes),
+                'nodes': [node.stats() for node in self.nodes]}
+
+    def stop(self):
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+
+    def close(self):
+        self.stop()
+        for node in self.nodes:
+            node.close()
+        if self.own_dir:
+            shutil.rmtree(self.base_dir, ignore_errors=True)
+
+class SimBTS(bts.BTS):
+    """
+    A bts.BTS talking to a VirtualBTS, with what HandoverController expects
+    of a BTS on top: its constructor arguments, id_num, current_arfcn as an
+    attribute, last_arfcns, init_decoder() and next_atten_state().
+    Restarts go to the VirtualBTS and take as long as it says.
+    """
+    WARBLE_PERIOD = 6 # we're off for one step in this many
+
+    def __init__(self, node, db_loc, openbts_proc=None, trans_proc=None, loglvl=logging.DEBUG,
+                 id_num=0, start_time=None, events=None):
+        self.node = node
+        self.id_num = id_num
+        self.start_time = start_time or datetime.datetime.now()
+        self.warble_step = 0
+        bts.BTS.__init__(self, loglvl, events=events, events_host=node.events_host,
+                         address=node.nm_address, decode=True)
+        self.events = self.decoder
+
+    @property
+    def current_arfcn(self):
+        return bts.BTS.current_arfcn(self)
+
+    @property
+    def last_arfcns(self):
+        """ The ARFCNs handsets are being told to report """
+        return list(self.node.neighbors)
+
+    def init_decoder(self, gsmd):
+        """
+        Our reports come from the VirtualBTS's PhysicalStatus events, not
+        gsmd's stream; we just take over its place with the aggregator.
+        """
+        self.decoder = replay.EventFeed(self.events, gsmd.aggregator, gsmd.decoder_id)
+        self.decoder.start()
+
+    def next_atten_state(self):
+        """
+        Warble: once start_time has passed, go off for one step in every
+        WARBLE_PERIOD, staggered by id_num so the cells take turns.
+        """
+        if datetime.datetime.now() < self.start_time:
+            return
+        self.warble_step += 1
+        atten = 100 if (self.warble_step + self.id_num) % self.WARBLE_PERIOD == 0 else 0
+        if atten != int(self.config.value('TRX.TxAttenOffset')):
+            self.set_txatten(atten)
+
+    def restart(self):
+        self.node.restart()
+        time.sleep(self.node.sim.restart_time)
+        self.events.current_arfcn = self.node.arfcn
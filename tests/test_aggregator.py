@@ -0,0 +1,67 @@
+"""
+This file is part of GSMWS.
+"""
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import aggregator
+
+class AggregatorTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.agg = aggregator.Aggregator(os.path.join(self.dir, "gsmws.db"), flush_interval=0.1)
+        self.published = threading.Event()
+        self.agg.add_listener(self.listen)
+        self.agg.start()
+        self.agg.ready.wait()
+
+    def tearDown(self):
+        self.agg.stop()
+        shutil.rmtree(self.dir)
+
+    def listen(self, decoder_id, arrived):
+        self.published.set()
+
+    def apply(self, queue, report):
+        self.published.clear()
+        queue.put(report)
+        self.assertTrue(self.published.wait(5))
+
+    def test_applies_reports(self):
+        queue = self.agg.register(0)
+        self.apply(queue, {51: 10, 61: -0.001})
+        self.assertEqual(self.agg.rssi(0), {51: 10.0, 61: -0.001})
+        self.agg.call(lambda db: self.agg.store.flush())
+        rows = self.agg.call(lambda db: db.execute("SELECT ARFCN, RSSI FROM MAX_STRENGTHS "
+                                                   "ORDER BY ARFCN").fetchall())
+        self.assertEqual(rows, [(51, 10.0), (61, -0.001)])
+
+    def test_survives_errors(self):
+        logging.disable(logging.ERROR) # we know
+        self.addCleanup(logging.disable, logging.NOTSET)
+        def broken(decoder_id, arrived):
+            raise RuntimeError("broken listener")
+        self.agg.add_listener(broken)
+        queue = self.agg.register(0)
+        self.apply(queue, {51: "not a strength"})
+        self.apply(queue, {51: 10})
+        self.assertEqual(self.agg.rssi(0), {51: 10.0})
+        self.assertEqual(self.agg.call(lambda db: 42), 42)
+        self.assertEqual(self.agg.stats()['errors'], 3) # one bad report, two listener calls
+
+    def test_call_errors(self):
+        def fail(db):
+            raise KeyError("nope")
+        self.assertRaises(KeyError, self.agg.call, fail)
+        self.agg.stop()
+        self.assertRaises(RuntimeError, self.agg.call, lambda db: 42)
+
+if __name__ == "__main__":
+    unittest.main()
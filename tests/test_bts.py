@@ -0,0 +1,110 @@
+"""
+This file is part of GSMWS.
+"""
+
+import os
+import sqlite3
+import sys
+import time
+import unittest
+
+import openbts
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import bts
+
+class Response(object):
+    def __init__(self, data):
+        self.data = data
+
+class FakeNodeManager(object):
+    """ read_config() like python-openbts's, failing whole-config reads with error """
+    def __init__(self, config, error=None):
+        self.config = config
+        self.error = error
+        self.reads = []
+
+    def read_config(self, key):
+        self.reads.append(key)
+        if key == "":
+            if self.error is not None:
+                raise self.error
+            return Response(dict((k, {'value': v}) for k, v in self.config.items()))
+        return Response({'value': self.config[key]})
+
+    def update_config(self, key, value):
+        self.config[key] = value
+        return Response({'value': value})
+
+class ConfigCacheTest(unittest.TestCase):
+    CONFIG = {"GSM.Radio.C0": "51", "GSM.Neighbors": ""}
+
+    def cache(self, error=None):
+        self.nm = FakeNodeManager(dict(self.CONFIG), error)
+        return bts.ConfigCache(self.nm, ttls={"GSM.Radio.C0": 60, "GSM.Neighbors": 60})
+
+    def test_prefetch(self):
+        cache = self.cache()
+        cache.prefetch()
+        self.assertEqual(cache.value("GSM.Radio.C0"), "51")
+        self.assertEqual(self.nm.reads, [""])
+        self.assertEqual(cache.stats()['saved_rpcs'], 0)
+
+    def test_prefetch_falls_back(self):
+        for error in [openbts.exceptions.TimeoutError("slow"),
+                      openbts.exceptions.InvalidResponseError("bad"),
+                      openbts.exceptions.InvalidRequestError("no")]:
+            cache = self.cache(error)
+            cache.prefetch()
+            self.assertEqual(sorted(self.nm.reads), ["", "GSM.Neighbors", "GSM.Radio.C0"])
+            self.assertEqual(cache.value("GSM.Radio.C0"), "51")
+            self.assertEqual(len(self.nm.reads), 3)
+
+    def test_update_invalidates(self):
+        cache = self.cache()
+        cache.prefetch()
+        cache.update("GSM.Radio.C0", "61")
+        self.assertEqual(cache.value("GSM.Radio.C0"), "61")
+        self.assertEqual(self.nm.reads, ["", "GSM.Radio.C0"])
+
+class SetNeighborsTest(unittest.TestCase):
+    def setUp(self):
+        # just what set_neighbors uses
+        self.bts = bts.BTS.__new__(bts.BTS)
+        self.bts.config = bts.ConfigCache(FakeNodeManager({"GSM.Neighbors": ""}))
+        self.bts.neighbor_table = sqlite3.connect(":memory:")
+        self.bts.neighbor_table.execute(
+            "CREATE TABLE NEIGHBOR_TABLE (IPADDRESS TEXT UNIQUE NOT NULL, UPDATED INTEGER, "
+            "HOLDOFF INTEGER DEFAULT 0, C0 INTEGER, BSIC INTEGER)")
+        self.bts.neighbor_table.executemany("INSERT INTO NEIGHBOR_TABLE (IPADDRESS) VALUES (?)",
+                                            [("127.0.10.%d:16001" % (i + 10),) for i in range(3)])
+        self.bts.neighbor_calls = self.bts.neighbor_config_writes = 0
+        self.bts.neighbor_config_skipped = 0
+        self.bts.neighbor_rows_written = self.bts.neighbor_rows_skipped = 0
+
+    def rows(self):
+        return self.bts.neighbor_table.execute(
+            "SELECT IPADDRESS, C0, UPDATED FROM NEIGHBOR_TABLE ORDER BY IPADDRESS").fetchall()
+
+    def test_writes_changes_only(self):
+        self.assertTrue(self.bts.set_neighbors([30, 40], ["10.0.0.2:16002"]))
+        self.assertEqual(self.bts.config.value("GSM.Neighbors"),
+                         "10.0.0.2:16002 127.0.10.10:16001 127.0.10.11:16001")
+        self.assertEqual([row[1] for row in self.rows()], [30, 40, None])
+        self.bts.set_neighbors([30, 50], ["10.0.0.2:16002"])
+        self.assertEqual([row[1] for row in self.rows()], [30, 50, None])
+        self.assertEqual(self.bts.neighbor_stats(),
+                         {'calls': 2, 'config_writes': 1, 'config_skipped': 1,
+                          'rows_written': 3, 'rows_skipped': 1})
+
+    def test_refreshes_old_rows(self):
+        self.bts.set_neighbors([30, 40])
+        old = int(time.time()) - bts.BTS.NEIGHBOR_REFRESH_TIME - 1
+        self.bts.neighbor_table.execute("UPDATE NEIGHBOR_TABLE SET UPDATED = ? "
+                                        "WHERE IPADDRESS = '127.0.10.10:16001'", (old,))
+        self.bts.set_neighbors([30, 40])
+        self.assertTrue(self.rows()[0][2] > old)
+        self.assertEqual(self.bts.neighbor_rows_written, 3)
+
+if __name__ == "__main__":
+    unittest.main()
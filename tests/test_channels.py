@@ -0,0 +1,78 @@
+"""
+This file is part of GSMWS.
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import channels, persist
+
+class ChannelStateTest(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(":memory:")
+        persist.init_gsmwsdb(self.db)
+        self.state = channels.ChannelState()
+
+    def save(self):
+        persist.save_avail_arfcns(self.db, *self.state.snapshot())
+
+    def avail(self):
+        return self.db.execute("SELECT ARFCN, TIMESTAMP, RSSI FROM AVAIL_ARFCN ORDER BY ARFCN").fetchall()
+
+    def test_snapshot_has_only_changes(self):
+        self.state.update({10: -1, 20: 5}, 100.0)
+        rows, expired_before = self.state.snapshot()
+        self.assertEqual(sorted(rows), [(10, 100.0, -1), (20, 100.0, 5)])
+        self.assertEqual(expired_before, None)
+        self.assertFalse(self.state.dirty)
+
+        self.state.update({20: 6}, 110.0)
+        self.assertEqual(self.state.snapshot(), ([(20, 110.0, 6)], None))
+
+    def test_save_and_load(self):
+        self.state.update({10: -1, 20: 5}, 100.0)
+        self.save()
+        self.state.update({20: 6, 30: -2}, 200.0)
+        self.assertEqual(self.state.expire(150.0), [10])
+        self.save()
+        self.assertEqual(self.avail(), [(20, 200.0, 6), (30, 200.0, -2)])
+
+        loaded = channels.ChannelState()
+        loaded.load(self.db)
+        self.assertEqual(loaded.arfcns(), [20, 30])
+        self.assertEqual(loaded.safe_arfcns(), [30])
+        self.assertEqual(loaded.snapshot(), ([], None))
+
+    def test_expired_then_seen_again(self):
+        self.state.update({10: -1}, 100.0)
+        self.save()
+        self.state.expire(150.0)
+        self.state.update({10: 3}, 200.0)
+        self.save()
+        self.assertEqual(self.avail(), [(10, 200.0, 3)])
+
+    def test_pick_unscanned_excludes(self):
+        rand = random.Random(1)
+        self.state.update(dict((a, 1) for a in range(1, 119)), 100.0) # 5 left unscanned
+        for _ in range(50):
+            picked = self.state.pick_unscanned(3, exclude=[119, 120, 7], rand=rand)
+            self.assertEqual(len(picked), 3)
+            self.assertEqual(set(picked), set([121, 122, 123]))
+        self.assertRaises(ValueError, self.state.pick_unscanned, 4, exclude=[119, 120], rand=rand)
+
+    def test_pick_unscanned_is_uniform(self):
+        rand = random.Random(2)
+        counts = dict((a, 0) for a in range(1, 124))
+        for _ in range(2000):
+            for a in self.state.pick_unscanned(5, exclude=range(1, 11), rand=rand):
+                counts[a] += 1
+        self.assertEqual(sum(counts[a] for a in range(1, 11)), 0)
+        picked = [counts[a] for a in range(11, 124)]
+        self.assertTrue(min(picked) > 40 and max(picked) < 140, picked)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+This file is part of GSMWS.
+"""
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import controller, fanout
+
+class FakeDecoder(object):
+    def __init__(self, gsmd):
+        self.gsmd = gsmd
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+class SlowBTS(object):
+    """ A BTS that takes db_loc seconds to come up """
+    made = {} # id_num -> the last one made
+
+    def __init__(self, db_loc, openbts_proc, trans_proc, loglvl, id_num, start_time):
+        time.sleep(db_loc)
+        SlowBTS.made[id_num] = self
+        self.id_num = id_num
+        self.current_arfcn = 10 * (id_num + 1)
+        self.offset_correct = True
+
+    def is_off(self):
+        return False
+
+    def init_decoder(self, gsmd):
+        self.decoder = FakeDecoder(gsmd)
+
+class SetupTest(unittest.TestCase):
+    def setUp(self):
+        # keep the controllers' basicConfig() from logging to /var/log
+        self.handler = logging.NullHandler()
+        logging.getLogger().addHandler(self.handler)
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.controller.units.close()
+        logging.getLogger().removeHandler(self.handler)
+        shutil.rmtree(self.dir)
+
+    def controller_for(self, delays, deadline):
+        SlowBTS.made.clear()
+        confs = [{'db_loc': delay, 'openbts_proc': None, 'trans_proc': None,
+                  'bts_class': SlowBTS, 'stream': None, 'start_cmd': None}
+                 for delay in delays]
+        c = controller.HandoverController(confs, 600, 10, 10, os.path.join(self.dir, "gsmws.db"),
+                                          deadline=deadline)
+        c.units = fanout.UnitPool(None, 4, deadline)
+        self.controller = c
+        return c
+
+    def test_late_unit_is_shut_down(self):
+        c = self.controller_for([0, 0.5], 0.2)
+        c.setup_bts()
+        self.assertEqual([b.id_num for b in c.bts_units], [0])
+        self.assertEqual(sorted(c.by_decoder), [0])
+        self.assertEqual(sorted(c.aggregator.queues), [0])
+
+        # it comes up later, and gets shut down rather than joining in
+        deadline = time.time() + 5
+        while time.time() < deadline and not hasattr(SlowBTS.made.get(1), 'decoder'):
+            time.sleep(0.01)
+        self.assertTrue(SlowBTS.made[1].decoder.stopped.wait(5))
+        self.assertEqual(sorted(c.aggregator.queues), [0])
+        self.assertEqual(c.made, {})
+        self.assertFalse(c.bts_units[0].decoder.stopped.is_set())
+
+        # and its reports, if any got through, are ignored
+        c.on_reports({1: time.time()})
+
+    def test_all_up(self):
+        c = self.controller_for([0, 0], 5)
+        c.setup_bts()
+        self.assertEqual(sorted(c.by_decoder), [0, 1])
+        self.assertEqual(c.abandoned, set())
+
+if __name__ == "__main__":
+    unittest.main()
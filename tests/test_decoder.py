@@ -0,0 +1,80 @@
+"""
+This file is part of GSMWS.
+"""
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import decoder
+
+class MeasurementReportListTest(unittest.TestCase):
+    def setUp(self):
+        self.reports = decoder.MeasurementReportList(maxlen=5)
+
+    def test_getall(self):
+        for i in range(3):
+            self.reports.put(i)
+        self.assertEqual(len(self.reports), 3)
+        self.assertEqual(self.reports.getall(), [0, 1, 2])
+        self.assertEqual(self.reports.getall(), [])
+        self.reports.put(3)
+        self.assertEqual(self.reports.get(), 3)
+        self.assertEqual(self.reports.get(), None)
+
+    def test_wraparound(self):
+        self.reports.put_many(range(4))
+        self.assertEqual(self.reports.getall(), [0, 1, 2, 3])
+        self.reports.put_many(range(4, 8)) # wraps
+        self.assertEqual(self.reports.ring, [5, 6, 7, 3, 4])
+        self.assertEqual(self.reports.getall(), [4, 5, 6, 7])
+        self.assertEqual(self.reports.first_seq(), 3)
+        self.assertEqual(self.reports.evicted, 3)
+
+    def test_put_many_over_maxlen(self):
+        self.reports.put(0)
+        self.reports.put_many(range(1, 13))
+        self.assertEqual(self.reports.next_seq, 13)
+        self.assertEqual(self.reports.evicted, 8)
+        self.assertEqual(self.reports.read(0), ([8, 9, 10, 11, 12], 13, 8))
+
+    def test_missed(self):
+        cursor = self.reports.cursor()
+        for i in range(8):
+            self.reports.put(i)
+        self.assertEqual(cursor.lag(), 5)
+        self.assertEqual(cursor.read(2), [3, 4])
+        self.assertEqual(cursor.missed, 3)
+        self.assertEqual(cursor.read(), [5, 6, 7])
+        self.assertEqual(cursor.missed, 3)
+
+    def test_cursors_are_independent(self):
+        self.reports.put_many([0, 1])
+        oldest = self.reports.cursor(oldest=True)
+        new = self.reports.cursor()
+        self.reports.put(2)
+        self.assertEqual(oldest.read(), [0, 1, 2])
+        self.assertEqual(new.read(), [2])
+        self.assertEqual(self.reports.getall(), [0, 1, 2])
+
+    def test_shared_cursor_across_threads(self):
+        reports = decoder.MeasurementReportList(maxlen=100000)
+        reports.put_many(range(20000))
+        got = [[] for _ in range(4)]
+        def drain(out):
+            while len(out) <= 20000: # more would mean duplicates
+                batch = reports.default.read(7)
+                if not batch:
+                    return
+                out.extend(batch)
+        threads = [threading.Thread(target=drain, args=(out,)) for out in got]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(sum(got, [])), range(20000))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+"""
+This file is part of GSMWS.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import estimator
+
+class RSSIEstimatorTest(unittest.TestCase):
+    def setUp(self):
+        self.est = estimator.RSSIEstimator(maxlen=3)
+
+    def check(self, arfcn, readings, top):
+        self.assertEqual(self.est.count(arfcn), len(readings))
+        self.assertEqual(self.est.max(arfcn), top)
+        self.assertAlmostEqual(self.est.mean(arfcn), sum(readings) / float(len(readings)))
+        self.assertAlmostEqual(self.est.rssi(arfcn),
+                               (top + sum(readings)) / float(1 + len(readings)))
+
+    def test_window(self):
+        for value in [10, 20, -0.001, 5]:
+            self.est.update({51: value})
+        self.check(51, [20, -0.001, 5], 20)
+
+    def test_forgets_what_a_report_leaves_out(self):
+        self.est.update({51: 10, 61: 3})
+        self.est.update({51: 12})
+        self.assertEqual(self.est.arfcns(), [51])
+        self.assertFalse(61 in self.est)
+
+    def test_out_of_band(self):
+        # DCS1800 neighbors get the same treatment as GSM900 ones
+        for value in [30, 10, 12, 14]:
+            self.est.update({51: value, 600: value})
+        self.check(51, [10, 12, 14], 30)
+        self.check(600, [10, 12, 14], 30)
+        self.assertEqual(sorted(self.est.rssis()), [51, 600])
+        self.assertEqual(self.est.add(600, 31), True)
+
+        self.est.update({51: 1})
+        self.assertFalse(600 in self.est)
+        self.assertEqual(self.est.arfcns(), [51])
+
+    def test_seed(self):
+        self.est.seed(51, 40, 10, 2)
+        self.est.seed(600, 40, 10, 2)
+        self.est.seed(700, 35)
+        self.check(51, [10, 10], 40)
+        self.check(600, [10, 10], 40)
+        self.assertEqual((self.est.max(700), self.est.count(700)), (35, 0))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+"""
+This file is part of GSMWS.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import gsm
+
+MR = gsm.MeasurementReport
+SI2 = gsm.SystemInformationTwo
+
+NEIGHBOR = """
+        ..01 0001 = RXLEV-NCELL: %d
+        0001 0... = BCCH-FREQ-NCELL: %d
+        .... .000  010. .... = BSIC-NCELL: %d"""
+
+def with_neighbors(*neighbors):
+    """ sample() reporting (RXLEV, BCCH-FREQ-NCELL, BSIC) for each neighbor after its own """
+    text = MR.sample().replace("result (1)", "result (%d)" % (len(neighbors) + 1))
+    return text + "".join(NEIGHBOR % n for n in neighbors)
+
+class ParseScanTest(unittest.TestCase):
+    def setUp(self):
+        self.last_arfcns = SI2(SI2.sample()).arfcns # 23 33 51 59 99
+        self.current_arfcn = 23
+
+    def parse(self, message, parser="scan"):
+        return MR(self.last_arfcns, self.current_arfcn, message, parser=parser)
+
+    def test_sample(self):
+        report = self.parse(MR.sample())
+        self.assertTrue(report.valid)
+        self.assertEqual(report.current_strengths, {23: 16, 33: -0.001, 51: 17, 59: -0.001, 99: -0.001})
+        self.assertEqual(report.current_bsics, {23: None, 33: None, 51: 2, 59: None, 99: None})
+
+    def test_agrees_with_regex(self):
+        # BSICs stay single digit, since parse() only keeps the first digit
+        for message in [MR.sample(), with_neighbors((30, 0, 5), (42, 4, 3))]:
+            expected = self.parse(message, "regex")
+            got = self.parse(message)
+            self.assertEqual(got.valid, expected.valid)
+            self.assertEqual(got.current_strengths, expected.current_strengths)
+            self.assertEqual(got.current_bsics, expected.current_bsics)
+
+    def test_own_arfcn_as_neighbor(self):
+        # a neighbor report for the serving ARFCN wins, and has no BSIC
+        report = self.parse(with_neighbors((30, 0, 5)))
+        self.assertEqual(report.current_strengths[23], 30)
+        self.assertEqual(report.current_bsics[23], None)
+
+    def test_multi_digit_bsic(self):
+        report = self.parse(with_neighbors((30, 3, 42)))
+        self.assertEqual(report.current_bsics[59], 42)
+
+    def test_neighbor_count_mismatch(self):
+        message = MR.sample().replace("result (1)", "result (2)")
+        report = self.parse(message)
+        self.assertFalse(report.valid)
+        self.assertEqual(report.current_strengths, {})
+
+    def test_no_serving_strength(self):
+        message = MR.sample().replace("RXLEV-FULL-SERVING-CELL", "RXLEV-FULL-SERVING")
+        self.assertFalse(self.parse(message).valid)
+
+    def test_no_neighbor_count(self):
+        message = MR.sample().replace("NO-NCELL-M", "NO-NCELL")
+        self.assertFalse(self.parse(message).valid)
+
+    def test_neighbor_index_out_of_range(self):
+        report = self.parse(with_neighbors((30, 9, 5)))
+        self.assertFalse(report.valid)
+        self.assertEqual((report.current_strengths, report.current_bsics), ({}, {}))
+
+def sacch_packet(l3, arfcn=51):
+    """ l3 on the uplink SACCH, the way OpenBTS sends measurement reports """
+    lapdm = b"\x00\x00\x01\x03" + bytes(bytearray([(len(l3) << 2) | 1]))
+    return gsm.encode_gsmtap(arfcn, gsm.GSMTAP_CHANNEL_SDCCH4 | gsm.GSMTAP_CHANNEL_ACCH,
+                             lapdm + l3, uplink=True)
+
+def set_bits(data, offset, width, value):
+    """ data with the (offset, width) bitfield after its first two octets set to value """
+    data = bytearray(data)
+    for i in range(width):
+        bit = 16 + offset + i
+        mask = 0x80 >> (bit % 8)
+        if (value >> (width - 1 - i)) & 1:
+            data[bit // 8] |= mask
+        else:
+            data[bit // 8] &= ~mask & 0xff
+    return bytes(data)
+
+class BinaryDecodeTest(unittest.TestCase):
+    def setUp(self):
+        self.last_arfcns = SI2(SI2.sample()).arfcns
+        self.current_arfcn = 23
+
+    def test_gsmtap_header(self):
+        gsmtap = gsm.GSMTAP(sacch_packet(MR.sample_bytes()), parser="binary")
+        self.assertEqual(gsmtap.arfcn, 51)
+        self.assertTrue(gsmtap.uplink)
+        self.assertEqual(gsmtap.sub_type, gsm.GSMTAP_CHANNEL_SDCCH4 | gsm.GSMTAP_CHANNEL_ACCH)
+        self.assertEqual(gsmtap.l3(), MR.sample_bytes())
+        self.assertEqual(gsmtap.message_type(), (gsm.RR_PROTOCOL, gsm.RR_MEASUREMENT_REPORT))
+
+    def test_bcch(self):
+        packet = gsm.encode_gsmtap(23, gsm.GSMTAP_CHANNEL_BCCH, b"\x59" + SI2.sample_bytes())
+        gsmtap = gsm.GSMTAP(packet, parser="binary")
+        self.assertFalse(gsmtap.uplink)
+        self.assertEqual(gsmtap.l3(), SI2.sample_bytes())
+        self.assertEqual(gsmtap.message_type(), (gsm.RR_PROTOCOL, gsm.RR_SYSTEM_INFORMATION_2))
+
+    def test_not_um(self):
+        packet = bytearray(sacch_packet(MR.sample_bytes()))
+        packet[2] = 0x02
+        self.assertRaises(ValueError, gsm.GSMTAP, bytes(packet), parser="binary")
+
+    def test_short_payload(self):
+        packet = gsm.encode_gsmtap(51, gsm.GSMTAP_CHANNEL_SDCCH4 | gsm.GSMTAP_CHANNEL_ACCH, b"\x00")
+        gsmtap = gsm.GSMTAP(packet, parser="binary")
+        self.assertEqual(gsmtap.l3(), "")
+        self.assertEqual(gsmtap.message_type(), (None, None))
+
+    def test_system_information_2(self):
+        expected = SI2(SI2.sample())
+        got = SI2(SI2.sample_bytes(), parser="binary")
+        self.assertEqual(got.arfcns, expected.arfcns)
+        self.assertEqual(got.ncc_permitted, expected.ncc_permitted)
+        self.assertRaises(ValueError, SI2, SI2.sample_bytes()[:10], parser="binary")
+
+    def test_measurement_report(self):
+        expected = MR(self.last_arfcns, self.current_arfcn, MR.sample())
+        got = MR(self.last_arfcns, self.current_arfcn, MR.sample_bytes(), parser="binary")
+        self.assertTrue(got.valid)
+        self.assertEqual(got.current_strengths, expected.current_strengths)
+        self.assertEqual(got.current_bsics, expected.current_bsics)
+
+    def test_neighbor_info_not_available(self):
+        message = set_bits(MR.sample_bytes(), 23, 3, 7)
+        self.assertFalse(MR(self.last_arfcns, self.current_arfcn, message, parser="binary").valid)
+
+    def test_short_report(self):
+        message = MR.sample_bytes()[:10]
+        self.assertFalse(MR(self.last_arfcns, self.current_arfcn, message, parser="binary").valid)
+
+    def test_neighbor_index_out_of_range(self):
+        message = set_bits(MR.sample_bytes(), 26 + 6, 5, 9)
+        report = MR(self.last_arfcns, self.current_arfcn, message, parser="binary")
+        self.assertFalse(report.valid)
+        self.assertEqual((report.current_strengths, report.current_bsics), ({}, {}))
+
+class CompactReportTest(unittest.TestCase):
+    def test_reads_like_the_dict(self):
+        report = MR(SI2(SI2.sample()).arfcns, 23, MR.sample())
+        compact = gsm.CompactReport.from_report(report)
+        self.assertEqual(dict(compact.items()), report.current_strengths)
+        self.assertEqual(sorted(compact), sorted(report.current_strengths))
+        self.assertEqual(len(compact), 5)
+        for arfcn in report.current_bsics:
+            self.assertEqual(compact.bsic(arfcn), report.current_bsics[arfcn])
+        self.assertFalse(60 in compact)
+        self.assertRaises(KeyError, lambda: compact[60])
+        self.assertEqual(compact.get(60, "x"), "x")
+        self.assertEqual(compact.bsic(60), None)
+
+    def test_set(self):
+        compact = gsm.CompactReport({30: 5}, {30: 2})
+        compact.set(124, 63, 7)
+        compact.set(0, -0.001)
+        compact.set(30, 6)
+        self.assertEqual(compact.items(), [(0, -0.001), (30, 6), (124, 63)])
+        self.assertEqual([compact.bsic(a) for a in compact], [None, None, 7])
+
+    def test_out_of_band(self):
+        self.assertRaises(ValueError, gsm.CompactReport, {512: 10})
+        self.assertFalse(512 in gsm.CompactReport({1: 10}))
+
+if __name__ == "__main__":
+    unittest.main()
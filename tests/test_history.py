@@ -0,0 +1,118 @@
+"""
+This file is part of GSMWS.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import gsm, history
+
+# raw: 10 samples or a minute per segment, kept for 10 minutes (so at most
+# 11 segments); 1m: 10 minute segments, kept for an hour
+TIERS = (history.Tier("raw", 0, 60, 600, 10),
+         history.Tier("1m", 60, 600, 3600, 20))
+
+class HistoryStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = history.HistoryStore(self.dir, TIERS)
+        # a few minutes ago, on a minute boundary
+        self.t0 = (int(time.time()) // 60 - 5) * 60
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def segments(self, tier, arfcn):
+        return sorted(os.listdir(os.path.join(self.dir, tier, str(arfcn))))
+
+    def test_query_across_segments(self):
+        for i in range(20):
+            self.store.append(51, i, self.t0 + i * 10)
+        self.assertEqual(len(self.segments("raw", 51)), 4) # one a minute
+        res = self.store.query(51, self.t0 + 15, self.t0 + 125, "raw")
+        self.assertEqual(res['tier'], "raw")
+        self.assertEqual(res['time'], [self.t0 + i * 10 for i in range(2, 13)])
+        self.assertEqual(list(res['value']), range(2, 13))
+        self.assertEqual(self.store.query(61, self.t0, self.t0 + 200, "raw")['time'], [])
+
+    def test_rollups_leave_out_not_heard(self):
+        for offset, value in [(0, 10), (10, -0.001), (20, 20), # minute 0
+                              (60, -0.001), # minute 1, nothing heard
+                              (120, 5)]: # minute 2, still in memory
+            self.store.append(51, value, self.t0 + offset)
+        res = self.store.query(51, self.t0, self.t0 + 180, "1m")
+        self.assertEqual(res['time'], [self.t0, self.t0 + 60, self.t0 + 120])
+        self.assertEqual(list(res['min']), [10, -1, 5])
+        self.assertEqual(list(res['max']), [20, -1, 5])
+        self.assertEqual(list(res['count']), [3, 1, 1])
+        self.assertEqual(list(res['heard']), [2, 0, 1])
+        self.assertEqual(list(res['sum']), [30, 0, 5])
+        self.assertEqual(res['mean'], [15.0, None, 5.0])
+
+    def test_append_report(self):
+        report = gsm.CompactReport({51: 30, 61: -0.001}, timestamp=self.t0)
+        self.store.append_report(report)
+        self.assertEqual(list(self.store.query(51, self.t0, self.t0 + 1, "raw")['value']), [30])
+        self.assertEqual(list(self.store.query(61, self.t0, self.t0 + 1, "raw")['value']),
+                         [history.NOT_HEARD])
+
+    def test_out_of_band(self):
+        self.store.append_report({51: 30, 600: 20, -1: 5}, timestamp=self.t0)
+        self.store.append(124, 10, self.t0)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.dir, "raw"))), ["124", "51"])
+        self.assertEqual(self.store.stats()['out_of_band'], 2)
+        per_arfcn = sum(t.max_segments * t.segment_size() for t in TIERS)
+        self.assertEqual(self.store.max_disk(), 125 * per_arfcn)
+
+    def test_out_of_order(self):
+        self.store.append(51, 1, self.t0 + 10)
+        self.store.append(51, 2, self.t0 + 5) # recorded at the last one's time
+        res = self.store.query(51, self.t0, self.t0 + 60, "raw")
+        self.assertEqual(res['time'], [self.t0 + 10, self.t0 + 10])
+
+    def test_max_segments_falls_back(self):
+        # a reading a second fills a raw segment every 10s, so max_segments
+        # cuts the raw tier well short of its retention
+        for i in range(150):
+            self.store.append(51, 7, self.t0 + i)
+        self.assertEqual(len(self.segments("raw", 51)), TIERS[0].max_segments)
+        now = self.t0 + 150
+        self.assertEqual(self.store.pick_tier(self.t0, now).name, "raw")
+        self.assertEqual(self.store.pick_tier(self.t0, now, arfcn=51).name, "1m")
+        self.assertEqual(self.store.pick_tier(now - 30, now, arfcn=51).name, "raw")
+        res = self.store.query(51, self.t0)
+        self.assertEqual(res['tier'], "1m")
+        self.assertEqual(sum(res['count']), 150)
+        # ARFCNs we've no raw samples for, or too few to be capped, use raw
+        self.assertEqual(self.store.query(61, self.t0)['tier'], "raw")
+
+    def test_retention(self):
+        for minute in range(15):
+            self.store.append(51, 3, self.t0 - 3600 + minute * 60)
+        segments = self.segments("raw", 51)
+        self.assertEqual(len(segments), 11)
+        self.assertEqual(int(segments[0][:-4]), (self.t0 - 3600 + 4 * 60) * 1000)
+
+    def test_reopen(self):
+        for i in range(5):
+            self.store.append(51, i, self.t0 + i)
+        self.store.close()
+        reader = history.HistoryStore(self.dir, TIERS)
+        self.assertEqual(list(reader.query(51, self.t0, self.t0 + 60, "raw")['value']), range(5))
+        res = reader.query(51, self.t0, self.t0 + 60, "1m")
+        self.assertEqual((list(res['count']), res['mean']), ([5], [2.0]))
+
+        # carries on after what's there, in time order
+        reader.append(51, 9, self.t0)
+        res = reader.query(51, self.t0, self.t0 + 60, "raw")
+        self.assertEqual((res['time'][-1], res['value'][-1]), (self.t0 + 4, 9))
+        reader.close()
+
+if __name__ == "__main__":
+    unittest.main()
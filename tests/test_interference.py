@@ -0,0 +1,74 @@
+"""
+This file is part of GSMWS.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import interference
+
+class FakeBTS(object):
+    def __init__(self, off=False):
+        self.off = off
+
+    def is_off(self):
+        return self.off
+
+class InterferenceDetectorTest(unittest.TestCase):
+    def setUp(self):
+        self.detector = interference.InterferenceDetector(threshold=10, hysteresis=3)
+        self.bts = FakeBTS()
+        self.detector.watch(self.bts, 51, off=False)
+
+    def test_restart_when_off(self):
+        self.bts.off = True
+        self.detector.refresh(self.bts)
+        self.assertEqual(self.detector.observe({51: 20}), [self.bts])
+
+    def test_no_restart_when_on(self):
+        self.assertEqual(self.detector.observe({51: 20}), [])
+
+    def test_one_restart_per_event(self):
+        self.detector.set_off(self.bts, True)
+        self.assertEqual(self.detector.observe({51: 20}), [self.bts])
+        self.assertEqual(self.detector.observe({51: 20}), [])
+        self.assertEqual(self.detector.observe({51: 8}), []) # within hysteresis
+        self.assertEqual(self.detector.observe({51: 20}), [])
+        self.assertEqual(self.detector.observe({51: 6}), [])
+        self.assertEqual(self.detector.observe({51: 20}), [self.bts])
+
+    def test_own_signal_then_off(self):
+        # while on, our own signal makes the ARFCN hot; interference still
+        # there once we go off should restart us
+        self.assertEqual(self.detector.observe({51: 40}), [])
+        self.detector.set_off(self.bts, True)
+        self.assertEqual(self.detector.observe({51: 20}), [self.bts])
+
+    def test_own_signal_then_refresh_off(self):
+        self.assertEqual(self.detector.observe({51: 40}), [])
+        self.bts.off = True
+        self.assertTrue(self.detector.refresh(self.bts))
+        self.assertEqual(self.detector.observe({51: 20}), [self.bts])
+
+    def test_staying_off_keeps_hysteresis(self):
+        self.detector.set_off(self.bts, True)
+        self.assertEqual(self.detector.observe({51: 20}), [self.bts])
+        self.detector.set_off(self.bts, True)
+        self.assertEqual(self.detector.observe({51: 20}), [])
+
+    def test_watch_moves(self):
+        self.detector.set_off(self.bts, True)
+        self.detector.watch(self.bts, 61)
+        self.assertEqual(self.detector.observe({51: 20}), [])
+        self.assertEqual(self.detector.observe({61: 20}), [self.bts])
+
+    def test_per_arfcn_threshold(self):
+        self.detector.set_off(self.bts, True)
+        self.detector.set_threshold(51, 30)
+        self.assertEqual(self.detector.observe({51: 20}), [])
+        self.assertEqual(self.detector.observe({51: 31}), [self.bts])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+"""
+This file is part of GSMWS.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import metrics
+
+class MetricTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_children(self):
+        counter = self.registry.counter("reports_total", "Reports", labels=("type",))
+        counter.labels("mr").inc()
+        counter.labels("mr").inc(2)
+        self.assertTrue(isinstance(counter.labels("mr"), metrics.CounterChild))
+        gauge = self.registry.gauge("depth", "Depth")
+        gauge.set(4)
+        self.assertEqual(gauge.get(), 4)
+        self.assertEqual(self.registry.text(),
+                         "# HELP depth Depth\n# TYPE depth gauge\ndepth 4\n"
+                         "# HELP reports_total Reports\n# TYPE reports_total counter\n"
+                         'reports_total{type="mr"} 3\n')
+
+    def test_histogram_buckets(self):
+        hist = self.registry.histogram("latency", "Latency", labels=("op",), buckets=(1, 0.5))
+        hist.labels("a").observe(0.7)
+        child = hist.labels("b")
+        self.assertEqual(child.buckets, (0.5, 1))
+        self.assertEqual(hist.labels("a").counts, [0, 1, 0])
+
+    def test_new_child(self):
+        metric = metrics.Metric("custom", "Custom", new_child=metrics.GaugeChild)
+        self.assertTrue(isinstance(metric.children[()], metrics.GaugeChild))
+        self.assertRaises(TypeError, metrics.Metric, "bare", "No children")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+"""
+This file is part of GSMWS.
+"""
+
+import datetime
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import persist
+
+class WriteBehindStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "gsmws.db")
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            if not store.stopped.is_set():
+                store.close()
+        shutil.rmtree(self.dir)
+
+    def store(self, **options):
+        store = persist.WriteBehindStore(self.path, **options)
+        persist.init_gsmwsdb(store.db)
+        self.stores.append(store)
+        return store
+
+    def rows(self, table):
+        store = self.store()
+        return store.execute("SELECT * FROM %s ORDER BY ARFCN" % table)
+
+    def test_coalesces_until_flush(self):
+        store = self.store(flush_interval=3600)
+        for rssi in range(10):
+            store.put("MAX_STRENGTHS", 51, ("t%d" % rssi, 51, rssi))
+        store.put("MAX_STRENGTHS", 61, ("t", 61, 20))
+        self.assertEqual(self.rows("MAX_STRENGTHS"), [])
+        self.assertEqual(store.dirty(), 2)
+        store.flush()
+        self.assertEqual(self.rows("MAX_STRENGTHS"), [("t9", 51, 9), ("t", 61, 20)])
+        stats = store.stats()
+        self.assertEqual((stats['flushes'], stats['rows_written'], stats['rows_coalesced']),
+                         (1, 2, 9))
+
+    def test_delete(self):
+        store = self.store(flush_interval=3600)
+        store.put("MAX_STRENGTHS", 51, ("t", 51, 9))
+        store.flush()
+        store.put("MAX_STRENGTHS", 51, ("t", 51, 10))
+        store.delete("MAX_STRENGTHS", 51)
+        store.flush()
+        self.assertEqual(self.rows("MAX_STRENGTHS"), [])
+
+    def test_max_dirty(self):
+        store = self.store(flush_interval=3600, max_dirty=3)
+        store.put("MAX_STRENGTHS", 1, ("t", 1, 1))
+        store.put("MAX_STRENGTHS", 2, ("t", 2, 1))
+        self.assertEqual(store.stats()['flushes'], 0)
+        store.put("MAX_STRENGTHS", 3, ("t", 3, 1))
+        self.assertEqual(store.stats()['flushes'], 1)
+        self.assertEqual(len(self.rows("MAX_STRENGTHS")), 3)
+
+    def test_close_flushes(self):
+        store = self.store(flush_interval=3600)
+        store.start()
+        store.put("AVG_STRENGTHS", 51, ("t", 51, 9.5, 4))
+        store.close()
+        self.assertEqual(self.rows("AVG_STRENGTHS"), [("t", 51, 9.5, 4)])
+
+    def test_interval_zero_commits_per_report(self):
+        store = self.store(flush_interval=0)
+        for report in range(3):
+            for arfcn in (51, 61, 71):
+                store.put("MAX_STRENGTHS", arfcn, ("t", arfcn, report))
+            self.assertEqual(store.stats()['flushes'], report)
+            store.maybe_flush()
+        self.assertEqual(store.stats()['flushes'], 3)
+        self.assertEqual(self.rows("MAX_STRENGTHS"), [("t", 51, 2), ("t", 61, 2), ("t", 71, 2)])
+
+    def test_background_flush(self):
+        store = self.store(flush_interval=0.05)
+        store.start()
+        store.put("MAX_STRENGTHS", 51, ("t", 51, 9))
+        store.stopped.wait(0.5)
+        self.assertEqual(store.stats()['flushes'], 1)
+
+class MigrationTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = sqlite3.connect(os.path.join(self.dir, "gsmws.db"))
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.dir)
+
+    def version_0(self, rows):
+        """ AVAIL_ARFCN the way the original controller made and filled it """
+        self.db.execute("CREATE TABLE AVAIL_ARFCN (TIMESTAMP TEXT NOT NULL, ARFCN INTEGER, RSSI REAL);")
+        self.db.executemany("INSERT INTO AVAIL_ARFCN VALUES(?,?,?)", rows)
+        self.db.commit()
+
+    def avail(self):
+        return self.db.execute("SELECT ARFCN, TIMESTAMP, RSSI FROM AVAIL_ARFCN ORDER BY ARFCN").fetchall()
+
+    def test_fresh(self):
+        persist.init_gsmwsdb(self.db)
+        self.assertEqual(self.db.execute("PRAGMA user_version").fetchone()[0], persist.SCHEMA_VERSION)
+        self.assertEqual(self.avail(), [])
+
+    def test_migrate_v1(self):
+        old = datetime.datetime(2014, 3, 1, 12, 0, 0, 500000)
+        self.version_0([(old, 51, 20.0),
+                        (old + datetime.timedelta(seconds=60), 51, 30.0), # newest wins
+                        (old.replace(microsecond=0), 61, -1.0), # str() drops zero microseconds
+                        ("yesterday", 71, 5.0)]) # dropped
+        persist.init_gsmwsdb(self.db)
+        epoch = time.mktime(old.timetuple()) + 0.5
+        self.assertEqual(self.avail(), [(51, epoch + 60, 30.0), (61, epoch - 0.5, -1.0)])
+        self.assertEqual(self.db.execute("PRAGMA user_version").fetchone()[0], 1)
+
+        # keyed on ARFCN now, and the index is there
+        self.db.execute("INSERT OR REPLACE INTO AVAIL_ARFCN VALUES (51, 1.0, 2.0)")
+        self.assertEqual(self.avail()[0], (51, 1.0, 2.0))
+        indexes = [row[1] for row in self.db.execute("PRAGMA index_list(AVAIL_ARFCN)")]
+        self.assertTrue("AVAIL_ARFCN_TIMESTAMP" in indexes)
+
+    def test_migrate_once(self):
+        self.version_0([(datetime.datetime(2014, 3, 1), 51, 20.0)])
+        persist.init_gsmwsdb(self.db)
+        self.db.execute("INSERT INTO AVAIL_ARFCN VALUES (61, 1.0, 2.0)")
+        self.db.commit()
+        persist.init_gsmwsdb(self.db)
+        self.assertEqual([row[0] for row in self.avail()], [51, 61])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+This file is part of GSMWS.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gsmws import gsm, scheduler
+
+class ScanSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.sched = scheduler.ScanScheduler(range(1, 21))
+
+    def test_leases_are_exclusive(self):
+        picks = [self.sched.assign(bts_id, 6) for bts_id in range(3)]
+        picked = sum(picks, [])
+        self.assertEqual([len(p) for p in picks], [6, 6, 6])
+        self.assertEqual(len(set(picked)), 18)
+        # only two left for a fourth BTS
+        self.assertEqual(sorted(self.sched.assign(3, 6)), sorted(set(range(1, 21)) - set(picked)))
+        self.assertEqual(self.sched.assign(4, 6), [])
+
+    def test_reassign_releases(self):
+        first = self.sched.assign(0, 10)
+        second = self.sched.assign(1, 10)
+        self.assertEqual(set(first) & set(second), set())
+        # BTS 0's old channels are free again; BTS 1's still aren't
+        again = self.sched.assign(0, 20)
+        self.assertEqual(sorted(again), sorted(first))
+        self.sched.release(1)
+        self.assertEqual(sorted(self.sched.assign(2, 20)), sorted(second))
+
+    def test_exclude(self):
+        picked = self.sched.assign(0, 20, exclude=[1, 2, 3])
+        self.assertEqual(sorted(picked), range(4, 21))
+        self.assertEqual(self.sched.leases.get(1), None)
+
+    def test_unscanned_then_stalest(self):
+        for arfcn in range(1, 21):
+            if arfcn != 7:
+                for i in range(10):
+                    self.sched.observe({arfcn: 5}, 1000.0 + arfcn)
+        self.assertEqual(self.sched.assign(0, 3), [7, 1, 2])
+
+    def test_observe_report(self):
+        self.sched.assign(0, 20)
+        report = gsm.CompactReport({3: 20, 5: -0.001})
+        self.sched.observe(report, 1000.0)
+        self.assertEqual(sorted(self.sched.last_seen), [3, 5])
+        self.assertEqual(self.sched.samples[3][1], 20)
+        self.assertEqual(self.sched.samples[5][1], -0.001)
+        coverage = self.sched.coverage(1000.0)
+        self.assertEqual((coverage['verifications'], coverage['distinct_verified']), (2, 2))
+        self.assertEqual(self.sched.coverage(1000.0 + 2 * self.sched.window)['verifications'], 0)
+
+if __name__ == "__main__":
+    unittest.main()